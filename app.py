@@ -1,23 +1,18 @@
 import dash
-from dash import dcc, html, Input, Output, State, dash_table, callback_context
+from dash import dcc, html, Input, Output, State, Patch, dash_table, callback_context
 import dash_bootstrap_components as dbc
-import plotly.graph_objects as go
-from datetime import datetime, timedelta
-import time
+from flask import Response, request, stream_with_context
+from datetime import datetime
 import logging
-import threading
-from threading import Lock
-import RPi.GPIO as GPIO
-from pathlib import Path
-import json
-from selenium import webdriver
-from selenium.webdriver.chrome.service import Service
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.common.exceptions import NoSuchElementException
-from apscheduler.schedulers.background import BackgroundScheduler
-from apscheduler.triggers.cron import CronTrigger
+import os
+import time
+import forecastCache
+import forecastChart
+import metrics
+import usageChart
+import controlDaemon
+import valveJournal
+from jobQueue import JobQueue
 
 # Configure logging
 logging.basicConfig(
@@ -25,148 +20,45 @@ logging.basicConfig(
     format='%(asctime)s - %(levelname)s - %(message)s'
 )
 
-# Initialize GPIO
-GPIO.setmode(GPIO.BCM)
-GPIO.setwarnings(False)
-
 # Valve configuration
-VALVE_NAMES = ["Patio", "Flowers", "Fig", "Apple"]
-VALVE_PINS = [17, 18, 27, 22]  # BCM numbering
-RELAY_ACTIVE = GPIO.LOW  # Change to GPIO.HIGH if your relays activate on HIGH
-
-# Weather thresholds
-HOT_WEATHER_EXTRA = 1.5  # Multiplier for watering when >85°F
-
-# Initialize all valves to OFF state
-for pin in VALVE_PINS:
-    GPIO.setup(pin, GPIO.OUT)
-    GPIO.output(pin, GPIO.HIGH if RELAY_ACTIVE == GPIO.LOW else GPIO.LOW)
-
-# Track system state
-valve_states = [False] * len(VALVE_NAMES)
-watering_history = []
-history_lock = Lock()
+VALVE_NAMES = controlDaemon.VALVE_NAMES
+SCHEDULE_FILE = controlDaemon.SCHEDULE_FILE
+
+# Relays, schedule and history live in the control daemon when one is running;
+# otherwise this process owns them (single-process mode)
+control = controlDaemon.connect()
+if control is None:
+    logging.warning(f"No control daemon at {controlDaemon.SOCKET_PATH} - controlling valves in-process")
+    try:
+        control = controlDaemon.ControlService()
+    except valveJournal.JournalBusy:
+        # Another dashboard worker or a cron run owns the relays; show, don't drive
+        logging.warning("Valves are driven by another process - dashboard is read-only")
+        control = controlDaemon.ReadOnlyService()
+else:
+    logging.info(f"Using control daemon at {controlDaemon.SOCKET_PATH}")
+
+jobs = JobQueue()
 weather_data = {
     'next_high_temp': 75,
     'forecast_data': []
 }
 
-SCHEDULE_FILE = "schedules.json"
-DEFAULT_SCHEDULE = {
-    "weekly": {
-        "Sunday": {"Patio": 30, "Flowers": 15, "Fig": 20, "Apple": 25},
-        "Monday": {"Patio": 20, "Flowers": 20, "Fig": 15, "Apple": 20},
-        "Tuesday": {"Patio": 20, "Flowers": 15, "Fig": 20, "Apple": 25},
-        "Wednesday": {"Patio": 25, "Flowers": 20, "Fig": 15, "Apple": 20},
-        "Thursday": {"Patio": 20, "Flowers": 15, "Fig": 20, "Apple": 25},
-        "Friday": {"Patio": 30, "Flowers": 20, "Fig": 15, "Apple": 20},
-        "Saturday": {"Patio": 40, "Flowers": 25, "Fig": 30, "Apple": 40}
-    },
-    "special": {}
-}
-
-# Ensure schedule file exists
-if not Path(SCHEDULE_FILE).exists():
-    with open(SCHEDULE_FILE, 'w') as f:
-        json.dump(DEFAULT_SCHEDULE, f, indent=2)
-
-# Initialize scheduler
-scheduler = BackgroundScheduler(daemon=True)
-scheduler.start()
-
 # Utility functions
 def load_schedule():
     """Load schedule from JSON file"""
-    try:
-        with open(SCHEDULE_FILE, 'r') as f:
-            return json.load(f)
-    except Exception as e:
-        logging.error(f"Error loading schedule: {str(e)}")
-        return DEFAULT_SCHEDULE
+    return controlDaemon.load_schedule()
 
 def control_valve(valve_idx, state, duration_min=10):
-    """Control a single valve with safety checks and timed shutoff"""
+    """Turn a valve on with a timed shutoff, or off immediately"""
     try:
-        pin = VALVE_PINS[valve_idx]
         if state:
-            # Cancel any existing timer for this valve
-            if hasattr(control_valve, f"timer_{valve_idx}"):
-                old_timer = getattr(control_valve, f"timer_{valve_idx}")
-                if old_timer and old_timer.is_alive():
-                    old_timer.cancel()
-            
-            # Turn valve ON
-            GPIO.output(pin, RELAY_ACTIVE)
-            valve_states[valve_idx] = True
-            
-            # Log watering event
-            with history_lock:
-                weather_condition = "Hot" if weather_data['next_high_temp'] > 85 else "Normal"
-                watering_history.append({
-                    'time': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                    'zone': VALVE_NAMES[valve_idx],
-                    'duration': duration_min,
-                    'weather': weather_condition
-                })
-            
-            # Start timer to turn off
-            timer = threading.Timer(duration_min * 60, lambda: control_valve(valve_idx, False))
-            timer.start()
-            setattr(control_valve, f"timer_{valve_idx}", timer)
-            
-            logging.info(f"Valve {VALVE_NAMES[valve_idx]} ON for {duration_min} minutes")
+            control.turn_on(valve_idx=valve_idx, duration_min=duration_min)
         else:
-            # Turn valve OFF
-            GPIO.output(pin, GPIO.HIGH if RELAY_ACTIVE == GPIO.LOW else GPIO.LOW)
-            valve_states[valve_idx] = False
-            
-            # Cancel any running timer
-            if hasattr(control_valve, f"timer_{valve_idx}"):
-                timer = getattr(control_valve, f"timer_{valve_idx}")
-                if timer and timer.is_alive():
-                    timer.cancel()
-            
-            logging.info(f"Valve {VALVE_NAMES[valve_idx]} OFF")
+            control.turn_off(valve_idx=valve_idx)
     except Exception as e:
         logging.error(f"Error controlling valve {VALVE_NAMES[valve_idx]}: {str(e)}")
 
-def run_scheduled_watering():
-    """Run the scheduled watering for today"""
-    try:
-        logging.info("Running scheduled watering")
-        weather = get_weather_forecast()
-        schedules = load_schedule()
-        
-        today = datetime.now().strftime("%A")
-        day_schedule = schedules['weekly'].get(today, {})
-        
-        # Apply weather adjustments
-        for zone, duration in day_schedule.items():
-            if weather['next_high_temp'] > 85:
-                day_schedule[zone] = int(duration * HOT_WEATHER_EXTRA)
-        
-        # Water each zone sequentially
-        for zone_idx, zone_name in enumerate(VALVE_NAMES):
-            if zone_name in day_schedule and day_schedule[zone_name] > 0:
-                control_valve(zone_idx, True, day_schedule[zone_name])
-                time.sleep(15)  # Short break between zones
-        
-    except Exception as e:
-        logging.error(f"Error in scheduled watering: {str(e)}")
-
-def schedule_daily_watering():
-    """Schedule the daily watering job at 6 AM"""
-    trigger = CronTrigger(hour=6, minute=0)
-    scheduler.add_job(
-        run_scheduled_watering,
-        trigger=trigger,
-        name="daily_watering"
-    )
-    logging.info("Scheduled daily watering at 6:00 AM")
-
-# Initialize the daily watering schedule
-schedule_daily_watering()
-
 # Initialize Dash app
 app = dash.Dash(__name__, external_stylesheets=[dbc.themes.BOOTSTRAP])
 app.title = "Smart Irrigation Dashboard"
@@ -179,7 +71,7 @@ controls_card = dbc.Card([
             dbc.Button(
                 f"{name}",
                 id=f"btn-{i}",
-                color="danger" if valve_states[i] else "primary",
+                color="primary",
                 className="m-1",
                 style={"width": "100px"}
             ) for i, name in enumerate(VALVE_NAMES)
@@ -218,16 +110,11 @@ weather_card = dbc.Card([
     dbc.CardBody([
         dcc.Interval(id="weather-update", interval=3600000),
         html.Div(id="weather-summary"),
-        dcc.Graph(
-            id="forecast-graph",
-            config={
-                'displayModeBar': False,
-                'staticPlot': True,      
-                'scrollZoom': False,
-                'doubleClick': False,
-            }
-        ),
-        dbc.Button("Update Now", id="update-weather", color="info", className="mt-2")
+        html.Img(id="forecast-graph", alt="Weather forecast", style={'width': '100%'}),
+        dbc.Button("Update Now", id="update-weather", color="info", className="mt-2"),
+        html.Small(id="weather-job-status", className="ms-2 text-muted"),
+        dcc.Interval(id="job-poll", interval=1000, disabled=True),
+        dcc.Store(id="weather-job")
     ])
 ])
 
@@ -282,15 +169,37 @@ history_card = dbc.Card([
                 {'name': 'Time', 'id': 'time'},
                 {'name': 'Zone', 'id': 'zone'},
                 {'name': 'Duration (min)', 'id': 'duration'},
-                {'name': 'Weather', 'id': 'weather'}
+                {'name': 'Weather', 'id': 'weather'},
+                {'name': 'Litres', 'id': 'litres', 'type': 'numeric'}
             ],
+            page_current=0,
             page_size=10,
-            style_table={'overflowX': 'auto'},
-            filter_action='native'
+            page_action='custom',
+            sort_action='custom',
+            sort_mode='single',
+            sort_by=[],
+            filter_action='custom',
+            filter_query='',
+            style_table={'overflowX': 'auto'}
         )
     ])
 ])
 
+usage_card = dbc.Card([
+    dbc.CardHeader("Water Usage", className="bg-info text-white"),
+    dbc.CardBody([
+        dbc.RadioItems(
+            id="usage-period",
+            options=[{'label': 'Days', 'value': 'day'},
+                     {'label': 'Weeks', 'value': 'week'},
+                     {'label': 'Months', 'value': 'month'}],
+            value='day',
+            inline=True
+        ),
+        html.Img(id="usage-graph", alt="Watering per zone", style={'width': '100%'})
+    ])
+])
+
 app.layout = dbc.Container([
     html.H1("Smart Irrigation Control System", className="text-center my-4"),
     dbc.Row([
@@ -301,142 +210,155 @@ app.layout = dbc.Container([
     dbc.Row([
         dbc.Col(schedule_card, md=6),
         dbc.Col(history_card, md=6)
+    ], className="mb-4"),
+    dbc.Row([
+        dbc.Col(usage_card, md=6)
     ]),
-    dcc.Interval(id="status-update", interval=10000),  # Update status every 10 sec
+    # Valve changes arrive over /events; the interval is only a resync fallback
+    dcc.Interval(id="status-update", interval=60000),
+    dcc.Store(id="live-valve-event"),
+    dcc.Store(id="live-history-event"),
+    dcc.Store(id="live-alarm-event"),
     dcc.Store(id="weather-store"),
-    dcc.Store(id="system-store")
+    dcc.Store(id="system-store"),  # valve/history versions this client has rendered
+    dcc.Store(id="history-version")
 ], fluid=True)
 
-# ====================== GPIO FUNCTIONS ======================
-def valve_timer(valve_idx, duration_min):
-    """Thread function to turn off valve after duration"""
-    time.sleep(duration_min * 60)
-    control_valve(valve_idx, False)
-    logging.info(f"Valve {VALVE_NAMES[valve_idx]} auto-off after {duration_min} minutes")
+# ====================== WEATHER FUNCTIONS ======================
+def get_weather_forecast(force=False):
+    """Get the shared cached forecast, fetching only when it has expired"""
+    if force:
+        return forecastCache.refresh_forecast()
+    return forecastCache.get_forecast()
+
+# ====================== STATUS RENDERING ======================
+def valve_indicator(valve_idx, active):
+    color = "danger" if active else "primary"
+    text = "ACTIVE" if active else "INACTIVE"
+    return dbc.Alert(f"{VALVE_NAMES[valve_idx]}: {text}", color=color, className="p-2 m-1")
+
+def last_watering_info(last):
+    if not last:
+        return "No watering history yet"
+    return [
+        html.H5("Last Watering:"),
+        html.P(f"{last['zone']} for {last['duration']} minutes"),
+        html.Small(f"at {last['time']} ({last['weather']})")
+    ]
+
+# ====================== LIVE EVENTS ======================
+@app.server.route("/events")
+def valve_events():
+    """Server-sent event stream of valve changes and history appends"""
+    return Response(stream_with_context(control.events.stream()),
+                    mimetype="text/event-stream",
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.server.route("/metrics")
+def metrics_endpoint():
+    """Prometheus metrics for this process, plus the control daemon's"""
+    merge = []
+    if isinstance(control, controlDaemon.ControlClient):
+        try:
+            merge.append(control.metrics())
+        except Exception as e:
+            logging.warning(f"Could not read daemon metrics: {str(e)}")
+    return Response(metrics.registry.render(merge), mimetype="text/plain; version=0.0.4")
+
+@app.server.route("/metrics/profile")
+def profile_endpoint():
+    """Folded stacks of slow callbacks (OPENVALVES_PROFILE_MS), for flamegraph tools"""
+    if not metrics.profiler.enabled:
+        return Response("Profiling is off; set OPENVALVES_PROFILE_MS\n", status=404, mimetype="text/plain")
+    return Response(metrics.profiler.folded(), mimetype="text/plain")
+
+@app.server.route("/forecast.svg")
+def forecast_svg():
+    """Cached forecast chart; versioned URLs are immutable"""
+    version = request.args.get('v')
+    key, svg = version, forecastChart.chart_cache.lookup(version) if version else None
+    if svg is None:
+        # Another worker rendered it, or an unversioned URL: draw the current forecast
+        key, svg = forecastChart.chart_cache.get(forecastCache.forecast_cache.peek())
+    cache_control = 'public, max-age=31536000, immutable' if key == version else 'no-cache'
+
+    etag = f'"{key}"'
+    if etag in request.headers.get('If-None-Match', ''):
+        return Response(status=304, headers={'ETag': etag, 'Cache-Control': cache_control})
+    return Response(svg, mimetype="image/svg+xml",
+                    headers={'ETag': etag, 'Cache-Control': cache_control})
+
+USAGE_BUCKETS = {'day': 14, 'week': 12, 'month': 12}
+
+def usage_chart_data(period):
+    """Rollups for the usage chart; a few rows whatever the length of the history"""
+    return {'period': period, 'buckets': USAGE_BUCKETS[period],
+            'rows': control.history_usage(period, USAGE_BUCKETS[period])}
+
+@app.server.route("/usage.svg")
+def usage_svg():
+    """Cached usage chart; versioned URLs are immutable"""
+    version = request.args.get('v')
+    period = request.args.get('period', 'day')
+    if period not in USAGE_BUCKETS:
+        return Response("Unknown period\n", status=400, mimetype="text/plain")
+    key, svg = version, usageChart.chart_cache.lookup(version) if version else None
+    if svg is None:
+        key, svg = usageChart.chart_cache.get(usage_chart_data(period))
+    cache_control = 'public, max-age=31536000, immutable' if key == version else 'no-cache'
+
+    etag = f'"{key}"'
+    if etag in request.headers.get('If-None-Match', ''):
+        return Response(status=304, headers={'ETag': etag, 'Cache-Control': cache_control})
+    return Response(svg, mimetype="image/svg+xml",
+                    headers={'ETag': etag, 'Cache-Control': cache_control})
 
-def control_valve(valve_idx, state, duration_min=10):
-    """Control a single valve with safety checks and timed shutoff"""
-    try:
-        pin = VALVE_PINS[valve_idx]
-        if state:
-            # Cancel any existing timer for this valve
-            if hasattr(control_valve, f"timer_{valve_idx}"):
-                old_timer = getattr(control_valve, f"timer_{valve_idx}")
-                if old_timer and old_timer.is_alive():
-                    old_timer.cancel()
-            
-            # Turn valve ON
-            GPIO.output(pin, RELAY_ACTIVE)
-            valve_states[valve_idx] = True
-            
-            # Log watering event
-            with history_lock:
-                weather_condition = "Hot" if weather_data['next_high_temp'] > 85 else "Normal"
-                
-                watering_history.append({
-                    'time': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                    'zone': VALVE_NAMES[valve_idx],
-                    'duration': duration_min,
-                    'weather': weather_condition
-                })
-            
-            # Start timer to turn off
-            timer = threading.Timer(duration_min * 60, lambda: control_valve(valve_idx, False))
-            timer.start()
-            setattr(control_valve, f"timer_{valve_idx}", timer)
-            
-            logging.info(f"Valve {VALVE_NAMES[valve_idx]} ON for {duration_min} minutes")
-        else:
-            # Turn valve OFF
-            GPIO.output(pin, GPIO.HIGH if RELAY_ACTIVE == GPIO.LOW else GPIO.LOW)
-            valve_states[valve_idx] = False
-            
-            # Cancel any running timer
-            if hasattr(control_valve, f"timer_{valve_idx}"):
-                timer = getattr(control_valve, f"timer_{valve_idx}")
-                if timer and timer.is_alive():
-                    timer.cancel()
-            
-            logging.info(f"Valve {VALVE_NAMES[valve_idx]} OFF")
-    except Exception as e:
-        logging.error(f"Error controlling valve {VALVE_NAMES[valve_idx]}: {str(e)}")
-        raise
+@app.callback(
+    [Output("valve-status-indicators", "children", allow_duplicate=True),
+     *[Output(f"btn-{i}", "color", allow_duplicate=True) for i in range(len(VALVE_NAMES))]],
+    Input("live-valve-event", "data"),
+    prevent_initial_call=True
+)
+def apply_valve_event(event):
+    """Patch only the indicator and button of the valve that changed"""
+    if not event:
+        return dash.no_update, *[dash.no_update] * len(VALVE_NAMES)
+
+    valve_idx = event['valve']
+    indicators = Patch()
+    indicators[valve_idx] = valve_indicator(valve_idx, event['active'])
+    button_colors = [dash.no_update] * len(VALVE_NAMES)
+    button_colors[valve_idx] = "danger" if event['active'] else "primary"
+    return indicators, *button_colors
 
-# ====================== WEATHER FUNCTIONS ======================
-def get_weather_forecast():
-    """Get comprehensive weather updates from weather.gov"""
-    options = webdriver.ChromeOptions()
-    options.add_argument("--headless=new")
-    options.add_argument("--disable-gpu")
-    options.binary_location = '/usr/bin/chromium-browser'
-    service = Service('/usr/bin/chromedriver')
-    driver = webdriver.Chrome(service=service, options=options)
-    
-    try:
-        # Navigate to forecast page
-        url = "https://forecast.weather.gov/MapClick.php?lat=44.591248&lon=-123.272118"
-        driver.get(url)
-        logging.info(f"Accessing weather data from: {url}")
-
-        # Wait for elements to load
-        WebDriverWait(driver, 15).until(
-            EC.presence_of_element_located((By.ID, "seven-day-forecast-body")))
-
-        # Get current conditions
-        current_temp = driver.find_element(
-            By.CLASS_NAME, "myforecast-current-lrg").text.replace('°F', '')
-
-        # Process extended forecast
-        forecast_items = driver.find_elements(
-            By.CSS_SELECTOR, "#seven-day-forecast-list li.forecast-tombstone")
-
-        processed_forecast = []
-        for item in forecast_items:
-            try:
-                period = item.find_element(By.CLASS_NAME, "period-name").text
-                temp = item.find_element(By.CLASS_NAME, "temp").text
-                desc = item.find_element(By.CLASS_NAME, "short-desc").text
-                
-                # Extract high temp if available
-                is_high = 'High' in temp
-                temp_value = int(temp.split()[1].replace('°F', '')) if is_high else None
-                
-                processed_forecast.append({
-                    'period': period,
-                    'temperature': temp,
-                    'temp_value': temp_value,
-                    'is_high': is_high,
-                    'description': desc
-                })
-            except NoSuchElementException:
-                continue
-
-        # Find next high temperature
-        next_high = next((f for f in processed_forecast if f['is_high']), None)
-        next_high_temp = next_high['temp_value'] if next_high else 75
-
-        return {
-            'current_temp': current_temp,
-            'next_high_temp': next_high_temp,
-            'forecast_data': processed_forecast
-        }
+@app.callback(
+    Output("last-watering-info", "children", allow_duplicate=True),
+    Input("live-history-event", "data"),
+    prevent_initial_call=True
+)
+def apply_history_event(event):
+    return last_watering_info(event) if event else dash.no_update
 
-    except Exception as e:
-        logging.error(f"Weather scraping error: {str(e)}")
-        return {
-            'current_temp': 'N/A',
-            'next_high_temp': 75,
-            'forecast_data': [],
-            'error': str(e)
-        }
-    finally:
-        driver.quit()
+@app.callback(
+    [Output("system-messages", "children", allow_duplicate=True),
+     Output("system-store", "data", allow_duplicate=True)],
+    Input("live-alarm-event", "data"),
+    prevent_initial_call=True
+)
+def apply_alarm_event(alarm):
+    """Show a pushed alarm and mark it seen, so the next poll doesn't repeat it"""
+    if not alarm:
+        return dash.no_update, dash.no_update
+    seen = Patch()
+    seen['alarm'] = alarm['time']  # The leak detector's alarm version
+    return flow_alarm_message(alarm), seen
 
 # ====================== CALLBACKS ======================
 @app.callback(
     [Output("valve-status-indicators", "children"),
      Output("last-watering-info", "children"),
      Output("system-messages", "children"),
+     Output("system-store", "data"),
      *[Output(f"btn-{i}", "color") for i in range(len(VALVE_NAMES))]],
     [Input("status-update", "n_intervals"),
      Input("emergency-stop", "n_clicks"),
@@ -444,85 +366,161 @@ def get_weather_forecast():
      Input("run-all-btn", "n_clicks"),
      Input("update-weather", "n_clicks")],
     [State("duration-input", "value"),
-     State("weather-store", "data")]
+     State("weather-store", "data"),
+     State("system-store", "data")]
 )
+@metrics.timed_callback("update_system")
 def update_system(interval, emergency_clicks, *args):
     """Handle all system updates in one callback"""
     ctx = callback_context
-    duration = args[-2] or 15  # Default duration
-    weather = args[-1] or weather_data
+    duration = args[-3] or 15  # Default duration
+    weather = args[-2] or weather_data
+    seen = args[-1] or {}
     
     # Check which input triggered the callback
+    trigger_id = None
     if ctx.triggered:
         trigger_id = ctx.triggered[0]['prop_id'].split('.')[0]
         
-        # Emergency stop takes priority
-        if trigger_id == 'emergency-stop':
-            for i in range(len(VALVE_NAMES)):
-                control_valve(i, False)  # This will cancel any running timers
-            message = dbc.Alert("Emergency stop activated! All valves turned off.", color="danger")
+        try:
+            # Emergency stop takes priority
+            if trigger_id == 'emergency-stop':
+                control.stop_all()  # Also drops every pending shutoff
+                message = dbc.Alert("Emergency stop activated! All valves turned off.", color="danger")
         
-        # Individual valve control
-        elif trigger_id.startswith('btn-'):
-            valve_idx = int(trigger_id.split('-')[1])
-            control_valve(valve_idx, not valve_states[valve_idx], 
-                        duration if not valve_states[valve_idx] else 0)
-            message = None
+            # Individual valve control
+            elif trigger_id.startswith('btn-'):
+                valve_idx = int(trigger_id.split('-')[1])
+                control_valve(valve_idx, not control.snapshot()['states'][valve_idx], duration)
+                message = None
         
-        # Run all zones
-        elif trigger_id == 'run-all-btn':
-            for i in range(len(VALVE_NAMES)):
-                control_valve(i, True, duration)
-                time.sleep(1)  # Brief delay between valves
-            message = dbc.Alert(f"Watering all zones for {duration} minutes", color="success")
+            # Run all zones
+            elif trigger_id == 'run-all-btn':
+                # Queue the zones 1 s apart instead of sleeping in the request
+                control.run_all(duration_min=duration)
+                message = dbc.Alert(f"Watering all zones for {duration} minutes", color="success")
         
-        # Weather update
-        elif trigger_id == 'update-weather':
-            message = dbc.Alert("Updating weather data...", color="info")
-        else:
-            message = None
+            # Weather update
+            elif trigger_id == 'update-weather':
+                message = dbc.Alert("Updating weather data...", color="info")
+            else:
+                message = None
+        except RuntimeError as e:
+            # A read-only dashboard, or the daemon refused the command
+            message = dbc.Alert(str(e), color="warning")
     else:
         message = None
+
+    # Compare versions with what this client last rendered
+    snapshot = control.snapshot()
+    flow = control.flow_status()
+    versions = {'valve': snapshot['version'], 'history': control.history_version(),
+                'alarm': flow['version'] if flow else 0}
+    if trigger_id == 'status-update':
+        message = dash.no_update
+    # A fresh page only records the alarm version; alarms before it loaded are old news
+    if 'alarm' in seen and versions['alarm'] != seen['alarm'] and flow and flow['alarms']:
+        message = flow_alarm_message(flow['alarms'][-1])
     
     # Update status indicators
-    indicators = []
-    for i, name in enumerate(VALVE_NAMES):
-        current_state = GPIO.input(VALVE_PINS[i]) == RELAY_ACTIVE
-        valve_states[i] = current_state
-        color = "danger" if current_state else "primary"
-        text = "ACTIVE" if current_state else "INACTIVE"
-        indicators.append(
-            dbc.Alert(f"{name}: {text}", color=color, className="p-2 m-1")
-        )
+    if versions['valve'] != seen.get('valve'):
+        indicators = [valve_indicator(i, active) for i, active in enumerate(snapshot['states'])]
+        button_colors = ["danger" if active else "primary" for active in snapshot['states']]
+    else:
+        indicators = dash.no_update
+        button_colors = [dash.no_update] * len(VALVE_NAMES)
     
     # Last watering info
-    last_watering = "No watering history yet"
-    with history_lock:
-        if watering_history:
-            last = watering_history[-1]
-            last_watering = [
-                html.H5("Last Watering:"),
-                html.P(f"{last['zone']} for {last['duration']} minutes"),
-                html.Small(f"at {last['time']} ({last['weather']})")
-            ]
-    
-    # Button colors
-    button_colors = ["danger" if valve_states[i] else "primary" 
-                    for i in range(len(VALVE_NAMES))]
+    if versions['history'] != seen.get('history'):
+        last_watering = last_watering_info(control.history_latest())
+    else:
+        last_watering = dash.no_update
     
-    return indicators, last_watering, message, *button_colors
+    if versions == seen:
+        versions = dash.no_update
+    return indicators, last_watering, message, versions, *button_colors
+
+FLOW_ALARM_TEXT = {
+    'leak': "Water is flowing with every valve closed",
+    'no_flow': "No water is flowing through the open zone",
+    'high_flow': "Flow is far above normal",
+    'low_flow': "Flow is far below normal",
+}
+
+def flow_alarm_message(alarm):
+    """Alert for the newest leak detector alarm"""
+    when = datetime.fromtimestamp(alarm['time']).strftime('%H:%M:%S')
+    zones = ', '.join(alarm['zones']) or 'all closed'
+    return dbc.Alert(
+        f"{FLOW_ALARM_TEXT.get(alarm['kind'], alarm['kind'])} ({alarm['rate_lpm']} L/min, {zones}) "
+        f"at {when} - all valves stopped.", color="danger")
+
+def refresh_weather_job(job):
+    """Background job: fetch a new forecast into the shared cache"""
+    global weather_data
+    job.report(0.1, "Fetching forecast from weather.gov")
+    weather = forecastCache.refresh_forecast()
+    if weather:
+        weather_data = weather
+    return weather
+
+def forecast_age(weather):
+    """Age of the forecast, with a warning while weather.gov is failing"""
+    if 'fetched_at' not in weather:
+        return None
+    minutes = int((time.time() - weather['fetched_at']) // 60)
+    age = f"{minutes} min ago" if minutes < 120 else f"{minutes // 60} h ago"
+    if weather.get('upstream_error'):
+        return html.P(f"Showing the forecast from {age} - weather.gov is unavailable",
+                      className="text-warning small mb-0", title=weather['upstream_error'])
+    return html.P(f"Updated {age}", className="text-muted small mb-0")
+
+def forecast_chart_src(weather):
+    """URL of the cached SVG chart; the version changes only with the data"""
+    key, _ = forecastChart.chart_cache.get(weather)
+    return f"/forecast.svg?v={key}"
+
+def job_status_text(status):
+    if not status:
+        return None
+    if status['state'] in ('queued', 'running'):
+        return f"{status['message'] or 'Waiting'}... ({status['progress']:.0%})"
+    if status['state'] == 'failed':
+        return f"Update failed: {status['error']}"
+    return None
 
 @app.callback(
     [Output("weather-summary", "children"),
-     Output("forecast-graph", "figure"),
-     Output("weather-store", "data")],
+     Output("forecast-graph", "src"),
+     Output("weather-store", "data"),
+     Output("weather-job", "data"),
+     Output("job-poll", "disabled"),
+     Output("weather-job-status", "children")],
     [Input("weather-update", "n_intervals"),
-     Input("update-weather", "n_clicks")]
+     Input("update-weather", "n_clicks"),
+     Input("job-poll", "n_intervals")],
+    State("weather-job", "data")
 )
-def update_weather(interval, update_click):
-    """Update weather data and display"""
+@metrics.timed_callback("update_weather")
+def update_weather(interval, update_click, poll, job_id):
+    """Render the cached forecast; refreshes run as background jobs"""
     try:
-        weather = get_weather_forecast()
+        trigger_id = callback_context.triggered[0]['prop_id'].split('.')[0] if callback_context.triggered else None
+        weather = forecastCache.forecast_cache.peek()
+        
+        # Never fetch inside the request; queue a refresh and poll for it
+        stale = trigger_id != 'job-poll' and not forecastCache.forecast_cache.is_fresh()
+        if trigger_id == 'update-weather' or stale:
+            job_id = jobs.submit('weather-refresh', refresh_weather_job)
+        
+        status = jobs.status(job_id) if job_id else None
+        running = bool(status) and status['state'] in ('queued', 'running')
+        if trigger_id == 'job-poll' and running:
+            return dash.no_update, dash.no_update, dash.no_update, job_id, False, job_status_text(status)
+        
+        if weather is None:
+            summary = [html.H4("Loading forecast...")]
+            return summary, forecast_chart_src(None), dash.no_update, job_id, not running, job_status_text(status)
         
         # Update global weather data
         global weather_data
@@ -532,43 +530,11 @@ def update_weather(interval, update_click):
         summary = [
             html.H4(f"Current: {weather.get('current_temp', 'N/A')}°F"),
             html.Hr(),
-            html.H5(f"Next High: {weather.get('next_high_temp', 75)}°F")
+            html.H5(f"Next High: {weather.get('next_high_temp', 75)}°F"),
+            forecast_age(weather)
         ]
         
-        # Create forecast graph
-        fig = go.Figure()
-        forecast_data = weather.get('forecast_data', [])
-        
-        if forecast_data:
-            highs = [f for f in forecast_data if f.get('is_high')]
-            if highs:
-                fig.add_trace(go.Bar(
-                    x=[f['period'] for f in highs],
-                    y=[f['temp_value'] for f in highs],
-                    text=[f['description'] for f in highs],
-                    marker_color='indianred',
-                    name='High Temp'
-                ))
-            
-            fig.update_layout(
-                title="Weather Forecast",
-                yaxis_title="Temperature (°F)",
-                xaxis_title="Day",
-                hovermode="x unified",
-                dragmode=False,
-                xaxis=dict(fixedrange=True),
-                yaxis=dict(fixedrange=True)
-            )
-        else:
-            fig.update_layout(
-                title="No Forecast Data Available",
-                annotations=[dict(text="Check connection", showarrow=False)],
-                dragmode=False,
-                xaxis=dict(fixedrange=True),
-                yaxis=dict(fixedrange=True)
-            )
-        
-        return summary, fig, weather
+        return summary, forecast_chart_src(weather), weather, job_id, not running, job_status_text(status)
     
     except Exception as e:
         logging.error(f"Weather update failed: {str(e)}")
@@ -576,23 +542,40 @@ def update_weather(interval, update_click):
             html.H4("Weather Data Unavailable"),
             html.P("Please check your internet connection")
         ]
-        error_fig = go.Figure()
-        error_fig.update_layout(
-            title="Weather Data Error",
-            annotations=[dict(text="Update failed", showarrow=False)],
-            dragmode=False,
-            xaxis=dict(fixedrange=True),
-            yaxis=dict(fixedrange=True)
-        )
-        return error_msg, error_fig, weather_data
+        return error_msg, forecast_chart_src({'error': str(e)}), weather_data, dash.no_update, True, None
 
 @app.callback(
-    Output("history-table", "data"),
-    Input("status-update", "n_intervals")
+    [Output("history-table", "data"),
+     Output("history-table", "page_count"),
+     Output("history-version", "data")],
+    [Input("status-update", "n_intervals"),
+     Input("live-history-event", "data"),
+     Input("history-table", "page_current"),
+     Input("history-table", "page_size"),
+     Input("history-table", "sort_by"),
+     Input("history-table", "filter_query")],
+    State("history-version", "data")
 )
-def update_history_table(n):
-    with history_lock:
-        return watering_history
+def update_history_table(n, history_event, page_current, page_size, sort_by, filter_query, seen):
+    """Serve one page of history, sorted and filtered in SQLite"""
+    version = control.history_version()
+    triggers = {t['prop_id'] for t in callback_context.triggered}
+    if triggers == {"status-update.n_intervals"} and version == seen:
+        return dash.no_update, dash.no_update, dash.no_update
+
+    data, page_count = control.history_page(
+        page_current=page_current, page_size=page_size, sort_by=sort_by, filter_query=filter_query)
+    return data, page_count, version
+
+@app.callback(
+    Output("usage-graph", "src"),
+    [Input("history-version", "data"),
+     Input("usage-period", "value")]
+)
+def update_usage_chart(version, period):
+    """Point the usage chart at the rollups; redrawn only when they change"""
+    key, _ = usageChart.chart_cache.get(usage_chart_data(period))
+    return f"/usage.svg?period={period}&v={key}"
 
 @app.callback(
     Output('weekly-schedule-editor', 'data'),
@@ -630,13 +613,13 @@ def initialize_schedule_editor(timestamp, current_data):
     Input('save-schedule', 'n_clicks'),
     State('schedule-editor', 'data')
 )
+@metrics.timed_callback("save_schedule")
 def save_schedule(n_clicks, table_data):
     if not n_clicks:
         return None
     
     try:
-        with open(SCHEDULE_FILE, 'r') as f:
-            schedules = json.load(f)
+        schedules = load_schedule()
         
         # Reconstruct weekly schedule from table data
         weekly_schedule = {}
@@ -649,8 +632,14 @@ def save_schedule(n_clicks, table_data):
         
         schedules['weekly'] = weekly_schedule
         
-        with open(SCHEDULE_FILE, 'w') as f:
-            json.dump(schedules, f, indent=2)
+        # Atomic replace, then have the daemon re-plan from the new file
+        controlDaemon.schedule_repo.save(schedules)
+        try:
+            control.reload_schedule()
+        except Exception as e:
+            logging.error(f"Error reloading schedule: {str(e)}")
+            return dbc.Alert("Schedule saved, but the control daemon did not reload it; "
+                             "it will on its next run", color="warning")
         
         return dbc.Alert("Schedule saved successfully!", color="success", duration=3000)
     except Exception as e:
@@ -658,19 +647,15 @@ def save_schedule(n_clicks, table_data):
 
 def cleanup():
     """Clean up resources on exit"""
-    logging.info("Cleaning up resources")
-    scheduler.shutdown()
-    for pin in VALVE_PINS:
-        GPIO.output(pin, GPIO.HIGH if RELAY_ACTIVE == GPIO.LOW else GPIO.LOW)
-    GPIO.cleanup()
+    control.shutdown()  # Closes valves only when this process owns them
 
 if __name__ == '__main__':
     try:
-        # Initial weather update
-        weather_data = get_weather_forecast()
+        # Serve the last persisted forecast at once and refresh it in the background
+        weather_data = forecastCache.get_forecast(block=False) or weather_data
         
         # Start the server
-        app.run(host='0.0.0.0', port=8050, debug=False)
+        app.run(host='0.0.0.0', port=int(os.environ.get("OPENVALVES_PORT", 8050)), debug=False)
     except KeyboardInterrupt:
         pass
     finally:
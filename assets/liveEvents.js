@@ -0,0 +1,23 @@
+// Forward valve, history and alarm events from /events into dcc.Store components
+(function () {
+    function connect() {
+        var clientside = window.dash_clientside;
+        if (!clientside || !clientside.set_props) {
+            setTimeout(connect, 500);
+            return;
+        }
+
+        var source = new EventSource('/events');
+        source.addEventListener('valve', function (e) {
+            clientside.set_props('live-valve-event', {data: JSON.parse(e.data)});
+        });
+        source.addEventListener('history', function (e) {
+            clientside.set_props('live-history-event', {data: JSON.parse(e.data)});
+        });
+        source.addEventListener('alarm', function (e) {
+            clientside.set_props('live-alarm-event', {data: JSON.parse(e.data)});
+        });
+    }
+
+    window.addEventListener('load', connect);
+})();
@@ -0,0 +1,595 @@
+#!/usr/bin/env python3
+"""Irrigation control daemon.
+
+One long-lived process owns the relays, the valve controller, the daily
+schedule and the watering history, and serves a small JSON-lines RPC on a
+Unix domain socket. The dashboard workers, the cron runner and the valve
+tester connect as thin clients, so there is only ever one scheduler and one
+writer to the relay pins.
+
+Protocol: each request is one line {"id": n, "method": ..., "params": {...}}
+answered by {"id": n, "result": ...} or {"id": n, "error": "..."}. The
+"subscribe" method turns the connection into a stream of
+{"event": ..., "data": ...} lines.
+"""
+
+import itertools
+import json
+import logging
+import os
+import signal
+import socket
+import socketserver
+import threading
+import time
+from datetime import datetime
+
+import flowMeter
+import forecastCache
+import forecastGuard
+import leakDetector
+import metrics
+import relayDriver
+import valveConfig
+import valveJournal
+import wateringRules
+import zonePlanner
+from historyStore import HistoryStore
+from liveEvents import EventBroker
+from scheduleCompiler import ScheduleCompiler
+from scheduleRepository import SCHEDULE_FILE, ScheduleRepository
+from valveEngine import ValveController
+
+SOCKET_PATH = os.environ.get("OPENVALVES_SOCKET", "/tmp/openvalves.sock")
+
+# Valve configuration (valves.json, see valveConfig.py)
+valve_config = valveConfig.load_config()
+VALVE_NAMES = [zone['name'] for zone in valve_config['zones']]
+VALVE_PINS = [zone['pin'] for zone in valve_config['zones']]  # BCM pins or expander outputs
+VALVE_INRUSH = [zone.get('inrush_ms', 0) / 1000 for zone in valve_config['zones']]
+RELAY_ACTIVE_LOW = valve_config['active_low']
+
+DEFAULT_SCHEDULE = {
+    "weekly": {
+        "Sunday": {"Patio": 30, "Flowers": 15, "Fig": 20, "Apple": 25},
+        "Monday": {"Patio": 20, "Flowers": 20, "Fig": 15, "Apple": 20},
+        "Tuesday": {"Patio": 20, "Flowers": 15, "Fig": 20, "Apple": 25},
+        "Wednesday": {"Patio": 25, "Flowers": 20, "Fig": 15, "Apple": 20},
+        "Thursday": {"Patio": 20, "Flowers": 15, "Fig": 20, "Apple": 25},
+        "Friday": {"Patio": 30, "Flowers": 20, "Fig": 15, "Apple": 20},
+        "Saturday": {"Patio": 40, "Flowers": 25, "Fig": 30, "Apple": 40}
+    },
+    "special": {}
+}
+
+# Methods a client may call
+RPC_METHODS = (
+    'snapshot', 'turn_on', 'turn_off', 'stop_all', 'run_all', 'test_zone',
+    'plan', 'run_scheduled', 'history_page', 'history_latest', 'history_version',
+    'history_usage', 'metrics', 'flow_status', 'reload_schedule',
+)
+# These may wait for a forecast fetch, which gives up after FORECAST_DEADLINE
+SLOW_METHODS = ('plan', 'run_scheduled')
+SLOW_CALL_TIMEOUT = forecastGuard.FORECAST_DEADLINE + 30
+
+
+schedule_repo = ScheduleRepository(SCHEDULE_FILE, DEFAULT_SCHEDULE)
+
+
+def load_schedule():
+    """Current schedule, reparsed only when the file changes"""
+    return schedule_repo.load()
+
+
+class ControlService:
+    """Relays, valve controller, schedule and history in one place"""
+
+    def __init__(self, schedule=True):
+        # Own the journal before touching a relay: setup writes every relay off
+        self.journal = valveJournal.ValveJournal()  # JournalBusy if another process drives the valves
+        self.relays = relayDriver.get_driver(valve_config['driver'], RELAY_ACTIVE_LOW,
+                                             **valveConfig.driver_options(valve_config))
+        self.relays.setup(VALVE_PINS)
+        self.bank = relayDriver.RelayBank(self.relays, VALVE_PINS, VALVE_INRUSH)
+        self.history = HistoryStore()
+        self.events = EventBroker()
+        self.last_plan = None
+        self._base_minutes = {}  # zone -> scheduled minutes before the weather, for the runs queued last
+        self._run_lock = threading.Lock()
+        self._last_run = None  # datetime of the compiled run executed last
+
+        # Optional flow sensor: litres per run are added to each history row,
+        # and flow that disagrees with the valve state triggers an emergency stop
+        self.usage = None
+        self.leaks = None
+        self._open_rows = {}  # valve index -> (history id, event) of the run in progress
+        if flowMeter.FLOW_METER_PIN:
+            meter = flowMeter.FlowMeter(self.relays, flowMeter.FLOW_METER_PIN)
+            meter.start()
+            zones, _ = zonePlanner.load_hydraulics(load_schedule())
+            flow_gpm = {name: zones.get(name, {}).get('flow_gpm') for name in VALVE_NAMES}
+            self.usage = flowMeter.ZoneUsage(meter, flow_gpm)
+            self.leaks = leakDetector.LeakDetector(
+                meter, {name: gpm * leakDetector.GPM_TO_LPM for name, gpm in flow_gpm.items() if gpm},
+                on_alarm=self._on_flow_alarm)
+
+        self.controller = ValveController(VALVE_NAMES, self.bank.set, commit=self._commit_relays,
+                                          journal=self.journal)
+        self.controller.add_listener(self._record_watering)
+        self.controller.add_listener(self._publish_valve_event)
+        if self.leaks:
+            self.controller.add_listener(
+                lambda valve_idx, active, info: self.leaks.valve_changed(VALVE_NAMES[valve_idx], active))
+            self.leaks.start()
+
+        # Valves left open by a crash: close the overdue ones and re-arm the
+        # rest before the first request or scheduled run is served
+        resumed = self.controller.restore(self.journal.open_runs())
+        if resumed:
+            logging.warning(f"Resumed runs interrupted by a restart: {', '.join(resumed)}")
+
+        # Ensure schedule file exists, and recompile whenever it changes
+        schedule_repo.ensure_exists()
+        self.timeline = ScheduleCompiler(load_schedule())
+        schedule_repo.add_listener(self._on_schedule_change)
+
+        self.scheduler = None
+        if schedule:
+            self._schedule_daily_watering()
+
+    # ---------------------- valve control ----------------------
+    def snapshot(self):
+        snapshot = self.controller.snapshot()
+        return {'version': snapshot.version, 'states': list(snapshot.states)}
+
+    def turn_on(self, valve_idx, duration_min):
+        return self.controller.turn_on(valve_idx, duration_min)
+
+    def turn_off(self, valve_idx):
+        self.controller.turn_off(valve_idx)
+
+    def stop_all(self):
+        self.controller.stop_all()  # Also drops every pending shutoff
+
+    def run_all(self, duration_min, stagger_sec=1):
+        """Queue every zone, stagger_sec apart"""
+        now = self.controller.clock()
+        for i in range(len(VALVE_NAMES)):
+            self.controller.queue_run(i, now + i * stagger_sec, duration_min, reason="manual")
+
+    def test_zone(self, valve_idx, seconds):
+        return self.controller.turn_on(valve_idx, seconds / 60, reason="test")
+
+    # ---------------------- scheduling ----------------------
+    def build_watering_plan(self, weather=None, when=None):
+        """Compute a day's watering plan without executing it"""
+        weather = weather or forecastCache.get_forecast()
+        schedules = load_schedule()
+
+        when = when or datetime.now()
+        base_durations = self.timeline.durations_on(when)
+        day_schedule = wateringRules.adjust_for_weather(base_durations, weather)
+
+        # Zones with soil and plant settings get their minutes from the water balance
+        import waterBalance  # Pulls in NumPy; keep it off the import path of thin clients
+
+        zones, hydraulics = zonePlanner.load_hydraulics(schedules)
+        balance = waterBalance.water_balance.plan(day_schedule, weather, zones, when)
+        # A late trigger waters from now, so done_by trims against the real start
+        plan = zonePlanner.plan_watering(balance['durations'], VALVE_NAMES, zones, hydraulics,
+                                         start=max(when, datetime.now()))
+        plan['water_balance'] = balance
+        plan['base_durations'] = base_durations
+        return plan
+
+    def plan(self):
+        return zonePlanner.format_plan(self.build_watering_plan())
+
+    def run_scheduled(self, when=None):
+        """Run the scheduled watering for today; returns the plan text.
+
+        Each compiled run executes once, whether the daemon's own trigger or
+        a cron job calling valveControl.py gets there first.
+        """
+        run = self.timeline.last_run(when or datetime.now())
+        with self._run_lock:
+            if run is not None and run.when == self._last_run:
+                logging.info(f"Watering for {run.when:%Y-%m-%d %H:%M} already ran; skipping")
+                return f"Watering for {run.when:%Y-%m-%d %H:%M} already ran"
+            if run is not None:
+                self._last_run = run.when
+        try:
+            logging.info("Running scheduled watering")
+            plan = self.build_watering_plan(when=when)
+            self.last_plan = plan
+            self._base_minutes = plan['base_durations']
+            text = zonePlanner.format_plan(plan)
+            logging.info(text)
+            zonePlanner.execute_plan(plan, self.controller)
+            import waterBalance
+            waterBalance.water_balance.commit(plan['water_balance'], zonePlanner.watered_minutes(plan))
+            return text
+        except Exception as e:
+            logging.error(f"Error in scheduled watering: {str(e)}")
+            with self._run_lock:
+                if run is not None and self._last_run == run.when:
+                    self._last_run = None  # Let a retry run it
+            raise
+
+    def _schedule_daily_watering(self):
+        """Start the scheduler and arm a trigger for the next compiled run"""
+        from apscheduler.schedulers.background import BackgroundScheduler
+
+        self.scheduler = BackgroundScheduler(daemon=True)
+        self.scheduler.start()
+        self._arm_next_run()
+
+    def _arm_next_run(self, after=None):
+        """Replace the pending trigger with one at the next run's exact time"""
+        run = self.timeline.next_run(after)
+        if self.scheduler is None:
+            return
+
+        from apscheduler.triggers.date import DateTrigger
+
+        if run is None:
+            if self.scheduler.get_job("next_watering"):
+                self.scheduler.remove_job("next_watering")
+            logging.info("No watering scheduled")
+            return
+        self.scheduler.add_job(
+            self._run_timeline,
+            trigger=DateTrigger(run_date=run.when),
+            args=[run],
+            id="next_watering",
+            name="watering",
+            replace_existing=True,
+            misfire_grace_time=3600
+        )
+        logging.info(f"Next watering at {run.when:%Y-%m-%d %H:%M} ({run.rule})")
+
+    def _run_timeline(self, run):
+        """Scheduler job for one compiled run; arms the following one"""
+        metrics.scheduler_drift_seconds.observe(
+            (datetime.now() - run.when).total_seconds(), stage="trigger")
+        try:
+            self.run_scheduled(when=run.when)
+        finally:
+            self._arm_next_run(after=run.when)
+
+    def reload_schedule(self):
+        """Re-read the schedule after another process saved it; True if it changed"""
+        return schedule_repo.reload()
+
+    def _on_schedule_change(self, new_schedules):
+        """Schedule listener: recompile the changed rules and re-arm the trigger"""
+        try:
+            days = self.timeline.update(new_schedules)
+            logging.info(f"Schedule changed; recompiled {days} days")
+            self._arm_next_run()
+        except Exception as e:
+            logging.error(f"Error re-planning after schedule change: {str(e)}")
+
+    # ---------------------- history ----------------------
+    def history_page(self, page_current=0, page_size=10, sort_by=None, filter_query=None):
+        return self.history.query(page_current, page_size, sort_by, filter_query)
+
+    def history_latest(self):
+        return self.history.latest()
+
+    def history_version(self):
+        return self.history.version()
+
+    def history_usage(self, period='day', buckets=14):
+        """Per-zone rollups for the usage chart"""
+        return self.history.usage(period, buckets)
+
+    def metrics(self):
+        """This process's metric values, for the dashboard's /metrics"""
+        return metrics.registry.snapshot()
+
+    # ---------------------- listeners ----------------------
+    def _commit_relays(self):
+        """Write the staged relay changes; called by the valve controller after it releases its lock"""
+        with metrics.gpio_write_seconds.time():
+            self.bank.commit()
+
+    def _record_watering(self, valve_idx, active, info):
+        """Valve controller listener that logs every valve change"""
+        litres = self.usage.valve_changed(VALVE_NAMES[valve_idx], active) if self.usage else None
+        if not active:
+            logging.info(f"Valve {VALVE_NAMES[valve_idx]} OFF ({info['reason']})")
+            row = self._open_rows.pop(valve_idx, None)
+            if row and litres is not None:
+                event_id, event = row
+                event['litres'] = round(litres, 1)
+                self.history.set_litres(event_id, event['litres'])
+                self.events.publish('history', event)
+                logging.info(f"Valve {VALVE_NAMES[valve_idx]} delivered {event['litres']} L")
+            return
+
+        if info['reason'] == "recovered":
+            logging.info(f"Valve {VALVE_NAMES[valve_idx]} ON for the remaining {info['duration']:.1f} minutes")
+            # The run is already in the history from before the restart; keep
+            # its row so the water metered from now on is still recorded
+            event = self.history.latest(zone=VALVE_NAMES[valve_idx])
+            if event and event['litres'] is None:
+                self._open_rows[valve_idx] = (event.pop('id'), event)
+            return
+
+        metrics.scheduler_drift_seconds.observe(info['opened_at'] - info['started_at'], stage="valve")
+
+        weather = forecastCache.forecast_cache.peek() or {'next_high_temp': 75}
+        weather_condition = "Hot" if weather['next_high_temp'] > wateringRules.HOT_WEATHER_THRESHOLD else "Normal"
+        event = {
+            'time': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            'zone': VALVE_NAMES[valve_idx],
+            'duration': info['duration'],
+            'weather': weather_condition
+        }
+        if info['reason'] == "scheduled" and VALVE_NAMES[valve_idx] in self._base_minutes:
+            event['adjustment'] = info['duration'] - self._base_minutes[VALVE_NAMES[valve_idx]]
+        self._open_rows[valve_idx] = (self.history.append(event), event)
+        self.events.publish('history', event)
+        logging.info(f"Valve {VALVE_NAMES[valve_idx]} ON for {info['duration']} minutes")
+
+    def _on_flow_alarm(self, alarm):
+        """Leak detector callback: emergency stop and tell the dashboard"""
+        metrics.flow_alarms.inc(kind=alarm.kind)
+        self.controller.stop_all(reason=alarm.kind)
+        self.events.publish('alarm', alarm._asdict())
+
+    def flow_status(self):
+        """Measured against expected flow and recent alarms; None without a meter"""
+        return self.leaks.status() if self.leaks else None
+
+    def _publish_valve_event(self, valve_idx, active, info):
+        """Valve controller listener that pushes deltas to subscribers"""
+        self.events.publish('valve', {'valve': valve_idx, 'active': active})
+
+    def shutdown(self):
+        """Clean up resources on exit"""
+        logging.info("Cleaning up resources")
+        if self.scheduler:
+            self.scheduler.shutdown()
+        self.controller.stop_all()
+        self.controller.stop()
+        if self.leaks:
+            self.leaks.stop()
+        if self.usage:
+            self.usage.meter.stop()
+        self.journal.close()
+        self.relays.cleanup()
+
+
+class ReadOnlyService:
+    """Dashboard view for when another process drives the valves in-process.
+
+    History comes from the shared database and valve states from the
+    journal the owner writes; commands are refused.
+    """
+
+    def __init__(self, journal_path=valveJournal.JOURNAL_FILE):
+        self.journal_path = journal_path
+        self.history = HistoryStore()
+        self.events = EventBroker()  # Nothing is published; the dashboard polls
+
+    def snapshot(self):
+        runs = valveJournal.read_open_runs(self.journal_path)
+        try:
+            version = os.stat(self.journal_path).st_mtime_ns
+        except FileNotFoundError:
+            version = 0
+        return {'version': version, 'states': [name in runs for name in VALVE_NAMES]}
+
+    def _refuse(self, *args, **kwargs):
+        raise RuntimeError("Valves are controlled by another process")
+
+    turn_on = turn_off = stop_all = run_all = test_zone = plan = run_scheduled = _refuse
+
+    def reload_schedule(self):
+        return False  # The owner sees the new file the next time it loads the schedule
+
+    def history_page(self, page_current=0, page_size=10, sort_by=None, filter_query=None):
+        return self.history.query(page_current, page_size, sort_by, filter_query)
+
+    def history_latest(self):
+        return self.history.latest()
+
+    def history_version(self):
+        return self.history.version()
+
+    def history_usage(self, period='day', buckets=14):
+        return self.history.usage(period, buckets)
+
+    def metrics(self):
+        return metrics.registry.snapshot()
+
+    def flow_status(self):
+        return None
+
+    def shutdown(self):
+        pass
+
+
+# ====================== SERVER ======================
+class _RPCHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        service = self.server.service
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+            except ValueError:
+                self._send({'error': "malformed request"})
+                continue
+
+            method = request.get('method')
+            if method == 'subscribe':
+                self._stream(service.events)
+                return
+
+            response = {'id': request.get('id')}
+            if method not in RPC_METHODS:
+                response['error'] = f"unknown method {method}"
+            else:
+                try:
+                    response['result'] = getattr(service, method)(**request.get('params', {}))
+                except Exception as e:
+                    logging.error(f"RPC {method} failed: {str(e)}")
+                    response['error'] = str(e)
+            self._send(response)
+
+    def _stream(self, events):
+        subscriber = events.subscribe()
+        try:
+            while not getattr(subscriber, 'dropped', False):
+                event, data = subscriber.get()
+                self._send({'event': event, 'data': data})
+        except OSError:
+            pass
+        finally:
+            events.unsubscribe(subscriber)
+
+    def _send(self, message):
+        self.wfile.write(json.dumps(message).encode() + b"\n")
+        self.wfile.flush()
+
+
+class ControlServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path, service):
+        if os.path.exists(path):
+            os.unlink(path)
+        self.service = service
+        super().__init__(path, _RPCHandler)
+        os.chmod(path, 0o660)
+
+
+# ====================== CLIENT ======================
+class ControlClient:
+    """Thin client exposing the service's RPC methods"""
+
+    def __init__(self, path=SOCKET_PATH, timeout=10):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+        self._ids = itertools.count(1)
+        self._events = None
+
+    def call(self, method, **params):
+        request = json.dumps({'id': next(self._ids), 'method': method, 'params': params})
+        while True:
+            reused = getattr(self._local, 'conn', None) is not None
+            conn = self._connection()
+            conn['sock'].settimeout(SLOW_CALL_TIMEOUT if method in SLOW_METHODS else self.timeout)
+            try:
+                conn['file'].write(request.encode() + b"\n")
+                conn['file'].flush()
+            except (BrokenPipeError, ConnectionResetError):
+                self._close_connection(conn)
+                # A cached socket the daemon had already closed: nothing was
+                # delivered, so it is safe to send once more on a fresh one
+                if not reused:
+                    raise
+                continue
+            except OSError:
+                self._close_connection(conn)
+                raise
+            try:
+                line = conn['file'].readline()
+            except OSError:
+                # The daemon may have acted on the request; never send it twice
+                self._close_connection(conn)
+                raise
+            if not line:
+                self._close_connection(conn)
+                raise ConnectionError("control daemon closed the connection")
+            break
+        response = json.loads(line)
+        if 'error' in response:
+            raise RuntimeError(response['error'])
+        return response.get('result')
+
+    def __getattr__(self, name):
+        if name in RPC_METHODS:
+            return lambda **params: self.call(name, **params)
+        raise AttributeError(name)
+
+    @property
+    def events(self):
+        """Local EventBroker fed by a subscription to the daemon"""
+        if self._events is None:
+            self._events = EventBroker()
+            threading.Thread(target=self._relay_events, name="control-events", daemon=True).start()
+        return self._events
+
+    def shutdown(self):
+        pass
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            sock.connect(self.path)
+            conn = self._local.conn = {'sock': sock, 'file': sock.makefile('rwb')}
+        return conn
+
+    def _close_connection(self, conn):
+        self._local.conn = None
+        conn['sock'].close()
+
+    def _relay_events(self):
+        while True:
+            try:
+                with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+                    sock.connect(self.path)
+                    stream = sock.makefile('rwb')
+                    stream.write(json.dumps({'method': 'subscribe'}).encode() + b"\n")
+                    stream.flush()
+                    for line in stream:
+                        message = json.loads(line)
+                        self._events.publish(message['event'], message['data'])
+            except (OSError, ValueError) as e:
+                logging.warning(f"Control daemon event stream lost: {str(e)}")
+            time.sleep(3)
+
+
+def connect(path=SOCKET_PATH):
+    """ControlClient for a running daemon, or None if there is none"""
+    if not os.path.exists(path):
+        return None
+    client = ControlClient(path)
+    try:
+        client.call('history_version')
+    except (OSError, RuntimeError):
+        return None
+    return client
+
+
+def main():
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s'
+    )
+
+    service = ControlService()
+    server = ControlServer(SOCKET_PATH, service)
+    signal.signal(signal.SIGTERM, lambda *args: threading.Thread(target=server.shutdown).start())
+    # kill -HUP after editing schedules.json by hand
+    signal.signal(signal.SIGHUP, lambda *args: threading.Thread(target=service.reload_schedule).start())
+    logging.info(f"Control daemon listening on {SOCKET_PATH}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if os.path.exists(SOCKET_PATH):
+            os.unlink(SOCKET_PATH)
+        service.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+"""Local stand-in for forecast.weather.gov and api.weather.gov.
+
+    python fakeWeatherServer.py --pages recorded/ --port 8090 --delay 0.3
+    OPENVALVES_FORECAST_URL='http://127.0.0.1:8090/MapClick.php?lat={lat}&lon={lon}' \\
+        OPENVALVES_API_URL='http://127.0.0.1:8090' python weatherForecast.py
+
+Serves recorded MapClick pages (*.html) and api.weather.gov forecast
+documents (*.json) from a directory in turn, or generated ones when no
+directory is given. Each response waits --delay seconds to stand in for
+the network. Faults can be injected at random: 500 errors (--fault-rate),
+requests that hang for HANG_SECONDS (--hang-rate) and pages that parse to
+nothing (--garbage-rate). Request counts, injected faults and the peak
+number of requests in flight are kept for benchmarks (see fleetHub.py
+--bench and forecastGuard.py --check).
+"""
+
+import argparse
+import itertools
+import json
+import random
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import urlsplit
+
+GRID_DEGREES = 0.025  # size of a fake grid cell, close to the NWS 2.5 km grid
+HANG_SECONDS = 30  # how long a "hung" request stalls before answering
+
+PERIODS = ["Today", "Tonight", "Monday", "Monday Night", "Tuesday", "Tuesday Night"]
+
+
+def sample_page(high=82):
+    """A small MapClick page in the layout ForecastPageParser reads"""
+    tombstones = []
+    details = []
+    for i, period in enumerate(PERIODS):
+        day = i % 2 == 0
+        temp = f"High: {high + i} &deg;F" if day else f"Low: {high - 30 + i} &deg;F"
+        text = f"Sunny, with a {'high' if day else 'low'} near {high + i if day else high - 30 + i}."
+        tombstones.append(
+            f'<li class="forecast-tombstone"><div class="tombstone-container">'
+            f'<p class="period-name">{period}</p><p><img alt="{period}: {text}"></p>'
+            f'<p class="short-desc">Sunny</p><p class="temp">{temp}</p></div></li>')
+        details.append(f'<div class="row row-forecast"><div class="forecast-label"><b>{period}</b></div>'
+                       f'<div class="forecast-text">{text}</div></div>')
+    return (
+        '<html><body><div id="current-conditions"><p class="myforecast-current-lrg">'
+        f'{high - 20}&deg;F</p></div><div id="seven-day-forecast-body"><ul id="seven-day-forecast-list">'
+        + ''.join(tombstones) + '</ul></div><div id="detailed-forecast-body">'
+        + ''.join(details) + '</div></body></html>')
+
+
+def sample_forecast(high=82):
+    """A small api.weather.gov forecast document"""
+    periods = [{
+        'name': period,
+        'isDaytime': i % 2 == 0,
+        'temperature': high + i if i % 2 == 0 else high - 30 + i,
+        'temperatureUnit': 'F',
+        'probabilityOfPrecipitation': {'value': None},
+        'shortForecast': 'Sunny',
+        'detailedForecast': 'Sunny.',
+    } for i, period in enumerate(PERIODS)]
+    return {'properties': {'periods': periods}}
+
+
+class FakeWeatherServer:
+    """Threaded HTTP server answering the URLs weatherForecast requests"""
+
+    def __init__(self, pages=None, delay=0.0, host='127.0.0.1', port=0,
+                 fault_rate=0.0, hang_rate=0.0, garbage_rate=0.0, seed=None):
+        self.delay = delay
+        self.fault_rate = fault_rate
+        self.hang_rate = hang_rate
+        self.garbage_rate = garbage_rate
+        self._random = random.Random(seed)
+        self.faults = Counter()  # kind -> injected count
+        html = sorted(Path(pages).glob('*.html')) if pages else []
+        documents = sorted(Path(pages).glob('*.json')) if pages else []
+        self._html = itertools.cycle([p.read_bytes() for p in html] or [sample_page().encode()])
+        self._json = itertools.cycle(
+            [p.read_bytes() for p in documents] or [json.dumps(sample_forecast()).encode()])
+        self.requests = Counter()  # first path segment -> count
+        self.peak_in_flight = 0
+        self._in_flight = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def forecast_url(self):
+        """Value for weatherForecast.FORECAST_URL"""
+        return self.url + "/MapClick.php?lat={lat}&lon={lon}"
+
+    def serve_forever(self):
+        self._server.serve_forever()
+
+    def start(self):
+        """Serve from a background thread"""
+        self._thread = threading.Thread(target=self.serve_forever, name="fake-weather", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def reset(self):
+        with self._lock:
+            self.requests.clear()
+            self.faults.clear()
+            self.peak_in_flight = 0
+
+    def pick_fault(self):
+        """'error', 'hang', 'garbage' or None for the next request"""
+        with self._lock:
+            roll = self._random.random()
+            for kind, rate in (('error', self.fault_rate), ('hang', self.hang_rate),
+                               ('garbage', self.garbage_rate)):
+                if roll < rate:
+                    self.faults[kind] += 1
+                    return kind
+                roll -= rate
+        return None
+
+    def respond(self, path, query):
+        """(status, content type, body) for one request"""
+        if path == '/MapClick.php':
+            with self._lock:
+                return 200, 'text/html; charset=utf-8', next(self._html)
+        if path.startswith('/points/'):
+            lat, lon = (float(v) for v in path[len('/points/'):].split(','))
+            x, y = round(lat / GRID_DEGREES), round(lon / GRID_DEGREES)
+            base = f"{self.url}/gridpoints/FAKE/{x},{y}"
+            body = {'properties': {'gridId': 'FAKE', 'gridX': x, 'gridY': y,
+                                   'forecast': base + '/forecast',
+                                   'forecastHourly': base + '/forecast/hourly'}}
+            return 200, 'application/geo+json', json.dumps(body).encode()
+        if path.endswith('/forecast/hourly'):
+            body = {'properties': {'periods': [{'temperature': 62}]}}
+            return 200, 'application/geo+json', json.dumps(body).encode()
+        if path.endswith('/forecast'):
+            with self._lock:
+                return 200, 'application/geo+json', next(self._json)
+        return 404, 'text/plain', b'not found'
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                parts = urlsplit(self.path)
+                with server._lock:
+                    server.requests[parts.path.split('/')[1]] += 1
+                    server._in_flight += 1
+                    server.peak_in_flight = max(server.peak_in_flight, server._in_flight)
+                try:
+                    fault = server.pick_fault()
+                    if server.delay or fault == 'hang':
+                        time.sleep(HANG_SECONDS if fault == 'hang' else server.delay)
+                    if fault == 'error':
+                        status, content_type, body = 500, 'text/plain', b'upstream error'
+                    elif fault == 'garbage':
+                        status, content_type, body = 200, 'text/html', b'<html>Service maintenance</html>'
+                    else:
+                        status, content_type, body = server.respond(parts.path, parts.query)
+                    self.send_response(status)
+                    self.send_header('Content-Type', content_type)
+                    self.send_header('Content-Length', str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                finally:
+                    with server._lock:
+                        server._in_flight -= 1
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve recorded weather.gov pages locally")
+    parser.add_argument('--pages', help="directory of recorded .html/.json pages")
+    parser.add_argument('--port', type=int, default=8090)
+    parser.add_argument('--delay', type=float, default=0.0, help="seconds to wait before each response")
+    parser.add_argument('--fault-rate', type=float, default=0.0, help="share of 500 responses")
+    parser.add_argument('--hang-rate', type=float, default=0.0, help="share of requests that hang")
+    parser.add_argument('--garbage-rate', type=float, default=0.0, help="share of unparseable pages")
+    args = parser.parse_args()
+
+    server = FakeWeatherServer(args.pages, args.delay, port=args.port, fault_rate=args.fault_rate,
+                               hang_rate=args.hang_rate, garbage_rate=args.garbage_rate)
+    print(f"Serving on {server.url} (FORECAST_URL={server.forecast_url})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(dict(server.requests), dict(server.faults))
+
+
+if __name__ == "__main__":
+    main()
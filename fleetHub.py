@@ -0,0 +1,355 @@
+#!/usr/bin/env python3
+"""Fleet hub: one process fetching forecasts for many irrigation sites.
+
+    python fleetHub.py                         # serve the sites in sites.json
+    python fleetHub.py --bench --sites 40      # against fakeWeatherServer
+
+Sites are listed in SITES_FILE::
+
+    {"sites": {"home": {"lat": 44.5912, "lon": -123.2721},
+               "farm": {"lat": 44.6301, "lon": -123.1043}}}
+
+Sites are grouped by forecast grid cell (the real NWS grid with the api
+backend, a GRID_DEGREES lattice otherwise) and each cell has one
+ForecastCache, so controllers a few hundred metres apart share a fetch.
+Stale cells are refreshed in parallel on a bounded worker pool, with the
+deadline and circuit breakers of forecastGuard (one set per cell), and
+every request weatherForecast makes passes through a per-host token bucket.
+
+Controllers use the hub instead of weather.gov with::
+
+    OPENVALVES_FORECAST_BACKEND=hub OPENVALVES_FLEET_HUB=http://hub.local:8051
+"""
+
+import argparse
+import functools
+import json
+import logging
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlsplit
+
+import forecastGuard
+import weatherForecast
+from forecastCache import FORECAST_TTL, ForecastCache
+
+SITES_FILE = Path(os.environ.get("OPENVALVES_SITES_FILE", Path(__file__).with_name("sites.json")))
+FLEET_PORT = int(os.environ.get("OPENVALVES_FLEET_PORT", 8051))
+FLEET_WORKERS = int(os.environ.get("OPENVALVES_FLEET_WORKERS", 8))
+HOST_RATE = float(os.environ.get("OPENVALVES_FLEET_HOST_RATE", 2))  # requests per second per host
+HOST_BURST = 4
+GRID_DEGREES = 0.025  # about the 2.5 km NWS forecast grid
+REFRESH_INTERVAL = 60  # seconds between checks for stale cells
+MAX_ADHOC_CELLS = int(os.environ.get("OPENVALVES_FLEET_MAX_ADHOC", 64))  # ?lat=&lon= cells kept, least recent dropped
+
+
+class TokenBucket:
+    """Allow rate requests per second on average, with bursts of burst"""
+
+    def __init__(self, rate, burst, clock=time.monotonic, sleep=time.sleep):
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock
+        self.sleep = sleep
+        self._tokens = burst
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Take a token, sleeping until one is available"""
+        while True:
+            with self._lock:
+                now = self.clock()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait_for = (1 - self._tokens) / self.rate
+            self.sleep(wait_for)
+
+
+class HostLimiter:
+    """One TokenBucket per host name; install as weatherForecast.host_limiter"""
+
+    def __init__(self, rate=HOST_RATE, burst=HOST_BURST):
+        self.rate = rate
+        self.burst = burst
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, host):
+        with self._lock:
+            bucket = self._buckets.get(host)
+            if bucket is None:
+                bucket = self._buckets[host] = TokenBucket(self.rate, self.burst)
+        bucket.acquire()
+
+
+def grid_cell(lat, lon, backend):
+    """Key shared by every location with the same forecast"""
+    if backend == 'api':
+        points = weatherForecast.grid_point(lat, lon)
+        return f"{points['gridId']}/{points['gridX']},{points['gridY']}"
+    return f"{round(lat / GRID_DEGREES) * GRID_DEGREES:.3f},{round(lon / GRID_DEGREES) * GRID_DEGREES:.3f}"
+
+
+def check_coordinates(lat, lon):
+    """ValueError unless lat and lon are finite and on the globe"""
+    if not (math.isfinite(lat) and math.isfinite(lon)):
+        raise ValueError("lat and lon must be finite")
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        raise ValueError(f"coordinates out of range: {lat}, {lon}")
+
+
+def load_sites(path=SITES_FILE):
+    """{name: {'lat': .., 'lon': ..}} from the sites file"""
+    with open(path, 'r') as f:
+        sites = json.load(f)['sites']
+    for name, site in sites.items():
+        if not isinstance(site.get('lat'), (int, float)) or not isinstance(site.get('lon'), (int, float)):
+            raise ValueError(f"site {name} needs numeric lat and lon")
+    return sites
+
+
+class _Cell:
+    """Sites sharing one forecast; fetched at the first site's coordinates"""
+
+    def __init__(self, key, lat, lon, cache, breakers):
+        self.key = key
+        self.lat = lat
+        self.lon = lon
+        self.cache = cache
+        self.breakers = breakers  # provider -> CircuitBreaker, for this cell only
+        self.sites = []
+
+
+class FleetHub:
+    """Location-keyed forecast caches refreshed on a bounded worker pool"""
+
+    def __init__(self, sites=None, backend=None, workers=FLEET_WORKERS, ttl=FORECAST_TTL,
+                 limiter=None):
+        self.backend = backend or weatherForecast.FORECAST_BACKEND
+        if self.backend == 'hub':
+            raise ValueError("the fleet hub cannot fetch from another hub")
+        self.ttl = ttl
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="fleet")
+        self.cells = {}  # grid cell -> _Cell
+        self.site_cells = {}  # site name -> grid cell
+        self._adhoc = OrderedDict()  # cells only asked for by coordinates, least recent first
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        weatherForecast.host_limiter = limiter or HostLimiter()
+        # Keep every site's grid lookup cached next to the ad-hoc ones
+        weatherForecast.POINTS_CACHE_SIZE = max(weatherForecast.POINTS_CACHE_SIZE,
+                                                len(sites or {}) + MAX_ADHOC_CELLS)
+
+        # Grid lookups can hit the network with the api backend; do them on the pool
+        sites = sites or {}
+        keys = self.pool.map(lambda site: grid_cell(site['lat'], site['lon'], self.backend), sites.values())
+        for (name, site), key in zip(sites.items(), keys):
+            self._cell(key, site['lat'], site['lon']).sites.append(name)
+            self.site_cells[name] = key
+
+    def _cell(self, key, lat, lon, adhoc=False):
+        with self._lock:
+            cell = self.cells.get(key)
+            if cell is None:
+                # Own breakers, so one failing location does not stop the others' refreshes
+                breakers = {}
+                fetch = functools.partial(forecastGuard.fetch_forecast, [self.backend], lat, lon,
+                                          registry=breakers)
+                cell = self.cells[key] = _Cell(key, lat, lon, ForecastCache(fetch, ttl=self.ttl, path=None),
+                                               breakers)
+                if adhoc:
+                    self._adhoc[key] = cell
+            elif not adhoc:
+                self._adhoc.pop(key, None)  # a configured site now keeps it
+            if key in self._adhoc:
+                self._adhoc.move_to_end(key)
+                while len(self._adhoc) > MAX_ADHOC_CELLS:
+                    evicted, _ = self._adhoc.popitem(last=False)
+                    del self.cells[evicted]
+            return cell
+
+    def forecast(self, site=None, lat=None, lon=None, block=True):
+        """Cached forecast for a named site or any location"""
+        if site is not None:
+            cell = self.cells[self.site_cells[site]]
+        else:
+            check_coordinates(lat, lon)
+            cell = self._cell(grid_cell(lat, lon, self.backend), lat, lon, adhoc=True)
+        return cell.cache.get(block=block)
+
+    def refresh_all(self, force=False):
+        """Refresh every cell past its TTL in parallel; returns how many ran"""
+        with self._lock:
+            cells = [cell for cell in self.cells.values() if force or not cell.cache.is_fresh()]
+        futures = [self.pool.submit(cell.cache.refresh) for cell in cells]
+        wait(futures)
+        for cell, future in zip(cells, futures):
+            if future.exception():
+                logging.error(f"Refresh of {cell.key} failed: {str(future.exception())}")
+        return len(futures)
+
+    def status(self):
+        """Per-cell summary: sites, forecast age and breaker states"""
+        now = time.time()
+        with self._lock:
+            cells = list(self.cells.values())
+        summary = {}
+        for cell in cells:
+            forecast = cell.cache.peek()
+            summary[cell.key] = {
+                'sites': cell.sites,
+                'age': round(now - forecast['fetched_at']) if forecast else None,
+                'next_high_temp': forecast['next_high_temp'] if forecast else None,
+                'breakers': {name: breaker.state for name, breaker in list(cell.breakers.items())},
+            }
+        return summary
+
+    # ---------------------- background refresh ----------------------
+    def start(self, interval=REFRESH_INTERVAL):
+        self._thread = threading.Thread(target=self._run, args=(interval,), name="fleet-refresh", daemon=True)
+        self._thread.start()
+
+    def _run(self, interval):
+        while True:
+            try:
+                refreshed = self.refresh_all()
+                if refreshed:
+                    logging.info(f"Refreshed {refreshed} of {len(self.cells)} forecast cells")
+            except Exception as e:
+                logging.error(f"Fleet refresh error: {str(e)}")
+            if self._stop.wait(interval):
+                return
+
+    def shutdown(self):
+        self._stop.set()
+        self.pool.shutdown(wait=False)
+
+
+# ====================== HTTP API ======================
+class _Handler(BaseHTTPRequestHandler):
+    """GET /forecast?site=name or ?lat=..&lon=.., and GET /sites"""
+
+    hub = None
+
+    def do_GET(self):
+        parts = urlsplit(self.path)
+        query = {key: values[0] for key, values in parse_qs(parts.query).items()}
+        try:
+            if parts.path == '/forecast':
+                if 'site' in query:
+                    body = self.hub.forecast(site=query['site'])
+                else:
+                    body = self.hub.forecast(lat=float(query['lat']), lon=float(query['lon']))
+            elif parts.path == '/sites':
+                body = self.hub.status()
+            else:
+                return self._send(404, {'error': 'not found'})
+        except (KeyError, ValueError) as e:
+            return self._send(400, {'error': f"bad request: {str(e)}"})
+        self._send(200, body or weatherForecast.error_forecast("no forecast yet"))
+
+    def _send(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        logging.debug(f"{self.address_string()} {format % args}")
+
+
+def serve(hub, port=FLEET_PORT):
+    handler = type('Handler', (_Handler,), {'hub': hub})
+    server = ThreadingHTTPServer(('0.0.0.0', port), handler)
+    server.daemon_threads = True
+    logging.info(f"Fleet hub serving {len(hub.site_cells)} sites in {len(hub.cells)} cells on port {port}")
+    server.serve_forever()
+
+
+# ====================== BENCHMARK ======================
+def benchmark(site_count=40, per_cell=4, workers=FLEET_WORKERS, delay=0.3, host_rate=50):
+    """Refresh site_count sites against a local fake weather.gov.
+
+    Compares one fetch per site in turn (every Pi for itself) with the hub
+    on one worker and on the pool. per_cell sites share each grid cell.
+    """
+    from fakeWeatherServer import FakeWeatherServer
+
+    server = FakeWeatherServer(delay=delay).start()
+    weatherForecast.FORECAST_URL = server.forecast_url
+    weatherForecast.API_BASE_URL = server.url
+    sites = {}
+    for i in range(site_count):
+        cell, member = divmod(i, per_cell)
+        # Sites in a cell sit a few hundred metres apart around its centre
+        sites[f"site{i}"] = {'lat': 44.0 + cell * GRID_DEGREES * 2 + member * 0.002,
+                             'lon': -123.0 + member * 0.002}
+
+    print(f"{site_count} sites, {per_cell} per cell, {delay * 1000:.0f} ms upstream latency")
+    print(f"{'mode':<16} {'wall (s)':>9} {'requests':>9} {'peak in flight':>15}")
+
+    def report(mode, run):
+        server.reset()
+        start = time.perf_counter()
+        run()
+        wall = time.perf_counter() - start
+        print(f"{mode:<16} {wall:>9.2f} {sum(server.requests.values()):>9} {server.peak_in_flight:>15}")
+
+    try:
+        report("per site", lambda: [weatherForecast.get_weather_forecast('html', s['lat'], s['lon'])
+                                    for s in sites.values()])
+        for pool_size in (1, workers):
+            hub = FleetHub(sites, backend='html', workers=pool_size, limiter=HostLimiter(host_rate, HOST_BURST))
+            report(f"hub x{pool_size}", lambda: hub.refresh_all(force=True))
+            hub.shutdown()
+    finally:
+        weatherForecast.host_limiter = None
+        server.stop()
+
+
+def main():
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s'
+    )
+
+    parser = argparse.ArgumentParser(description="Fetch forecasts for many irrigation sites")
+    parser.add_argument('--sites-file', default=SITES_FILE)
+    parser.add_argument('--port', type=int, default=FLEET_PORT)
+    parser.add_argument('--workers', type=int, default=FLEET_WORKERS)
+    parser.add_argument('--bench', action='store_true', help="benchmark against fakeWeatherServer")
+    parser.add_argument('--sites', type=int, default=40, help="sites for --bench")
+    parser.add_argument('--per-cell', type=int, default=4, help="sites sharing a grid cell for --bench")
+    parser.add_argument('--delay', type=float, default=0.3, help="fake upstream latency for --bench")
+    args = parser.parse_args()
+
+    if args.bench:
+        logging.getLogger().setLevel(logging.WARNING)
+        benchmark(args.sites, args.per_cell, args.workers, args.delay)
+        return
+
+    hub = FleetHub(load_sites(args.sites_file), workers=args.workers)
+    hub.start()
+    try:
+        serve(hub, args.port)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        hub.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,215 @@
+"""Shared forecast cache for the dashboard, scheduler and cron runner.
+
+One cache entry is kept in memory and mirrored to FORECAST_CACHE_FILE so that
+app.py and valveControl.py reuse each other's results. Within a process,
+concurrent callers wait on the fetch that is already running (single flight);
+across processes an flock on the lock file serialises refreshes. When a
+refresh fails the last good forecast is kept and returned with the error in
+'upstream_error', so callers can show how old it is and why.
+"""
+
+import copy
+import fcntl
+import json
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+
+import forecastGuard
+
+FORECAST_CACHE_FILE = Path(__file__).with_name("forecast_cache.json")
+FORECAST_TTL = int(os.environ.get("OPENVALVES_FORECAST_TTL", 1800))  # seconds
+FORECAST_STALE_TTL = int(os.environ.get("OPENVALVES_FORECAST_STALE_TTL", 6 * 3600))
+
+
+class _Flight:
+    """A fetch in progress that other callers can wait on"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+
+
+class ForecastCache:
+    """TTL cache with stale-while-revalidate and single-flight refreshes"""
+
+    def __init__(self, fetch, ttl=FORECAST_TTL, stale_ttl=FORECAST_STALE_TTL,
+                 path=FORECAST_CACHE_FILE, clock=time.time):
+        self.fetch = fetch
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.path = Path(path) if path else None
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._entry = None
+        self._disk_mtime = None
+        self._flight = None
+        self.last_error = None  # error of the latest failed refresh, until one succeeds
+
+    def get(self, block=True):
+        """Return a forecast, refreshing it if it is older than the TTL.
+
+        Entries past the TTL but within the stale window are returned at once
+        while a background refresh runs. With block=False a missing or
+        expired entry also triggers a background refresh and None is returned
+        if nothing is cached yet.
+        """
+        entry = self._load()
+        age = self._age(entry)
+
+        if age is not None and age < self.ttl:
+            return self._result(entry)
+        if age is not None and (age < self.stale_ttl or not block):
+            self.refresh_async()
+            return self._result(entry)
+        if not block:
+            self.refresh_async()
+            return None
+        return self.refresh()
+
+    def is_fresh(self):
+        """True if the cached entry is younger than the TTL"""
+        age = self._age(self._load())
+        return age is not None and age < self.ttl
+
+    def peek(self):
+        """Return the cached forecast without ever fetching"""
+        return self._result(self._load())
+
+    def refresh(self):
+        """Fetch now, or wait for the fetch that is already in flight"""
+        with self._lock:
+            flight = self._flight
+            leader = flight is None
+            if leader:
+                flight = self._flight = _Flight()
+
+        if not leader:
+            flight.done.wait()
+            return flight.result
+
+        try:
+            flight.result = self._fetch_and_store()
+        finally:
+            with self._lock:
+                self._flight = None
+            flight.done.set()
+        return flight.result
+
+    def refresh_async(self):
+        """Start a refresh in the background unless one is already running"""
+        with self._lock:
+            if self._flight is not None:
+                return
+        threading.Thread(target=self.refresh, name="forecast-refresh", daemon=True).start()
+
+    def _fetch_and_store(self):
+        started = self.clock()
+        with self._process_lock():
+            # Another process may have refreshed while we waited for the lock
+            entry = self._load()
+            if entry and entry['fetched_at'] >= started:
+                return self._result(entry)
+
+            forecast = self.fetch()
+            if forecast.get('error'):
+                logging.warning(f"Forecast refresh failed: {forecast['error']}")
+                self.last_error = forecast['error']
+                if entry:
+                    return self._result(entry)
+                return forecast
+
+            entry = {'fetched_at': self.clock(), 'forecast': forecast}
+            with self._lock:
+                self._entry = entry
+                self.last_error = None
+            self._save(entry)
+            return self._result(entry)
+
+    def _age(self, entry):
+        if not entry:
+            return None
+        return self.clock() - entry['fetched_at']
+
+    def _result(self, entry):
+        if not entry:
+            return None
+        forecast = copy.deepcopy(entry['forecast'])
+        forecast['fetched_at'] = entry['fetched_at']
+        if self.last_error:
+            forecast['upstream_error'] = self.last_error
+        return forecast
+
+    def _load(self):
+        """Current entry, picking up newer results written by other processes"""
+        if self.path is None:
+            return self._entry
+        try:
+            mtime = self.path.stat().st_mtime_ns
+        except FileNotFoundError:
+            return self._entry
+        if mtime == self._disk_mtime:
+            return self._entry
+
+        try:
+            with open(self.path, 'r') as f:
+                entry = json.load(f)
+        except (OSError, ValueError) as e:
+            logging.error(f"Error reading forecast cache: {str(e)}")
+            return self._entry
+
+        with self._lock:
+            self._disk_mtime = mtime
+            if not self._entry or entry['fetched_at'] > self._entry['fetched_at']:
+                self._entry = entry
+            return self._entry
+
+    def _save(self, entry):
+        if self.path is None:
+            return
+        tmp_path = self.path.with_suffix('.tmp')
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(entry, f)
+            os.replace(tmp_path, self.path)
+            self._disk_mtime = self.path.stat().st_mtime_ns
+        except OSError as e:
+            logging.error(f"Error writing forecast cache: {str(e)}")
+
+    def _process_lock(self):
+        return _FileLock(self.path.with_suffix('.lock') if self.path else None)
+
+
+class _FileLock:
+    """Exclusive flock held for the duration of a with block"""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+
+    def __enter__(self):
+        if self.path is not None:
+            self._file = open(self.path, 'a')
+            fcntl.flock(self._file, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        if self._file is not None:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+            self._file.close()
+            self._file = None
+
+
+forecast_cache = ForecastCache(forecastGuard.fetch_forecast)
+
+
+def get_forecast(block=True):
+    """Cached forecast shared by every caller in this process"""
+    return forecast_cache.get(block=block)
+
+
+def refresh_forecast():
+    """Force a refresh, joining one that is already running"""
+    return forecast_cache.refresh()
@@ -0,0 +1,125 @@
+"""Server-side SVG chart of the forecast highs.
+
+The dashboard shows the forecast as a plain <img>, so phones download a few
+kilobytes of SVG instead of the Plotly bundle and figure JSON. Charts are
+cached by a hash of the data they draw; the hash doubles as the ETag and as
+a version in the image URL, so an unchanged forecast is never redrawn and
+never downloaded twice.
+"""
+
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from html import escape
+
+WIDTH = 640
+HEIGHT = 320
+MARGIN = {'top': 40, 'right': 16, 'bottom': 64, 'left': 48}
+BAR_COLOR = 'indianred'
+RAIN_COLOR = 'steelblue'
+
+
+def chart_data(weather):
+    """The parts of a forecast the chart draws"""
+    if not weather:
+        return {'state': 'loading'}
+    highs = [
+        [f['period'], f['temp_value'], f.get('description', ''), f.get('precip_chance', 0)]
+        for f in weather.get('forecast_data', []) if f.get('is_high') and f.get('temp_value') is not None
+    ]
+    if not highs:
+        return {'state': 'error' if weather.get('error') else 'empty'}
+    return {'state': 'ok', 'highs': highs}
+
+
+def chart_key(data):
+    return hashlib.sha1(json.dumps(data, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def _message(title, text):
+    return (
+        f'<text x="{WIDTH / 2}" y="24" text-anchor="middle" font-size="16">{escape(title)}</text>'
+        f'<text x="{WIDTH / 2}" y="{HEIGHT / 2}" text-anchor="middle" fill="#666">{escape(text)}</text>'
+    )
+
+
+def render_svg(data):
+    """SVG document for chart_data() output"""
+    parts = [
+        f'<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 {WIDTH} {HEIGHT}" '
+        f'width="100%" font-family="sans-serif" font-size="12">'
+    ]
+    if data['state'] == 'loading':
+        parts.append(_message("Loading Forecast...", "Please wait"))
+    elif data['state'] != 'ok':
+        parts.append(_message("No Forecast Data Available", "Check connection"))
+    else:
+        highs = data['highs']
+        plot_w = WIDTH - MARGIN['left'] - MARGIN['right']
+        plot_h = HEIGHT - MARGIN['top'] - MARGIN['bottom']
+        top = max(t for _, t, _, _ in highs)
+        scale_max = max(10, (top // 10 + 1) * 10)
+        slot = plot_w / len(highs)
+        bar_w = slot * 0.7
+        base_y = MARGIN['top'] + plot_h
+
+        parts.append(f'<text x="{WIDTH / 2}" y="24" text-anchor="middle" font-size="16">Weather Forecast</text>')
+        for tick in range(0, scale_max + 1, max(10, scale_max // 5 // 10 * 10)):
+            y = base_y - plot_h * tick / scale_max
+            parts.append(f'<line x1="{MARGIN["left"]}" x2="{WIDTH - MARGIN["right"]}" y1="{y:.1f}" '
+                         f'y2="{y:.1f}" stroke="#eee"/>')
+            parts.append(f'<text x="{MARGIN["left"] - 6}" y="{y + 4:.1f}" text-anchor="end">{tick}</text>')
+        parts.append(f'<text transform="translate(14 {MARGIN["top"] + plot_h / 2}) rotate(-90)" '
+                     f'text-anchor="middle">Temperature (°F)</text>')
+
+        for i, (period, temp, desc, chance) in enumerate(highs):
+            x = MARGIN['left'] + slot * i + (slot - bar_w) / 2
+            h = plot_h * max(temp, 0) / scale_max
+            cx = x + bar_w / 2
+            parts.append(
+                f'<rect x="{x:.1f}" y="{base_y - h:.1f}" width="{bar_w:.1f}" height="{h:.1f}" '
+                f'fill="{BAR_COLOR}"><title>{escape(period)}: {temp}°F, {escape(desc)}</title></rect>')
+            parts.append(f'<text x="{cx:.1f}" y="{base_y - h - 4:.1f}" text-anchor="middle">{temp}°</text>')
+            parts.append(f'<text x="{cx:.1f}" y="{base_y + 16:.1f}" text-anchor="middle">{escape(period)}</text>')
+            if chance:
+                parts.append(f'<text x="{cx:.1f}" y="{base_y + 32:.1f}" text-anchor="middle" '
+                             f'fill="{RAIN_COLOR}">{chance}% rain</text>')
+    parts.append('</svg>')
+    return ''.join(parts)
+
+
+class ChartCache:
+    """The last few rendered charts, keyed by chart_key()"""
+
+    def __init__(self, size=4, chart_data=chart_data, render=render_svg):
+        self.size = size
+        self.chart_data = chart_data
+        self.render = render
+        self._lock = threading.Lock()
+        self._charts = OrderedDict()
+
+    def get(self, weather):
+        """(key, svg) for a forecast, rendering it only if it is new"""
+        data = self.chart_data(weather)
+        key = chart_key(data)
+        with self._lock:
+            svg = self._charts.get(key)
+            if svg is not None:
+                self._charts.move_to_end(key)
+                return key, svg
+
+        svg = self.render(data)
+        with self._lock:
+            self._charts[key] = svg
+            while len(self._charts) > self.size:
+                self._charts.popitem(last=False)
+        return key, svg
+
+    def lookup(self, key):
+        """A chart rendered earlier, or None"""
+        with self._lock:
+            return self._charts.get(key)
+
+
+chart_cache = ChartCache()
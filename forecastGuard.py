@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+"""Deadlines, hedged requests and circuit breakers for forecast retrieval.
+
+    python forecastGuard.py --check --fault-rate 0.1 --hang-rate 0.02
+
+fetch_forecast() asks the providers in FORECAST_PROVIDERS (weatherForecast
+backends, e.g. "html,api") for a forecast. The first starts at once; if it
+has not produced a valid forecast after HEDGE_DELAY, or fails, the next one
+starts too, cycling through the list up to HEDGE_ROUNDS times, and the
+first valid answer wins. Nothing waits past FORECAST_DEADLINE.
+
+Each provider has a CircuitBreaker. After BREAKER_FAILURES consecutive
+failures (errors, empty pages or answers past the deadline) it opens and
+the provider is skipped for a backoff that doubles on every reopening, up
+to BREAKER_MAX_BACKOFF. Once the backoff ends, one trial request decides
+whether it closes again. With every breaker open, fetch_forecast fails
+straight away and ForecastCache keeps serving the last good forecast,
+whose age the dashboard shows. Callers fetching for several locations
+(fleetHub) pass their own breakers per location, so one bad location
+cannot stop the others.
+
+--check runs fetches against two fault-injecting fakeWeatherServer
+instances and fails unless the error rate and latency stay within budget.
+"""
+
+import argparse
+import json
+import logging
+import os
+import queue
+import sys
+import threading
+import time
+
+import metrics
+import weatherForecast
+
+FORECAST_PROVIDERS = [p.strip() for p in os.environ.get(
+    "OPENVALVES_FORECAST_PROVIDERS", weatherForecast.FORECAST_BACKEND).split(',') if p.strip()]
+FORECAST_DEADLINE = float(os.environ.get("OPENVALVES_FORECAST_DEADLINE", 20))  # seconds, end to end
+HEDGE_DELAY = float(os.environ.get("OPENVALVES_FORECAST_HEDGE_DELAY", 3))  # before asking the next provider
+HEDGE_ROUNDS = 2  # times each provider may be asked within one deadline
+BREAKER_FAILURES = 5
+BREAKER_BACKOFF = 60  # seconds open after the first trip
+BREAKER_MAX_BACKOFF = 3600
+
+
+class ForecastUnavailable(Exception):
+    """No provider produced a valid forecast in time"""
+
+
+class CircuitBreaker:
+    """closed -> open after repeated failures -> half-open trial -> closed"""
+
+    def __init__(self, name, failures=BREAKER_FAILURES, backoff=BREAKER_BACKOFF,
+                 max_backoff=BREAKER_MAX_BACKOFF, clock=time.monotonic):
+        self.name = name
+        self.failures = failures
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._state = 'closed'
+        self._consecutive = 0
+        self._trips = 0
+        self._open_until = 0
+        self._trial = False
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._state == 'open' and self.clock() >= self._open_until:
+                return 'half-open'
+            return self._state
+
+    def allow(self):
+        """True if a request may go out now (claims the trial when half-open)"""
+        with self._lock:
+            if self._state == 'closed':
+                return True
+            if self.clock() < self._open_until or self._trial:
+                return False
+            self._trial = True
+            return True
+
+    def record(self, ok):
+        with self._lock:
+            self._trial = False
+            if ok:
+                self._state = 'closed'
+                self._consecutive = 0
+                self._trips = 0
+                return
+            self._consecutive += 1
+            if self._state == 'closed' and self._consecutive < self.failures:
+                return
+            backoff = min(self.max_backoff, self.backoff * 2 ** self._trips)
+            self._trips += 1
+            self._state = 'open'
+            self._open_until = self.clock() + backoff
+        logging.warning(f"Forecast provider {self.name} unhealthy; retrying in {backoff:.0f} s")
+        metrics.forecast_breaker_trips.inc(backend=self.name)
+
+    def status(self):
+        with self._lock:
+            return {'state': self._state, 'failures': self._consecutive,
+                    'retry_in': max(0, round(self._open_until - self.clock()))}
+
+
+breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def breaker(provider, registry=None):
+    """The provider's breaker in registry (a dict), by default the process-wide one"""
+    registry = breakers if registry is None else registry
+    with _breakers_lock:
+        if provider not in registry:
+            registry[provider] = CircuitBreaker(provider)
+        return registry[provider]
+
+
+def is_valid(forecast):
+    return bool(forecast) and not forecast.get('error') and bool(forecast.get('forecast_data'))
+
+
+def fetch_forecast(providers=None, lat=weatherForecast.FORECAST_LAT, lon=weatherForecast.FORECAST_LON,
+                   deadline=None, hedge_delay=None, registry=None):
+    """Fastest valid forecast from the providers, or error_forecast()
+
+    registry is a dict of breakers for this location; None shares the
+    process-wide ones.
+    """
+    try:
+        return hedged_fetch(providers or FORECAST_PROVIDERS, lat, lon,
+                            FORECAST_DEADLINE if deadline is None else deadline,
+                            HEDGE_DELAY if hedge_delay is None else hedge_delay, registry)
+    except ForecastUnavailable as e:
+        logging.error(f"Forecast unavailable: {str(e)}")
+        return weatherForecast.error_forecast(e)
+
+
+def hedged_fetch(providers, lat, lon, deadline, hedge_delay, registry=None):
+    """Race providers, starting each hedge_delay after the last; raises ForecastUnavailable"""
+    start = time.monotonic()
+    end = start + deadline
+    waiting = list(providers) * HEDGE_ROUNDS
+    results = queue.Queue()
+    running = 0
+    errors = []
+    next_start = start
+    while True:
+        now = time.monotonic()
+        if waiting and now >= next_start:
+            provider = _next_allowed(waiting, registry)
+            if provider is not None:
+                _launch(provider, lat, lon, end, results, registry)
+                running += 1
+                next_start = now + hedge_delay
+        if not running:
+            if not errors:
+                raise ForecastUnavailable(f"every provider is backing off ({', '.join(providers)})")
+            break
+        timeout = min(end, next_start) if waiting else end
+        try:
+            provider, forecast, error = results.get(timeout=max(0, timeout - time.monotonic()))
+        except queue.Empty:
+            if time.monotonic() >= end:
+                errors.append(f"deadline of {deadline:.1f} s passed")
+                break
+            continue
+        running -= 1
+        if error is None:
+            return forecast
+        errors.append(f"{provider}: {error}")
+        next_start = time.monotonic()  # Hedge at once after a failure
+
+    raise ForecastUnavailable('; '.join(errors))
+
+
+def _next_allowed(waiting, registry):
+    # Breakers are asked only when a provider is about to be used, so an
+    # unused hedge never claims a half-open breaker's trial request
+    while waiting:
+        provider = waiting.pop(0)
+        if breaker(provider, registry).allow():
+            return provider
+    return None
+
+
+def _launch(provider, lat, lon, end, results, registry):
+    def run():
+        started = time.monotonic()
+        weatherForecast.set_deadline(end)
+        forecast = weatherForecast.get_weather_forecast(provider, lat, lon)
+        late = time.monotonic() > end
+        ok = is_valid(forecast) and not late
+        breaker(provider, registry).record(ok)
+        if ok:
+            error = None
+        elif late:
+            error = f"answered after the deadline ({time.monotonic() - started:.1f} s)"
+        else:
+            error = forecast.get('error') or "no forecast periods"
+        results.put((provider, forecast, error))
+
+    # A stuck provider is abandoned at the deadline; its thread ends with the socket timeout
+    threading.Thread(target=run, name=f"forecast-{provider}", daemon=True).start()
+
+
+# ====================== OFFLINE CHECK ======================
+def check(runs=100, deadline=2.0, hedge_delay=0.3, fault_rate=0.1, hang_rate=0.02, garbage_rate=0.03,
+          delay=0.05, max_error_rate=0.01):
+    """Fetch runs times from two faulty fake servers; True if within budget"""
+    from fakeWeatherServer import FakeWeatherServer
+
+    faults = dict(fault_rate=fault_rate, hang_rate=hang_rate, garbage_rate=garbage_rate)
+    html_server = FakeWeatherServer(delay=delay, seed=1, **faults).start()
+    api_server = FakeWeatherServer(delay=delay, seed=2, **faults).start()
+    weatherForecast.FORECAST_URL = html_server.forecast_url
+    weatherForecast.API_BASE_URL = api_server.url
+    breakers.clear()
+
+    latencies = []
+    failures = 0
+    try:
+        for _ in range(runs):
+            start = time.perf_counter()
+            try:
+                hedged_fetch(['html', 'api'], weatherForecast.FORECAST_LAT, weatherForecast.FORECAST_LON,
+                             deadline, hedge_delay)
+            except ForecastUnavailable:
+                failures += 1
+            latencies.append(time.perf_counter() - start)
+    finally:
+        html_server.stop()
+        api_server.stop()
+
+    latencies.sort()
+    error_rate = failures / runs
+    worst = latencies[-1]
+    print(f"{runs} fetches, {fault_rate:.0%} errors / {hang_rate:.0%} hangs / {garbage_rate:.0%} bad pages "
+          f"per upstream, deadline {deadline:.1f} s, hedge after {hedge_delay:.1f} s")
+    print(f"error rate {error_rate:.1%} (budget {max_error_rate:.1%})")
+    print(f"latency p50 {latencies[len(latencies) // 2]:.3f} s, "
+          f"p95 {latencies[int(len(latencies) * 0.95)]:.3f} s, max {worst:.3f} s")
+    print(json.dumps({name: b.status() for name, b in breakers.items()}))
+    # Allow a little scheduling slack on top of the deadline
+    return error_rate <= max_error_rate and worst <= deadline + 0.25
+
+
+def main():
+    logging.basicConfig(
+        level=logging.WARNING,
+        format='%(asctime)s - %(levelname)s - %(message)s'
+    )
+
+    parser = argparse.ArgumentParser(description="Fetch a forecast with deadlines, hedging and breakers")
+    parser.add_argument('--check', action='store_true', help="check the budget against fake servers")
+    parser.add_argument('--runs', type=int, default=100)
+    parser.add_argument('--deadline', type=float, default=2.0)
+    parser.add_argument('--hedge-delay', type=float, default=0.3)
+    parser.add_argument('--fault-rate', type=float, default=0.1, help="share of 500 responses")
+    parser.add_argument('--hang-rate', type=float, default=0.02, help="share of requests that never answer")
+    parser.add_argument('--garbage-rate', type=float, default=0.03, help="share of unparseable pages")
+    parser.add_argument('--max-error-rate', type=float, default=0.01)
+    args = parser.parse_args()
+
+    if not args.check:
+        print(json.dumps(fetch_forecast()))
+        return
+    logging.getLogger().setLevel(logging.CRITICAL)  # Injected faults would flood the report
+    ok = check(args.runs, args.deadline, args.hedge_delay, args.fault_rate, args.hang_rate,
+               args.garbage_rate, max_error_rate=args.max_error_rate)
+    print("PASS" if ok else "FAIL")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
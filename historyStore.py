@@ -0,0 +1,258 @@
+"""Persistent watering history.
+
+Events are appended to a SQLite database in WAL mode, indexed by time and by
+zone, so the dashboard can page, sort and filter on the server and never
+hold the whole history in memory.
+
+Daily, weekly (starting Monday) and monthly totals per zone are kept in
+zone_usage and updated with an UPSERT in the same transaction as each
+append, so usage() reads a few rows of the primary key however long the
+history is. "adjustment" is the minutes the weather added to (or took off)
+a scheduled run.
+"""
+
+import logging
+import math
+import re
+import sqlite3
+import threading
+from datetime import date, datetime, timedelta
+from pathlib import Path
+
+HISTORY_DB = Path(__file__).with_name("watering_history.db")
+
+COLUMNS = ('time', 'zone', 'duration', 'weather', 'litres')
+NUMERIC_COLUMNS = ('duration', 'litres')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS watering_events (
+    id INTEGER PRIMARY KEY,
+    time TEXT NOT NULL,
+    zone TEXT NOT NULL,
+    duration NUMERIC NOT NULL,
+    weather TEXT,
+    litres REAL,
+    adjustment REAL
+);
+CREATE INDEX IF NOT EXISTS idx_events_time ON watering_events (time);
+CREATE INDEX IF NOT EXISTS idx_events_zone_time ON watering_events (zone, time);
+CREATE TABLE IF NOT EXISTS zone_usage (
+    period TEXT NOT NULL,
+    bucket TEXT NOT NULL,
+    zone TEXT NOT NULL,
+    runs INTEGER NOT NULL DEFAULT 0,
+    minutes REAL NOT NULL DEFAULT 0,
+    adjustment REAL NOT NULL DEFAULT 0,
+    litres REAL NOT NULL DEFAULT 0,
+    PRIMARY KEY (period, bucket, zone)
+) WITHOUT ROWID;
+"""
+
+# Bucket of an event time per rollup period; weeks are named by their Monday
+PERIODS = {
+    'day': "date(?)",
+    'week': "date(?, 'weekday 0', '-6 days')",
+    'month': "strftime('%Y-%m', ?)",
+}
+
+
+def bucket_names(period, buckets, until=None):
+    """Names of the last buckets days, weeks or months up to until (today), oldest first"""
+    until = until or date.today()
+    if isinstance(until, datetime):
+        until = until.date()
+    if period == 'day':
+        return [(until - timedelta(days=i)).isoformat() for i in reversed(range(buckets))]
+    if period == 'week':
+        monday = until - timedelta(days=until.weekday())
+        return [(monday - timedelta(weeks=i)).isoformat() for i in reversed(range(buckets))]
+    month = until.year * 12 + until.month - 1
+    return [f"{(month - i) // 12:04d}-{(month - i) % 12 + 1:02d}" for i in reversed(range(buckets))]
+
+
+# DataTable filter_query terms, e.g. "{zone} scontains Fig" or "{duration} >= 15"
+_FILTER_TERM = re.compile(
+    r'^\{(?P<column>[^}]+)\}\s+(?P<op>[si]?(?:contains|datestartswith|<=|>=|!=|<|>|=|eq|ne|lt|le|gt|ge))'
+    r'\s+(?P<value>.+)$')
+_OPERATORS = {
+    '=': '=', 'eq': '=', '!=': '!=', 'ne': '!=',
+    '<': '<', 'lt': '<', '<=': '<=', 'le': '<=',
+    '>': '>', 'gt': '>', '>=': '>=', 'ge': '>=',
+}
+
+
+class HistoryStore:
+    """Append-only watering event log"""
+
+    def __init__(self, path=HISTORY_DB):
+        self.path = str(path)
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+            self._migrate(conn)
+
+    @staticmethod
+    def _migrate(conn):
+        """Bring databases created by older versions up to the current schema"""
+        columns = {row['name'] for row in conn.execute("PRAGMA table_info(watering_events)")}
+        if 'litres' not in columns:
+            conn.execute("ALTER TABLE watering_events ADD COLUMN litres REAL")
+        if 'adjustment' not in columns:
+            conn.execute("ALTER TABLE watering_events ADD COLUMN adjustment REAL")
+
+        # Roll up history recorded before zone_usage existed, once
+        if (conn.execute("SELECT 1 FROM zone_usage LIMIT 1").fetchone() is None
+                and conn.execute("SELECT 1 FROM watering_events LIMIT 1").fetchone() is not None):
+            for period, bucket in PERIODS.items():
+                conn.execute(
+                    f"INSERT INTO zone_usage (period, bucket, zone, runs, minutes, adjustment, litres) "
+                    f"SELECT ?, {bucket.replace('?', 'time')}, zone, COUNT(*), SUM(duration), "
+                    f"COALESCE(SUM(adjustment), 0), COALESCE(SUM(litres), 0) "
+                    f"FROM watering_events GROUP BY 2, 3", (period,))
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def append(self, event):
+        """Store one event dict and return its id"""
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "INSERT INTO watering_events (time, zone, duration, weather, adjustment) VALUES (?, ?, ?, ?, ?)",
+                (event['time'], event['zone'], event['duration'], event.get('weather'), event.get('adjustment')))
+            self._roll_up(conn, event['time'], event['zone'], runs=1, minutes=event['duration'],
+                          adjustment=event.get('adjustment') or 0)
+            return cursor.lastrowid
+
+    def set_litres(self, event_id, litres):
+        """Record the metered water for a finished run"""
+        with self._connect() as conn:
+            row = conn.execute("SELECT time, zone, litres FROM watering_events WHERE id = ?",
+                               (event_id,)).fetchone()
+            if row is None:
+                return
+            conn.execute("UPDATE watering_events SET litres = ? WHERE id = ?", (litres, event_id))
+            self._roll_up(conn, row['time'], row['zone'], litres=litres - (row['litres'] or 0))
+            # Bump the revision so version() changes for updates too
+            revision = conn.execute("PRAGMA user_version").fetchone()[0]
+            conn.execute(f"PRAGMA user_version = {revision + 1}")
+
+    @staticmethod
+    def _roll_up(conn, time, zone, runs=0, minutes=0, adjustment=0, litres=0):
+        """Add one event's share to its day, week and month totals"""
+        for period, bucket in PERIODS.items():
+            conn.execute(
+                f"INSERT INTO zone_usage (period, bucket, zone, runs, minutes, adjustment, litres) "
+                f"VALUES (?, {bucket}, ?, ?, ?, ?, ?) "
+                f"ON CONFLICT (period, bucket, zone) DO UPDATE SET "
+                f"runs = runs + excluded.runs, minutes = minutes + excluded.minutes, "
+                f"adjustment = adjustment + excluded.adjustment, litres = litres + excluded.litres",
+                (period, time, zone, runs, minutes, adjustment, litres))
+
+    def usage(self, period='day', buckets=14, until=None):
+        """Per-zone totals for the last buckets days, weeks or months.
+
+        Returns dicts with bucket, zone, runs, minutes, adjustment and
+        litres, oldest bucket first.
+        """
+        if period not in PERIODS:
+            raise ValueError(f"unknown usage period {period}")
+        names = bucket_names(period, buckets, until)
+        rows = self._connect().execute(
+            "SELECT bucket, zone, runs, minutes, adjustment, litres FROM zone_usage "
+            "WHERE period = ? AND bucket BETWEEN ? AND ? ORDER BY bucket, zone",
+            (period, names[0], names[-1])).fetchall()
+        return [dict(row) for row in rows]
+
+    def latest(self, zone=None):
+        """Newest event, or the newest for one zone"""
+        if zone is None:
+            row = self._connect().execute(
+                "SELECT * FROM watering_events ORDER BY id DESC LIMIT 1").fetchone()
+        else:
+            row = self._connect().execute(
+                "SELECT * FROM watering_events WHERE zone = ? ORDER BY time DESC, id DESC LIMIT 1",
+                (zone,)).fetchone()
+        return dict(row) if row else None
+
+    def version(self):
+        """Changes whenever history is appended or updated"""
+        conn = self._connect()
+        newest = conn.execute("SELECT MAX(id) FROM watering_events").fetchone()[0] or 0
+        return newest + conn.execute("PRAGMA user_version").fetchone()[0]
+
+    def query(self, page_current=0, page_size=10, sort_by=None, filter_query=None):
+        """One page of events plus the page count for a DataTable"""
+        where, params = self._where(filter_query)
+        order = self._order(sort_by)
+        conn = self._connect()
+
+        total = conn.execute(
+            f"SELECT COUNT(*) FROM watering_events {where}", params).fetchone()[0]
+        rows = conn.execute(
+            f"SELECT {', '.join(COLUMNS)} FROM watering_events {where} {order} LIMIT ? OFFSET ?",
+            (*params, page_size, (page_current or 0) * page_size)).fetchall()
+        return [dict(row) for row in rows], max(1, math.ceil(total / page_size))
+
+    @staticmethod
+    def _order(sort_by):
+        clauses = []
+        for sort in sort_by or []:
+            if sort.get('column_id') in COLUMNS:
+                direction = "DESC" if sort.get('direction') == 'desc' else "ASC"
+                clauses.append(f"{sort['column_id']} {direction}")
+        clauses.append("id DESC")  # newest first by default
+        return "ORDER BY " + ", ".join(clauses)
+
+    @staticmethod
+    def _where(filter_query):
+        if not filter_query:
+            return "", ()
+
+        clauses = []
+        params = []
+        for term in filter_query.split(' && '):
+            match = _FILTER_TERM.match(term.strip())
+            if not match or match.group('column') not in COLUMNS:
+                logging.warning(f"Ignoring history filter term: {term}")
+                continue
+
+            column = match.group('column')
+            op = match.group('op')
+            value = match.group('value').strip()
+            if len(value) >= 2 and value[0] == value[-1] and value[0] in '"\'`':
+                value = value[1:-1]
+
+            # Optional s/i prefix selects case sensitivity
+            case_insensitive = op[0] == 'i'
+            if op[0] in 'si':
+                op = op[1:]
+
+            if op == 'contains':
+                if case_insensitive:
+                    clauses.append(f"{column} LIKE ? ESCAPE '\\'")
+                    params.append('%' + re.sub(r'([%_\\])', r'\\\1', value) + '%')
+                else:
+                    clauses.append(f"instr({column}, ?) > 0")
+                    params.append(value)
+            elif op == 'datestartswith':
+                clauses.append(f"substr({column}, 1, ?) = ?")
+                params.extend((len(value), value))
+            else:
+                if column in NUMERIC_COLUMNS:
+                    try:
+                        value = float(value)
+                    except ValueError:
+                        continue
+                clauses.append(f"{column} {_OPERATORS[op]} ?")
+                params.append(value)
+
+        if not clauses:
+            return "", ()
+        return "WHERE " + " AND ".join(clauses), tuple(params)
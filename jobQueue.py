@@ -0,0 +1,95 @@
+"""Local background job queue for work too slow for a request handler.
+
+Callbacks submit a job and return at once; the page polls status() for
+progress. Submitting a job whose name is already queued or running returns
+the existing job instead of starting another copy.
+"""
+
+import itertools
+import logging
+import queue
+import threading
+import time
+from collections import OrderedDict
+
+
+class Job:
+    def __init__(self, job_id, name, fn, args):
+        self.id = job_id
+        self.name = name
+        self.fn = fn
+        self.args = args
+        self.state = 'queued'
+        self.progress = 0.0
+        self.message = ""
+        self.result = None
+        self.error = None
+        self.submitted = time.time()
+        self.finished = None
+
+    def report(self, progress, message=""):
+        """Called by the job function to publish progress (0.0 - 1.0)"""
+        self.progress = max(0.0, min(1.0, progress))
+        self.message = message
+
+    def status(self):
+        return {
+            'id': self.id,
+            'name': self.name,
+            'state': self.state,
+            'progress': self.progress,
+            'message': self.message,
+            'error': self.error
+        }
+
+
+class JobQueue:
+    """Worker threads fed from a FIFO, keeping the last few finished jobs"""
+
+    def __init__(self, workers=1, keep=50):
+        self.keep = keep
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._jobs = OrderedDict()
+        self._ids = itertools.count(1)
+        for n in range(workers):
+            threading.Thread(target=self._work, name=f"job-worker-{n}", daemon=True).start()
+
+    def submit(self, name, fn, *args):
+        """Queue fn(job, *args) and return its job id"""
+        with self._lock:
+            for job in self._jobs.values():
+                if job.name == name and job.state in ('queued', 'running'):
+                    return job.id
+            job = Job(next(self._ids), name, fn, args)
+            self._jobs[job.id] = job
+            while len(self._jobs) > self.keep:
+                oldest = next(iter(self._jobs.values()))
+                if oldest.state in ('queued', 'running'):
+                    break
+                self._jobs.popitem(last=False)
+        self._queue.put(job)
+        return job.id
+
+    def status(self, job_id):
+        job = self._jobs.get(job_id)
+        return job.status() if job else None
+
+    def result(self, job_id):
+        job = self._jobs.get(job_id)
+        return job.result if job else None
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            job.state = 'running'
+            try:
+                job.result = job.fn(job, *job.args)
+                job.state = 'done'
+                job.progress = 1.0
+            except Exception as e:
+                logging.error(f"Job {job.name} failed: {str(e)}")
+                job.error = str(e)
+                job.state = 'failed'
+            finally:
+                job.finished = time.time()
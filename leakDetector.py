@@ -0,0 +1,169 @@
+"""Leak and stuck-valve detection from flow telemetry and valve state.
+
+The relay state only says what we asked for; the flow meter says what the
+water is doing. LeakDetector compares the two once per sample:
+
+    leak       - water flowing with every valve closed
+    no_flow    - a zone is open but nothing flows (stuck valve, supply off)
+    high_flow  - far above the open zones' baseline (burst pipe, lost head)
+    low_flow   - far below it (blocked filter, kinked line)
+
+Each sample costs O(1): the flow rate comes from the pulse count difference
+since the previous sample, smoothed with an EWMA, and each zone's baseline
+is an EWMA learned while it runs alone. A condition must hold for
+DEBOUNCE_SAMPLES samples in a row, and transients right after a valve
+change are ignored, before on_alarm is called once for it.
+"""
+
+import logging
+import threading
+import time
+from collections import deque, namedtuple
+
+SAMPLE_INTERVAL = 1.0  # seconds between samples
+SETTLE_SECONDS = 15  # ignore the surge and drain-down after a valve change
+DEBOUNCE_SAMPLES = 5  # consecutive bad samples before an alarm
+RATE_SMOOTHING = 0.3  # EWMA weight of the newest rate sample
+BASELINE_SMOOTHING = 0.02  # EWMA weight when learning a zone's normal flow
+LEAK_LPM = 0.5  # flow with every valve closed that counts as a leak
+NO_FLOW_LPM = 0.2  # below this an open zone is treated as dry
+DEVIATION = 0.5  # allowed fraction above or below the baseline
+GPM_TO_LPM = 3.785
+KEEP_ALARMS = 20
+
+Alarm = namedtuple('Alarm', ['time', 'kind', 'zones', 'rate_lpm', 'expected_lpm'])
+
+
+def classify(rate, open_zones, expected):
+    """Anomaly kind for one smoothed sample, or None"""
+    if not open_zones:
+        return 'leak' if rate > LEAK_LPM else None
+    if rate < NO_FLOW_LPM:
+        return 'no_flow'
+    if expected:
+        if rate > expected * (1 + DEVIATION):
+            return 'high_flow'
+        if rate < expected * (1 - DEVIATION):
+            return 'low_flow'
+    return None
+
+
+class LeakDetector:
+    """Streaming flow anomaly detector fed by a FlowMeter"""
+
+    def __init__(self, meter, baselines=None, on_alarm=None, clock=time.monotonic):
+        self.meter = meter
+        self.on_alarm = on_alarm
+        self.clock = clock
+        # zone -> normal flow in L/min; absent until seeded or learned
+        self.baselines = {zone: lpm for zone, lpm in (baselines or {}).items() if lpm}
+        self.alarms = deque(maxlen=KEEP_ALARMS)
+        self.version = 0  # time of the newest alarm, so it never repeats across restarts
+        self.rate = 0.0  # smoothed L/min
+        self._lock = threading.Lock()
+        self._open = frozenset()
+        self._changed_at = clock()
+        self._last = (self._changed_at, meter.pulses)
+        self._pending = None  # kind being debounced
+        self._strikes = 0
+        self._latched = None  # kind already alarmed, until it clears
+        self._thread = None
+        self._stop = threading.Event()
+
+    def valve_changed(self, zone, active):
+        """Valve controller hook; restarts the settle period"""
+        with self._lock:
+            self._open = self._open | {zone} if active else self._open - {zone}
+            self._changed_at = self.clock()
+            self._pending, self._strikes, self._latched = None, 0, None
+
+    def expected(self):
+        """Baseline flow for the open zones, or None if any is unknown"""
+        with self._lock:
+            return self._expected(self._open)
+
+    def _expected(self, open_zones):
+        if not open_zones or any(zone not in self.baselines for zone in open_zones):
+            return None
+        return sum(self.baselines[zone] for zone in open_zones)
+
+    def sample(self, now=None):
+        """Take one reading; returns the Alarm it raised, if any"""
+        now = self.clock() if now is None else now
+        pulses = self.meter.pulses
+        with self._lock:
+            last_time, last_pulses = self._last
+            self._last = (now, pulses)
+            if now <= last_time:
+                return None
+            instant = self.meter.litres(pulses - last_pulses) * 60 / (now - last_time)
+            self.rate += RATE_SMOOTHING * (instant - self.rate)
+            if now - self._changed_at < SETTLE_SECONDS:
+                return None
+
+            open_zones = self._open
+            expected = self._expected(open_zones)
+            kind = classify(self.rate, open_zones, expected)
+            if kind is None:
+                self._pending, self._strikes, self._latched = None, 0, None
+                if len(open_zones) == 1:
+                    self._learn(next(iter(open_zones)))
+                return None
+            if kind == self._latched:
+                return None
+            if kind != self._pending:
+                self._pending, self._strikes = kind, 0
+            self._strikes += 1
+            if self._strikes < DEBOUNCE_SAMPLES:
+                return None
+
+            alarm = Alarm(time.time(), kind, sorted(open_zones), round(self.rate, 2),
+                          None if expected is None else round(expected, 2))
+            self._latched, self._pending, self._strikes = kind, None, 0
+            self.alarms.append(alarm)
+            self.version = alarm.time
+
+        logging.warning(f"Flow alarm {kind}: {alarm.rate_lpm} L/min with zones {alarm.zones or 'closed'}"
+                        f" (expected {alarm.expected_lpm})")
+        if self.on_alarm:
+            try:
+                self.on_alarm(alarm)
+            except Exception as e:
+                logging.error(f"Flow alarm handler failed: {str(e)}")
+        return alarm
+
+    def _learn(self, zone):
+        baseline = self.baselines.get(zone)
+        if baseline is None:
+            self.baselines[zone] = self.rate
+        else:
+            self.baselines[zone] = baseline + BASELINE_SMOOTHING * (self.rate - baseline)
+
+    def status(self):
+        """JSON-friendly summary for the dashboard"""
+        with self._lock:
+            expected = self._expected(self._open)
+            return {
+                'rate_lpm': round(self.rate, 2),
+                'expected_lpm': None if expected is None else round(expected, 2),
+                'version': self.version,
+                'alarms': [alarm._asdict() for alarm in self.alarms],
+            }
+
+    # ---------------------- background sampling ----------------------
+    def start(self, interval=SAMPLE_INTERVAL):
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, args=(interval,),
+                                            name="leak-detector", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self, interval):
+        while not self._stop.wait(interval):
+            self.sample()
@@ -0,0 +1,72 @@
+"""Server-sent events for the dashboard.
+
+The valve controller publishes state deltas and history appends to an
+EventBroker; every open browser holds one /events stream and receives only
+those changes instead of polling for the full status.
+"""
+
+import json
+import logging
+import queue
+import threading
+
+KEEPALIVE_SEC = 15
+
+
+class EventBroker:
+    """Fan events out to per-client queues"""
+
+    def __init__(self, max_queue=256):
+        self.max_queue = max_queue
+        self._lock = threading.Lock()
+        self._subscribers = set()
+        self._seq = 0
+
+    def subscribe(self):
+        """Queue that receives (event, data) tuples"""
+        subscriber = queue.Queue(self.max_queue)
+        with self._lock:
+            self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def publish(self, event, data):
+        """Send one event to every subscriber; slow clients are dropped"""
+        with self._lock:
+            self._seq += 1
+            message = (event, dict(data, seq=self._seq))
+            subscribers = list(self._subscribers)
+
+        for subscriber in subscribers:
+            try:
+                subscriber.put_nowait(message)
+            except queue.Full:
+                # The browser will reconnect and resync from a fresh poll
+                logging.warning("Dropping slow event stream subscriber")
+                subscriber.dropped = True
+                self.unsubscribe(subscriber)
+
+    def stream(self, keepalive=KEEPALIVE_SEC):
+        """Generator of SSE text for one client"""
+        subscriber = self.subscribe()
+        try:
+            yield "retry: 3000\n\n"
+            while not getattr(subscriber, 'dropped', False):
+                try:
+                    event, data = subscriber.get(timeout=keepalive)
+                    yield _format(event, data)
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+        finally:
+            self.unsubscribe(subscriber)
+
+    def client_count(self):
+        with self._lock:
+            return len(self._subscribers)
+
+
+def _format(event, data):
+    return f"id: {data['seq']}\nevent: {event}\ndata: {json.dumps(data)}\n\n"
@@ -0,0 +1,264 @@
+"""In-process metrics with a Prometheus text exposition.
+
+Counters and histograms are plain Python objects guarded by one lock; the
+dashboard serves registry.render() on /metrics. The control daemon returns
+registry.snapshot() over RPC so the dashboard can merge its numbers in.
+
+An optional sampling profiler (OPENVALVES_PROFILE_MS=<threshold>) samples
+the stacks of instrumented callbacks with sys._current_frames() and keeps
+the folded stacks of calls slower than the threshold for flamegraph tools.
+"""
+
+import functools
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter as _Tally, deque
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+FAST_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.05)
+DRIFT_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1, 5, 15, 60, 300)
+
+PROFILE_MS = float(os.environ.get("OPENVALVES_PROFILE_MS", 0))  # 0 disables
+PROFILE_INTERVAL = 0.005  # seconds between stack samples
+PROFILE_KEEP = 20  # slow calls kept for /metrics/profile
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _label_text(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+class _Metric:
+    kind = None
+    suffix = ''  # appended to the name in the exposition, HELP/TYPE included
+
+    def __init__(self, registry, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._lock = registry._lock
+        self._values = {}
+        registry._metrics[name] = self
+
+    @property
+    def family(self):
+        return self.name + self.suffix
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+
+class Counter(_Metric):
+    kind = 'counter'
+    suffix = '_total'  # Prometheus 0.0.4 text: the family is named like its samples
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _merge(self, values, key, value):
+        values[key] = values.get(key, 0) + value
+
+    def _samples(self, values):
+        for key, value in sorted(values.items()):
+            yield f"{self.family}{_label_text(self.labelnames, key)} {value}"
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, registry, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(registry, name, help_text, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            # [count per bucket..., +Inf count, sum]
+            data = self._values.setdefault(key, [0] * (len(self.buckets) + 1) + [0.0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    data[i] += 1
+                    break
+            else:
+                data[len(self.buckets)] += 1
+            data[-1] += value
+
+    def time(self, **labels):
+        """Context manager that observes the duration of its block"""
+        return _Timer(self, labels)
+
+    def _merge(self, values, key, value):
+        data = values.setdefault(key, [0] * (len(self.buckets) + 1) + [0.0])
+        for i, n in enumerate(value):
+            data[i] += n
+
+    def _samples(self, values):
+        for key, data in sorted(values.items()):
+            cumulative = 0
+            for bound, n in zip(self.buckets + ('+Inf',), data):
+                cumulative += n
+                labels = _label_text(self.labelnames, key, [('le', bound)])
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            yield f"{self.name}_sum{_label_text(self.labelnames, key)} {data[-1]}"
+            yield f"{self.name}_count{_label_text(self.labelnames, key)} {cumulative}"
+
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+
+    def counter(self, name, help_text, labelnames=()):
+        return Counter(self, name, help_text, labelnames)
+
+    def histogram(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return Histogram(self, name, help_text, labelnames, buckets)
+
+    def snapshot(self):
+        """JSON-friendly copy of every value: {name: [[label values, value], ...]}"""
+        with self._lock:
+            return {
+                name: [[list(key), list(value) if isinstance(value, list) else value]
+                       for key, value in metric._values.items()]
+                for name, metric in self._metrics.items()
+            }
+
+    def render(self, merge=()):
+        """Prometheus text format, adding in snapshots from other processes"""
+        lines = []
+        with self._lock:
+            for name, metric in self._metrics.items():
+                values = {key: list(value) if isinstance(value, list) else value
+                          for key, value in metric._values.items()}
+                for snapshot in merge:
+                    for key, value in snapshot.get(name, []):
+                        metric._merge(values, tuple(key), value)
+                lines.append(f"# HELP {metric.family} {metric.help}")
+                lines.append(f"# TYPE {metric.family} {metric.kind}")
+                lines.extend(metric._samples(values))
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+forecast_fetch_seconds = registry.histogram(
+    'openvalves_forecast_fetch_seconds', "Forecast fetch duration", ['backend'])
+forecast_fetch_failures = registry.counter(
+    'openvalves_forecast_fetch_failures', "Forecast fetches that failed", ['backend'])
+forecast_breaker_trips = registry.counter(
+    'openvalves_forecast_breaker_trips', "Times a forecast provider's circuit breaker opened", ['backend'])
+callback_seconds = registry.histogram(
+    'openvalves_callback_seconds', "Dashboard callback latency", ['callback'])
+gpio_write_seconds = registry.histogram(
+    'openvalves_gpio_write_seconds', "Latency of one batched relay write", buckets=FAST_BUCKETS)
+scheduler_drift_seconds = registry.histogram(
+    'openvalves_scheduler_drift_seconds', "Actual minus planned start time",
+    ['stage'], buckets=DRIFT_BUCKETS)
+flow_alarms = registry.counter(
+    'openvalves_flow_alarms', "Leak detector alarms that stopped all valves", ['kind'])
+
+
+# ====================== SAMPLING PROFILER ======================
+class SamplingProfiler:
+    """Samples the stacks of registered threads from one background thread"""
+
+    def __init__(self, threshold_ms=PROFILE_MS, interval=PROFILE_INTERVAL, keep=PROFILE_KEEP):
+        self.threshold = threshold_ms / 1000
+        self.interval = interval
+        self.slow_calls = deque(maxlen=keep)  # (name, seconds, {folded stack: samples})
+        self._lock = threading.Lock()
+        self._active = {}  # thread id -> tally of folded stacks
+        self._thread = None
+
+    @property
+    def enabled(self):
+        return self.threshold > 0
+
+    def start(self):
+        """Begin sampling the calling thread"""
+        tally = _Tally()
+        with self._lock:
+            self._active[threading.get_ident()] = tally
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._sample, name="profiler", daemon=True)
+                self._thread.start()
+        return tally
+
+    def stop(self, name, seconds):
+        with self._lock:
+            tally = self._active.pop(threading.get_ident(), None)
+        if tally is not None and seconds >= self.threshold:
+            self.slow_calls.append((name, seconds, dict(tally)))
+            logging.warning(f"Slow callback {name}: {seconds * 1000:.0f} ms ({sum(tally.values())} samples)")
+
+    def folded(self):
+        """Folded stacks of the kept slow calls, one 'frame;frame count' per line"""
+        lines = []
+        for name, _, stacks in list(self.slow_calls):
+            for stack, count in stacks.items():
+                lines.append(f"{name};{stack} {count}")
+        return '\n'.join(lines) + '\n'
+
+    def _sample(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                active = dict(self._active)
+            if not active:
+                continue
+            frames = sys._current_frames()
+            for thread_id, tally in active.items():
+                frame = frames.get(thread_id)
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                if stack:
+                    tally[';'.join(reversed(stack))] += 1
+
+
+profiler = SamplingProfiler()
+
+
+def timed_callback(name):
+    """Decorator recording a callback's latency (and profile, if enabled)"""
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if profiler.enabled:
+                profiler.start()
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                callback_seconds.observe(elapsed, callback=name)
+                if profiler.enabled:
+                    profiler.stop(name, elapsed)
+        return wrapper
+    return decorate
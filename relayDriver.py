@@ -0,0 +1,401 @@
+"""Relay driver interface shared by the dashboard, cron runner and valve tester.
+
+Backends:
+    rpi             - RPi.GPIO
+    gpiozero        - gpiozero OutputDevice
+    shift_register  - chained 74HC595s bit-banged over three GPIO pins
+    mcp23017        - MCP23017 I2C expanders, 16 outputs each (smbus2)
+    simulated       - in-memory pins that record timestamped transitions
+
+Pins use BCM numbering on the GPIO backends and the output number along the
+chain on the expanders; "active" always means the valve is open and the
+driver takes care of active-low relay boards. write_many() changes several
+outputs at once, in a single latch or bus transaction on the expanders.
+Drivers can also report edges on an input pin (watch_edges), which the flow
+meter uses to count pulses. Choose a backend with OPENVALVES_RELAY_DRIVER or
+valves.json; the default "auto" tries rpi, then gpiozero, and falls back to
+the simulator so the code imports on machines without GPIO.
+"""
+
+import logging
+import os
+import threading
+import time
+
+RELAY_DRIVER = os.environ.get("OPENVALVES_RELAY_DRIVER", "auto")
+
+
+class RelayDriver:
+    """Base relay driver"""
+
+    name = "base"
+
+    def __init__(self, active_low=True):
+        self.active_low = active_low
+        self.pins = []
+
+    def setup(self, pins):
+        """Configure pins as outputs with every relay off"""
+        for pin in pins:
+            if pin not in self.pins:
+                self.pins.append(pin)
+            self._setup_pin(pin)
+        self.write_many({pin: False for pin in pins})
+
+    def write(self, pin, active):
+        raise NotImplementedError
+
+    def write_many(self, changes):
+        """Apply {pin: active}; backends that can do it in one transaction override this"""
+        for pin, active in changes.items():
+            self.write(pin, active)
+
+    def read(self, pin):
+        raise NotImplementedError
+
+    def watch_edges(self, pin, callback):
+        """Call callback(pin) on every falling edge of an input pin"""
+        raise NotImplementedError
+
+    def unwatch_edges(self, pin):
+        pass
+
+    def all_off(self):
+        self.write_many({pin: False for pin in self.pins})
+
+    def cleanup(self):
+        self.all_off()
+
+    def _setup_pin(self, pin):
+        pass
+
+
+class RPiGPIODriver(RelayDriver):
+    name = "rpi"
+
+    def __init__(self, active_low=True):
+        super().__init__(active_low)
+        import RPi.GPIO as GPIO
+        self.GPIO = GPIO
+        GPIO.setmode(GPIO.BCM)
+        GPIO.setwarnings(False)
+        self._on = GPIO.LOW if active_low else GPIO.HIGH
+        self._off = GPIO.HIGH if active_low else GPIO.LOW
+
+    def _setup_pin(self, pin):
+        self.GPIO.setup(pin, self.GPIO.OUT)
+
+    def write(self, pin, active):
+        self.GPIO.output(pin, self._on if active else self._off)
+
+    def write_many(self, changes):
+        if changes:
+            # RPi.GPIO takes parallel lists of channels and levels
+            self.GPIO.output(list(changes), [self._on if active else self._off for active in changes.values()])
+
+    def read(self, pin):
+        return self.GPIO.input(pin) == self._on
+
+    def watch_edges(self, pin, callback):
+        # Edges are timestamped and dispatched from RPi.GPIO's own thread
+        self.GPIO.setup(pin, self.GPIO.IN, pull_up_down=self.GPIO.PUD_UP)
+        self.GPIO.add_event_detect(pin, self.GPIO.FALLING, callback=callback)
+
+    def unwatch_edges(self, pin):
+        self.GPIO.remove_event_detect(pin)
+
+    def cleanup(self):
+        super().cleanup()
+        self.GPIO.cleanup()
+
+
+class GpioZeroDriver(RelayDriver):
+    name = "gpiozero"
+
+    def __init__(self, active_low=True):
+        super().__init__(active_low)
+        from gpiozero import Device, OutputDevice
+        Device.ensure_pin_factory()  # raises off-Pi when no pin library is usable
+        self._device_class = OutputDevice
+        self._devices = {}
+        self._inputs = {}
+
+    def _setup_pin(self, pin):
+        if pin not in self._devices:
+            self._devices[pin] = self._device_class(
+                pin, active_high=not self.active_low, initial_value=False)
+
+    def write(self, pin, active):
+        if active:
+            self._devices[pin].on()
+        else:
+            self._devices[pin].off()
+
+    def read(self, pin):
+        return bool(self._devices[pin].value)
+
+    def watch_edges(self, pin, callback):
+        from gpiozero import DigitalInputDevice
+        device = DigitalInputDevice(pin, pull_up=True)
+        device.when_activated = lambda: callback(pin)
+        self._inputs[pin] = device
+
+    def unwatch_edges(self, pin):
+        device = self._inputs.pop(pin, None)
+        if device is not None:
+            device.close()
+
+    def cleanup(self):
+        super().cleanup()
+        for device in list(self._devices.values()) + list(self._inputs.values()):
+            device.close()
+        self._devices.clear()
+        self._inputs.clear()
+
+
+class ShiftRegisterDriver(RelayDriver):
+    """74HC595 chain: outputs change together when the latch pin rises"""
+
+    name = "shift_register"
+
+    def __init__(self, active_low=True, data_pin=17, clock_pin=27, latch_pin=22, chips=1):
+        super().__init__(active_low)
+        import RPi.GPIO as GPIO
+        self.GPIO = GPIO
+        GPIO.setmode(GPIO.BCM)
+        GPIO.setwarnings(False)
+        self.data_pin = data_pin
+        self.clock_pin = clock_pin
+        self.latch_pin = latch_pin
+        for pin in (data_pin, clock_pin, latch_pin):
+            GPIO.setup(pin, GPIO.OUT, initial=GPIO.LOW)
+        self._bits = [active_low] * (8 * chips)  # output levels, all relays off
+        self._shift_out()
+
+    def _setup_pin(self, pin):
+        if not 0 <= pin < len(self._bits):
+            raise ValueError(f"output {pin} is beyond the {len(self._bits) // 8}-chip chain")
+
+    def write(self, pin, active):
+        self.write_many({pin: active})
+
+    def write_many(self, changes):
+        for pin, active in changes.items():
+            self._bits[pin] = bool(active) != self.active_low
+        self._shift_out()
+
+    def read(self, pin):
+        return self._bits[pin] != self.active_low
+
+    # Input pins (the flow meter) are still plain GPIO
+    watch_edges = RPiGPIODriver.watch_edges
+    unwatch_edges = RPiGPIODriver.unwatch_edges
+
+    def _shift_out(self):
+        GPIO = self.GPIO
+        GPIO.output(self.latch_pin, GPIO.LOW)
+        # The last chip's QH goes first so output 0 ends up on the first chip's QA
+        for bit in reversed(self._bits):
+            GPIO.output(self.data_pin, GPIO.HIGH if bit else GPIO.LOW)
+            GPIO.output(self.clock_pin, GPIO.HIGH)
+            GPIO.output(self.clock_pin, GPIO.LOW)
+        GPIO.output(self.latch_pin, GPIO.HIGH)
+
+    def cleanup(self):
+        super().cleanup()
+        self.GPIO.cleanup()
+
+
+class Mcp23017Driver(RelayDriver):
+    """MCP23017 expanders; one combined I2C transaction per write_many"""
+
+    name = "mcp23017"
+
+    IODIRA = 0x00
+    OLATA = 0x14  # OLATB follows, so one write sets both ports
+
+    def __init__(self, active_low=True, bus=1, addresses=(0x20,)):
+        super().__init__(active_low)
+        from smbus2 import SMBus, i2c_msg
+        self._msg = i2c_msg
+        self.bus = SMBus(bus)
+        self.addresses = list(addresses)
+        off = 0xFF if active_low else 0x00
+        self._latches = [[off, off] for _ in self.addresses]
+        for address, latch in zip(self.addresses, self._latches):
+            # Latch the off levels before switching the ports to outputs
+            self.bus.write_i2c_block_data(address, self.OLATA, latch)
+            self.bus.write_i2c_block_data(address, self.IODIRA, [0x00, 0x00])
+
+    def _setup_pin(self, pin):
+        if not 0 <= pin < 16 * len(self.addresses):
+            raise ValueError(f"output {pin} is beyond the {len(self.addresses)} expanders")
+
+    def write(self, pin, active):
+        self.write_many({pin: active})
+
+    def write_many(self, changes):
+        dirty = set()
+        for pin, active in changes.items():
+            chip, bit = divmod(pin, 16)
+            port, bit = divmod(bit, 8)
+            if bool(active) != self.active_low:
+                self._latches[chip][port] |= 1 << bit
+            else:
+                self._latches[chip][port] &= ~(1 << bit) & 0xFF
+            dirty.add(chip)
+        if dirty:
+            # Repeated-start messages to every changed chip in a single ioctl
+            self.bus.i2c_rdwr(*[self._msg.write(self.addresses[chip], [self.OLATA] + self._latches[chip])
+                                for chip in sorted(dirty)])
+
+    def read(self, pin):
+        chip, bit = divmod(pin, 16)
+        port, bit = divmod(bit, 8)
+        return bool(self._latches[chip][port] >> bit & 1) != self.active_low
+
+    def cleanup(self):
+        super().cleanup()
+        self.bus.close()
+
+
+class SimulatedDriver(RelayDriver):
+    """In-memory relays; transitions holds (timestamp, pin, active) tuples.
+
+    Each write or write_many counts as one bus transaction in transactions.
+    inject_pulses() plays a synthetic pulse train into watch_edges callbacks.
+    """
+
+    name = "simulated"
+
+    def __init__(self, active_low=True, clock=time.time):
+        super().__init__(active_low)
+        self.clock = clock
+        self.levels = {}
+        self.transitions = []
+        self.transactions = 0
+        self._edge_callbacks = {}
+
+    def write(self, pin, active):
+        self.write_many({pin: active})
+
+    def write_many(self, changes):
+        now = self.clock()
+        for pin, active in changes.items():
+            active = bool(active)
+            if self.levels.get(pin, False) != active:
+                self.transitions.append((now, pin, active))
+            self.levels[pin] = active
+        self.transactions += 1
+
+    def read(self, pin):
+        return self.levels.get(pin, False)
+
+    def watch_edges(self, pin, callback):
+        self._edge_callbacks[pin] = callback
+
+    def unwatch_edges(self, pin):
+        self._edge_callbacks.pop(pin, None)
+
+    def inject_pulses(self, pin, count, rate_hz=None, start=None):
+        """Deliver count edges to pin's callback.
+
+        Without rate_hz the callback receives only the pin, as on real
+        hardware, and timestamps itself. With rate_hz each call also gets a
+        timestamp spaced 1/rate_hz apart from start (default: now), so a
+        virtual-clock test can play a long train in one go.
+        """
+        callback = self._edge_callbacks.get(pin)
+        if callback is None:
+            return 0
+        if rate_hz is None:
+            for _ in range(count):
+                callback(pin)
+        else:
+            start = self.clock() if start is None else start
+            step = 1.0 / rate_hz
+            for i in range(count):
+                callback(pin, start + i * step)
+        return count
+
+
+class RelayBank:
+    """Zone-indexed relays that go out in one batched write per commit.
+
+    The valve controller stages changes with set() while it holds its lock
+    and calls commit() after releasing it, so an emergency stop closes every
+    zone in one transaction. Zones with an inrush time are energised one per
+    write, each after the previous one's inrush. The bank lock is not held
+    while waiting out an inrush, so a close committed meanwhile goes out at
+    once and cancels any staggered open still waiting for that zone.
+    """
+
+    def __init__(self, driver, pins, inrush=None, sleep=time.sleep):
+        self.driver = driver
+        self.pins = list(pins)
+        self.inrush = list(inrush or [0] * len(self.pins))  # seconds per zone
+        self.sleep = sleep
+        self._lock = threading.Lock()
+        self._levels = [False] * len(self.pins)  # as written to the relays
+        self._wanted = [False] * len(self.pins)  # as last committed
+        self._staged = {}
+
+    def set(self, zone_idx, active):
+        with self._lock:
+            self._staged[zone_idx] = bool(active)
+
+    def commit(self):
+        """Write the staged changes; returns the number of transactions"""
+        with self._lock:
+            staged, self._staged = self._staged, {}
+            batch = {}
+            staggered = []
+            for zone_idx, active in staged.items():
+                self._wanted[zone_idx] = active
+                if active and not self._levels[zone_idx] and self.inrush[zone_idx]:
+                    staggered.append(zone_idx)
+                    continue
+                batch[self.pins[zone_idx]] = active
+                self._levels[zone_idx] = active
+            if staggered:
+                # The first inrush zone goes out with everything else
+                batch[self.pins[staggered[0]]] = True
+                self._levels[staggered[0]] = True
+            if not batch:
+                return 0
+            self.driver.write_many(batch)
+
+        writes = 1
+        for previous, zone_idx in zip(staggered, staggered[1:]):
+            self.sleep(self.inrush[previous])
+            with self._lock:
+                if not self._wanted[zone_idx] or self._levels[zone_idx]:
+                    continue  # Closed (or opened by another commit) while waiting
+                self.driver.write_many({self.pins[zone_idx]: True})
+                self._levels[zone_idx] = True
+            writes += 1
+        return writes
+
+
+DRIVERS = {
+    'rpi': RPiGPIODriver,
+    'gpiozero': GpioZeroDriver,
+    'shift_register': ShiftRegisterDriver,
+    'mcp23017': Mcp23017Driver,
+    'simulated': SimulatedDriver,
+}
+
+
+def get_driver(name=None, active_low=True, **options):
+    """Create the configured relay driver; options go to the expander drivers"""
+    name = name or RELAY_DRIVER
+    if name != "auto":
+        return DRIVERS[name](active_low, **options)
+
+    for candidate in ('rpi', 'gpiozero'):
+        try:
+            return DRIVERS[candidate](active_low)
+        except Exception as e:
+            logging.debug(f"Relay driver {candidate} unavailable: {str(e)}")
+    logging.warning("No GPIO library available - using simulated relays")
+    return SimulatedDriver(active_low)
@@ -1,5 +1,8 @@
 #!/bin/bash
 #
+# Cron entry point for running without controlDaemon.py. The daemon fires
+# every scheduled run itself; remove this cron job when it is installed.
+#
 source /home/user/openValves/venv/bin/activate
 
 python3 /home/user/openValves/valveControl.py >> /home/user/openValves/irrigation.log 2>&1
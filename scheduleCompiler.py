@@ -0,0 +1,273 @@
+"""Compile schedules.json rules into an indexed run timeline.
+
+Rules, most specific first:
+
+    "special":   {"2026-07-04": {zone: minutes}}
+    "ranges":    [{"start": "2026-06-01", "end": "2026-08-31",
+                   "weekdays": ["Monday", ...], "durations": {...}}]
+    "intervals": [{"start": "2026-05-01", "every_days": 3, "durations": {...}}]
+    "weekly":    {"Monday": {zone: minutes}}
+    "daily":     {zone: minutes}
+
+Ranges and intervals may carry their own "start_times" and an optional
+"end"; everything else runs at the top-level "start_times" (default 06:00).
+The first rule that matches a date decides that date's durations.
+
+ScheduleCompiler expands the rules over a rolling horizon into a sorted
+list of runs, so "what runs next" and "what runs on date D" are bisect
+lookups. update() diffs the old and new rules and recomputes only the days
+the changed rules can touch.
+"""
+
+import bisect
+import threading
+from collections import namedtuple
+from datetime import datetime, time, timedelta
+
+DEFAULT_START_TIMES = ["06:00"]
+HORIZON_DAYS = 366
+
+DAYS = ['Sunday', 'Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday']
+
+Run = namedtuple('Run', ['when', 'durations', 'rule'])
+
+
+def _parse_date(value, label):
+    try:
+        return datetime.strptime(value, "%Y-%m-%d").date()
+    except (TypeError, ValueError):
+        raise ValueError(f"{label}: invalid date {value!r}")
+
+
+def _parse_times(values, label):
+    if not isinstance(values, list) or not values:
+        raise ValueError(f"{label}: start_times must be a non-empty list")
+    times = []
+    for value in values:
+        try:
+            times.append(datetime.strptime(value, "%H:%M").time())
+        except (TypeError, ValueError):
+            raise ValueError(f"{label}: invalid start time {value!r}")
+    return tuple(sorted(set(times)))
+
+
+def _as_date(day):
+    return day.date() if isinstance(day, datetime) else day
+
+
+class Rule:
+    """One schedule entry: which dates it covers and what it waters"""
+
+    def __init__(self, key, durations, start_times, first=None, last=None,
+                 weekdays=None, every_days=None):
+        self.key = key
+        self.durations = dict(durations)
+        self.start_times = start_times
+        self.first = first
+        self.last = last
+        self.weekdays = weekdays
+        self.every_days = every_days
+
+    def matches(self, day):
+        if self.first is not None and day < self.first:
+            return False
+        if self.last is not None and day > self.last:
+            return False
+        if self.weekdays is not None and day.strftime("%A") not in self.weekdays:
+            return False
+        if self.every_days is not None and (day - self.first).days % self.every_days:
+            return False
+        return True
+
+    def _identity(self):
+        return (self.durations, self.start_times, self.first, self.last,
+                self.weekdays, self.every_days)
+
+    def __eq__(self, other):
+        return isinstance(other, Rule) and self._identity() == other._identity()
+
+
+def compile_rules(schedules):
+    """Parse schedules.json into rules, highest priority first.
+
+    Raises ValueError for malformed entries.
+    """
+    default_times = _parse_times(schedules.get('start_times', DEFAULT_START_TIMES), "start_times")
+    rules = []
+
+    for date_key, durations in schedules.get('special', {}).items():
+        day = _parse_date(date_key, "special")
+        rules.append(Rule(f"special.{date_key}", durations, default_times, first=day, last=day))
+
+    for kind in ('ranges', 'intervals'):
+        for i, entry in enumerate(schedules.get(kind, [])):
+            label = f"{kind}[{i}]"
+            if not isinstance(entry, dict) or not isinstance(entry.get('durations'), dict):
+                raise ValueError(f"{label} needs a durations object")
+            first = _parse_date(entry.get('start'), label)
+            last = _parse_date(entry['end'], label) if entry.get('end') else None
+            if kind == 'ranges' and last is None:
+                raise ValueError(f"{label} needs an end date")
+            if last is not None and last < first:
+                raise ValueError(f"{label} ends before it starts")
+            weekdays = entry.get('weekdays')
+            if weekdays is not None:
+                unknown = set(weekdays) - set(DAYS)
+                if unknown:
+                    raise ValueError(f"{label}: unknown weekdays {sorted(unknown)}")
+                weekdays = frozenset(weekdays)
+            every_days = None
+            if kind == 'intervals':
+                every_days = entry.get('every_days')
+                if not isinstance(every_days, int) or every_days < 1:
+                    raise ValueError(f"{label}: every_days must be a positive integer")
+            times = _parse_times(entry['start_times'], label) if 'start_times' in entry else default_times
+            rules.append(Rule(label, entry['durations'], times, first=first, last=last,
+                              weekdays=weekdays, every_days=every_days))
+
+    for weekday, durations in schedules.get('weekly', {}).items():
+        rules.append(Rule(f"weekly.{weekday}", durations, default_times,
+                          weekdays=frozenset([weekday])))
+
+    if 'daily' in schedules:
+        rules.append(Rule("daily", schedules['daily'], default_times))
+    return rules
+
+
+def resolve(rules, day):
+    """The rule that decides a date, or None"""
+    for rule in rules:
+        if rule.matches(day):
+            return rule
+    return None
+
+
+class ScheduleCompiler:
+    """Sorted run timeline over a rolling horizon"""
+
+    def __init__(self, schedules=None, start=None, horizon_days=HORIZON_DAYS):
+        self.horizon_days = horizon_days
+        # The schedule watcher recompiles while the scheduler thread looks up runs
+        self._lock = threading.RLock()
+        self.rules = []
+        self._start = _as_date(start or datetime.now())
+        self._end = self._start  # exclusive
+        self._days = {}  # date -> deciding Rule or None
+        self._times = []  # sorted run datetimes
+        self._runs = []  # Run tuples, parallel to _times
+        if schedules is not None:
+            self.update(schedules)
+
+    def update(self, schedules):
+        """Recompile after a schedule change; returns the number of days recomputed"""
+        with self._lock:
+            new_rules = compile_rules(schedules)
+            old_by_key = {rule.key: rule for rule in self.rules}
+            new_by_key = {rule.key: rule for rule in new_rules}
+            order_changed = [r.key for r in self.rules if r.key in new_by_key] != \
+                            [r.key for r in new_rules if r.key in old_by_key]
+            self.rules = new_rules
+
+            if not self._days or order_changed:
+                self._rebuild(self._start, self._start + timedelta(days=self.horizon_days))
+                return self.horizon_days
+
+            # Both versions of a changed rule: days it used to win and days it may win now
+            changed = []
+            for key in old_by_key.keys() | new_by_key.keys():
+                old, new = old_by_key.get(key), new_by_key.get(key)
+                if old != new:
+                    changed += [rule for rule in (old, new) if rule is not None]
+
+            touched = 0
+            for day in self._affected_days(changed):
+                self._compile_day(day)
+                touched += 1
+            return touched
+
+    def durations_on(self, day):
+        """Durations of the rule that decides a date ({} if none does)"""
+        with self._lock:
+            day = _as_date(day)
+            rule = self._rule_for(day)
+            return dict(rule.durations) if rule else {}
+
+    def runs_on(self, day):
+        """Runs on one date, in start-time order"""
+        with self._lock:
+            day = _as_date(day)
+            self._ensure(day)
+            start = datetime.combine(day, time.min)
+            lo = bisect.bisect_left(self._times, start)
+            hi = bisect.bisect_left(self._times, start + timedelta(days=1))
+            return self._runs[lo:hi]
+
+    def next_run(self, after=None):
+        """First run strictly after a datetime, or None within the horizon"""
+        with self._lock:
+            after = after or datetime.now()
+            self._ensure(after.date())
+            # Keep the horizon a full window ahead of the query
+            self._ensure(after.date() + timedelta(days=self.horizon_days - 1))
+            i = bisect.bisect_right(self._times, after)
+            return self._runs[i] if i < len(self._runs) else None
+
+    def last_run(self, at=None):
+        """Latest run at or before a datetime on the same day, or None"""
+        with self._lock:
+            at = at or datetime.now()
+            runs = [run for run in self.runs_on(at.date()) if run.when <= at]
+            return runs[-1] if runs else None
+
+    def runs_between(self, start, end):
+        with self._lock:
+            self._ensure(start.date())
+            self._ensure(end.date())
+            lo = bisect.bisect_left(self._times, start)
+            hi = bisect.bisect_left(self._times, end)
+            return self._runs[lo:hi]
+
+    # ---------------------- internals ----------------------
+    def _rule_for(self, day):
+        if day in self._days:
+            return self._days[day]
+        return resolve(self.rules, day)
+
+    def _ensure(self, day):
+        """Extend the compiled window to cover a date"""
+        if day < self._start:
+            self._rebuild(day, self._end)
+        elif day >= self._end:
+            for offset in range((day - self._end).days + 1):
+                self._compile_day(self._end + timedelta(days=offset))
+            self._end = day + timedelta(days=1)
+
+    def _rebuild(self, start, end):
+        self._start, self._end = start, start
+        self._days, self._times, self._runs = {}, [], []
+        self._ensure(end - timedelta(days=1))
+
+    def _affected_days(self, rules):
+        """Compiled dates any of the rules could match"""
+        days = set()
+        for rule in rules:
+            first = max(rule.first or self._start, self._start)
+            last = min(rule.last or self._end - timedelta(days=1), self._end - timedelta(days=1))
+            for offset in range((last - first).days + 1):
+                day = first + timedelta(days=offset)
+                if rule.matches(day):
+                    days.add(day)
+        return sorted(days)
+
+    def _compile_day(self, day):
+        rule = resolve(self.rules, day)
+        self._days[day] = rule
+        start = datetime.combine(day, time.min)
+        lo = bisect.bisect_left(self._times, start)
+        hi = bisect.bisect_left(self._times, start + timedelta(days=1))
+
+        runs = []
+        if rule and any(minutes > 0 for minutes in rule.durations.values()):
+            runs = [Run(datetime.combine(day, t), rule.durations, rule.key) for t in rule.start_times]
+        self._times[lo:hi] = [run.when for run in runs]
+        self._runs[lo:hi] = runs
@@ -0,0 +1,160 @@
+"""Cached, validated access to schedules.json.
+
+The parsed schedule is cached against the file's (mtime, inode, size), so
+repeated loads cost one stat() call. Saves go through write-temp-then-rename
+so readers never see a half-written file, and registered listeners are told
+about every change, whether it came from save() or from an edit on disk
+found by load() or reload(). Nothing polls the file: the dashboard asks the
+control daemon to reload() after it saves, and the stat() check in load()
+catches edits made by hand.
+"""
+
+import copy
+import json
+import logging
+import os
+import stat
+import tempfile
+import threading
+from pathlib import Path
+
+import scheduleCompiler
+
+SCHEDULE_FILE = Path(__file__).with_name("schedules.json")
+
+DAYS = ['Sunday', 'Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday']
+
+
+def _check_durations(label, durations):
+    if not isinstance(durations, dict):
+        raise ValueError(f"{label} must map zone names to minutes")
+    for zone, minutes in durations.items():
+        if not isinstance(minutes, (int, float)) or minutes < 0:
+            raise ValueError(f"{label}: invalid duration {minutes!r} for {zone}")
+
+
+def validate_schedule(schedules):
+    """Raise ValueError if a schedules dict is malformed"""
+    if not isinstance(schedules, dict):
+        raise ValueError("schedule must be a JSON object")
+    if 'daily' in schedules:
+        _check_durations("daily", schedules['daily'])
+    for day, durations in schedules.get('weekly', {}).items():
+        if day not in DAYS:
+            raise ValueError(f"weekly: unknown day {day!r}")
+        _check_durations(f"weekly.{day}", durations)
+    for date, durations in schedules.get('special', {}).items():
+        _check_durations(f"special.{date}", durations)
+    for kind in ('ranges', 'intervals'):
+        for i, entry in enumerate(schedules.get(kind, [])):
+            _check_durations(f"{kind}[{i}]", entry.get('durations') if isinstance(entry, dict) else None)
+    scheduleCompiler.compile_rules(schedules)  # dates, start times and intervals
+
+
+class ScheduleRepository:
+    """Single point of access to the schedule file"""
+
+    def __init__(self, path=SCHEDULE_FILE, default=None):
+        self.path = Path(path)
+        self.default = default or {"weekly": {}, "special": {}}
+        self._lock = threading.Lock()
+        self._key = None
+        self._schedules = None
+        self._listeners = []
+
+    def add_listener(self, listener):
+        """Call listener(schedules) whenever the schedule changes"""
+        self._listeners.append(listener)
+
+    def ensure_exists(self):
+        if not self.path.exists():
+            self.save(self.default)
+
+    def load(self):
+        """Return the current schedule (a copy callers may modify)"""
+        changed = self._refresh()
+        schedules = copy.deepcopy(self._schedules)
+        if changed:
+            self._notify(schedules)
+        return schedules
+
+    def save(self, schedules):
+        """Validate and atomically replace the schedule file"""
+        validate_schedule(schedules)
+        fd, tmp_path = tempfile.mkstemp(dir=self.path.parent, prefix=".schedules-", suffix=".tmp")
+        try:
+            # mkstemp makes the file 0600; keep the mode other users rely on
+            os.fchmod(fd, self._file_mode())
+            with os.fdopen(fd, 'w') as f:
+                json.dump(schedules, f, indent=2)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+        self._fsync_dir()
+
+        with self._lock:
+            self._key = self._stat_key()
+            self._schedules = copy.deepcopy(schedules)
+        self._notify(copy.deepcopy(schedules))
+
+    def _file_mode(self):
+        """Mode of the existing file, or 0644 for a new one"""
+        try:
+            return stat.S_IMODE(os.stat(self.path).st_mode)
+        except FileNotFoundError:
+            return 0o644
+
+    def reload(self):
+        """Pick up a save made by another process; returns True if the schedule changed"""
+        changed = self._refresh()
+        if changed:
+            self._notify(copy.deepcopy(self._schedules))
+        return changed
+
+    def _stat_key(self):
+        try:
+            st = self.path.stat()
+        except FileNotFoundError:
+            return None
+        return (st.st_mtime_ns, st.st_ino, st.st_size)
+
+    def _refresh(self):
+        """Reparse the file if it changed; returns True when the schedule changed"""
+        key = self._stat_key()
+        with self._lock:
+            if key == self._key and self._schedules is not None:
+                return False
+            previous = self._schedules
+            try:
+                if key is None:
+                    raise FileNotFoundError(self.path)
+                with open(self.path, 'r') as f:
+                    schedules = json.load(f)
+                validate_schedule(schedules)
+            except Exception as e:
+                logging.error(f"Error loading schedule: {str(e)}")
+                schedules = previous if previous is not None else copy.deepcopy(self.default)
+            self._key = key
+            self._schedules = schedules
+            return previous is not None and schedules != previous
+
+    def _fsync_dir(self):
+        try:
+            fd = os.open(self.path.parent, os.O_RDONLY)
+        except OSError:
+            return
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def _notify(self, schedules):
+        for listener in self._listeners:
+            try:
+                listener(schedules)
+            except Exception as e:
+                logging.error(f"Schedule listener error: {str(e)}")
@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+"""Replay a season of schedules and weather on a virtual clock.
+
+The real schedule rules, zone planner and valve controller run against
+simulated relays; the clock jumps straight from one valve deadline to the
+next, so a 180-day season finishes in well under a second.
+
+    python seasonSimulator.py --start 2025-04-01 --days 180 --weather highs.json
+
+The weather file maps "YYYY-MM-DD" to either a forecast high in °F or a full
+forecast dict as returned by weatherForecast. Missing days use 75°F.
+"""
+
+import argparse
+import json
+import sys
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import valveConfig
+import wateringRules
+import zonePlanner
+from scheduleCompiler import ScheduleCompiler
+from relayDriver import SimulatedDriver
+from valveEngine import ValveController
+from waterBalance import WaterBalance
+from weatherForecast import DEFAULT_HIGH_TEMP
+
+# The deployed zones from valves.json, so the simulation checks the real wiring
+ZONE_NAMES = [zone['name'] for zone in valveConfig.load_config()['zones']]
+SCHEDULE_FILE = Path(__file__).with_name("schedules.json")
+
+
+class VirtualClock:
+    """Callable clock whose time only moves when told to"""
+
+    def __init__(self, now):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+    def advance_to(self, when):
+        self.now = max(self.now, when)
+
+
+def load_weather(path):
+    """Read recorded forecasts into {date: forecast dict}"""
+    if not path:
+        return {}
+    with open(path, 'r') as f:
+        recorded = json.load(f)
+    weather = {}
+    for day, value in recorded.items():
+        if isinstance(value, dict):
+            weather[day] = value
+        else:
+            weather[day] = {'next_high_temp': value, 'forecast_data': []}
+    return weather
+
+
+def simulate_season(schedules, start, days, weather=None, zone_names=ZONE_NAMES):
+    """Run every compiled watering run and return the relay transitions"""
+    weather = weather or {}
+    zones, hydraulics = zonePlanner.load_hydraulics(schedules)
+
+    clock = VirtualClock(start.timestamp())
+    relays = SimulatedDriver(clock=clock)
+    relays.setup(range(len(zone_names)))
+    controller = ValveController(zone_names, relays.write, clock=clock, start=False)
+
+    timeline = ScheduleCompiler(schedules, start=start, horizon_days=days)
+    balance = WaterBalance(path=None)  # Kept in memory, apart from the live state
+    for run in timeline.runs_between(start, start + timedelta(days=days)):
+        _advance(controller, clock, run.when.timestamp())
+
+        forecast = weather.get(run.when.strftime("%Y-%m-%d"),
+                               {'next_high_temp': DEFAULT_HIGH_TEMP, 'forecast_data': []})
+        durations = wateringRules.adjust_for_weather(run.durations, forecast)
+        plan = balance.plan(durations, forecast, zones, run.when)
+        balance.commit(plan)
+        plan = zonePlanner.plan_watering(plan['durations'], zone_names, zones, hydraulics, start=run.when)
+        zonePlanner.execute_plan(plan, controller)
+
+    _advance(controller, clock, float('inf'))
+    return relays.transitions
+
+
+def _advance(controller, clock, until):
+    """Fire every event due before until, jumping the clock deadline to deadline"""
+    while True:
+        deadline = controller.next_deadline()
+        if deadline is None or deadline > until:
+            break
+        clock.advance_to(deadline)
+        controller.run_pending(deadline)
+    if until != float('inf'):
+        clock.advance_to(until)
+
+
+def summarize(transitions, zone_names=ZONE_NAMES, zones=None):
+    """Per-zone minutes, runs and gallons plus overlap statistics"""
+    zones = zones or {}
+    report = {name: {'runs': 0, 'minutes': 0.0, 'gallons': 0.0} for name in zone_names}
+    opened = {}
+    open_count = 0
+    overlap_since = None
+    overlap_minutes = 0.0
+    overlaps = 0
+
+    for timestamp, pin, active in sorted(transitions):
+        name = zone_names[pin]
+        if active:
+            opened[pin] = timestamp
+            open_count += 1
+            if open_count == 2:
+                overlaps += 1
+                overlap_since = timestamp
+        elif pin in opened:
+            minutes = (timestamp - opened.pop(pin)) / 60
+            report[name]['runs'] += 1
+            report[name]['minutes'] += minutes
+            report[name]['gallons'] += minutes * (zones.get(name, {}).get('flow_gpm') or 0)
+            open_count -= 1
+            if open_count == 1 and overlap_since is not None:
+                overlap_minutes += (timestamp - overlap_since) / 60
+                overlap_since = None
+
+    for values in report.values():
+        values['minutes'] = round(values['minutes'], 2)
+        values['gallons'] = round(values['gallons'], 2)
+
+    return {
+        'zones': report,
+        'overlaps': overlaps,
+        'overlap_minutes': round(overlap_minutes, 2),
+        'total_minutes': round(sum(v['minutes'] for v in report.values()), 2),
+        'total_gallons': round(sum(v['gallons'] for v in report.values()), 2)
+    }
+
+
+def print_report(report, days, elapsed):
+    print(f"{'Zone':<10} {'Runs':>5} {'Minutes':>9} {'Gallons':>9}")
+    for name, values in report['zones'].items():
+        print(f"{name:<10} {values['runs']:>5} {values['minutes']:>9.1f} {values['gallons']:>9.1f}")
+    print(f"{'Total':<10} {'':>5} {report['total_minutes']:>9.1f} {report['total_gallons']:>9.1f}")
+    print(f"Overlapping runs: {report['overlaps']} ({report['overlap_minutes']:.1f} min)")
+    speedup = days * 86400 / elapsed if elapsed else float('inf')
+    print(f"Simulated {days} days in {elapsed:.3f} s ({speedup:,.0f}x real time)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a watering season on a virtual clock")
+    parser.add_argument('--schedule', default=str(SCHEDULE_FILE))
+    parser.add_argument('--start', default=datetime.now().strftime("%Y-%m-%d"),
+                        help="first day (YYYY-MM-DD)")
+    parser.add_argument('--days', type=int, default=180)
+    parser.add_argument('--weather', help="recorded forecasts, {date: high or forecast}")
+    parser.add_argument('--json', action='store_true', help="print the report as JSON")
+    parser.add_argument('--expect', help="fail unless the report matches this JSON file")
+    args = parser.parse_args()
+
+    with open(args.schedule, 'r') as f:
+        schedules = json.load(f)
+    start = datetime.strptime(args.start, "%Y-%m-%d")
+    weather = load_weather(args.weather)
+
+    began = time.perf_counter()
+    transitions = simulate_season(schedules, start, args.days, weather)
+    elapsed = time.perf_counter() - began
+    zones, _ = zonePlanner.load_hydraulics(schedules)
+    report = summarize(transitions, zones=zones)
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report, args.days, elapsed)
+
+    if args.expect:
+        with open(args.expect, 'r') as f:
+            expected = json.load(f)
+        if expected != report:
+            print("Simulation report differs from expected", file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""Measure how quickly the dashboard comes up after a reboot.
+
+    python startupBenchmark.py --runs 5
+
+Each run imports app in a fresh interpreter (wall time, plus the slowest
+top-level imports reported by -X importtime), then starts app.py on a spare
+port and polls it until the first byte of the page arrives.
+"""
+
+import argparse
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+from pathlib import Path
+
+HERE = Path(__file__).resolve().parent
+
+
+def import_time(module='app', top=5):
+    """(wall seconds, [(cumulative seconds, module), ...]) for one cold import"""
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                            cwd=HERE, capture_output=True, text=True)
+    wall = time.perf_counter() - start
+    if result.returncode:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+
+    # "import time: self [us] | cumulative | imported package"; direct
+    # children of the measured module are indented by three spaces
+    children = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        if name.startswith('   ') and not name.startswith('    '):
+            children.append((int(cumulative) / 1e6, name.strip()))
+    return wall, sorted(children, reverse=True)[:top]
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def time_to_first_byte(timeout=120):
+    """Seconds from launching app.py until / returns its first byte"""
+    port = _free_port()
+    env = dict(os.environ, OPENVALVES_PORT=str(port))
+    start = time.perf_counter()
+    server = subprocess.Popen([sys.executable, 'app.py'], cwd=HERE, env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while time.perf_counter() - start < timeout:
+            if server.poll() is not None:
+                raise RuntimeError(f"app.py exited with {server.returncode}")
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}/", timeout=timeout) as response:
+                    response.read(1)
+                return time.perf_counter() - start
+            except (urllib.error.URLError, ConnectionError):
+                time.sleep(0.05)
+        raise TimeoutError(f"no response within {timeout} s")
+    finally:
+        server.send_signal(signal.SIGINT)  # Lets app.py run its cleanup
+        try:
+            server.wait(10)
+        except subprocess.TimeoutExpired:
+            server.kill()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark dashboard import time and time to first byte")
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--top', type=int, default=5, help="slowest imports to list")
+    args = parser.parse_args()
+
+    print(f"{'run':>3} {'import (s)':>10} {'first byte (s)':>14}")
+    slowest = []
+    for run in range(1, args.runs + 1):
+        wall, slowest = import_time(top=args.top)
+        ttfb = time_to_first_byte()
+        print(f"{run:>3} {wall:>10.2f} {ttfb:>14.2f}")
+
+    print("\nSlowest imports (last run):")
+    for seconds, name in slowest:
+        print(f"  {seconds:>6.3f} s  {name}")
+
+
+if __name__ == "__main__":
+    main()
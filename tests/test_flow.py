@@ -0,0 +1,122 @@
+import pytest
+
+import leakDetector
+from flowMeter import FlowMeter, PulseRing, ZoneUsage
+from relayDriver import SimulatedDriver
+
+PIN = 5
+PULSES_PER_LITRE = 450  # 7.5 Hz per L/min
+
+
+class FakeClock:
+    def __init__(self, now=0.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def driver(clock):
+    return SimulatedDriver(clock=clock)
+
+
+@pytest.fixture
+def meter(driver, clock):
+    meter = FlowMeter(driver, PIN, PULSES_PER_LITRE, ring_size=1024, clock=clock)
+    meter.start()
+    return meter
+
+
+def flow(driver, clock, seconds, lpm, detector=None):
+    """Play seconds of pulses at lpm, sampling the detector once a second; returns its alarms"""
+    alarms = []
+    hz = lpm * PULSES_PER_LITRE / 60
+    for _ in range(seconds):
+        driver.inject_pulses(PIN, round(hz), rate_hz=hz or None, start=clock.now)
+        clock.now += 1
+        if detector is not None:
+            alarm = detector.sample()
+            if alarm:
+                alarms.append(alarm)
+    return alarms
+
+
+def test_pulse_ring_counts_pulses_since_a_time():
+    ring = PulseRing(8)
+    for t in range(5):
+        ring.push(float(t))
+    assert ring.count == 5
+    assert ring.since(2.0) == 3
+    assert ring.since(10.0) == 0
+
+
+def test_pulse_ring_keeps_the_newest_after_wrapping():
+    ring = PulseRing(8)
+    for t in range(20):
+        ring.push(float(t))
+    assert ring.count == 20
+    assert ring.since(15.0) == 5
+    assert ring.since(0.0) == 8  # Older timestamps have been overwritten
+
+
+def test_pulse_ring_size_must_be_a_power_of_two():
+    with pytest.raises(ValueError):
+        PulseRing(1000)
+
+
+def test_meter_rate_from_a_pulse_train(driver, meter, clock):
+    flow(driver, clock, 10, lpm=4)
+    assert meter.pulses == 10 * 30
+    assert meter.rate_lpm(window=5) == pytest.approx(4, rel=0.05)
+
+
+def test_zone_usage_shares_pulses_by_nominal_flow(driver, meter, clock):
+    usage = ZoneUsage(meter, {'Patio': 1.0, 'Fig': 3.0})
+    usage.valve_changed('Patio', True)
+    flow(driver, clock, 60, lpm=2)  # 2 L to Patio alone
+    usage.valve_changed('Fig', True)
+    flow(driver, clock, 60, lpm=8)  # 8 L shared 1:3
+    assert usage.valve_changed('Patio', False) == pytest.approx(4.0)
+    assert usage.valve_changed('Fig', False) == pytest.approx(6.0)
+
+
+def test_flow_with_every_valve_closed_raises_one_leak_alarm(driver, meter, clock):
+    alarms = []
+    detector = leakDetector.LeakDetector(meter, on_alarm=alarms.append, clock=clock)
+    flow(driver, clock, leakDetector.SETTLE_SECONDS, lpm=0, detector=detector)
+    raised = flow(driver, clock, 30, lpm=2, detector=detector)
+    assert [alarm.kind for alarm in raised] == ['leak']
+    assert alarms == raised
+    assert detector.status()['version'] == raised[0].time
+
+
+def test_transients_after_a_valve_change_are_ignored(driver, meter, clock):
+    detector = leakDetector.LeakDetector(meter, clock=clock)
+    detector.valve_changed('Patio', True)
+    detector.valve_changed('Patio', False)
+    # The line drains for a few seconds after the valve closes
+    assert flow(driver, clock, leakDetector.SETTLE_SECONDS - 1, lpm=3, detector=detector) == []
+    assert flow(driver, clock, 30, lpm=0, detector=detector) == []
+
+
+def test_open_zone_without_flow_raises_no_flow(driver, meter, clock):
+    detector = leakDetector.LeakDetector(meter, clock=clock)
+    detector.valve_changed('Fig', True)
+    raised = flow(driver, clock, leakDetector.SETTLE_SECONDS + 10, lpm=0, detector=detector)
+    assert [alarm.kind for alarm in raised] == ['no_flow']
+    assert raised[0].zones == ['Fig']
+
+
+def test_flow_far_above_the_baseline_raises_high_flow(driver, meter, clock):
+    detector = leakDetector.LeakDetector(meter, {'Apple': 10.0}, clock=clock)
+    detector.valve_changed('Apple', True)
+    assert flow(driver, clock, 60, lpm=10, detector=detector) == []
+    raised = flow(driver, clock, 30, lpm=25, detector=detector)
+    assert [alarm.kind for alarm in raised] == ['high_flow']
+    assert raised[0].expected_lpm == pytest.approx(10.0, rel=0.05)
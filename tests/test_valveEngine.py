@@ -0,0 +1,121 @@
+import time
+
+import pytest
+
+from valveEngine import ValveController
+from valveJournal import ValveJournal
+
+ZONES = ['Patio', 'Flowers', 'Fig', 'Apple']
+
+
+class FakeClock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def outputs():
+    return {}
+
+
+@pytest.fixture
+def controller(clock, outputs):
+    commits = []
+    controller = ValveController(ZONES, outputs.__setitem__, clock=clock, start=False,
+                                 commit=lambda: commits.append(dict(outputs)))
+    controller.commits = commits
+    return controller
+
+
+def test_queued_run_opens_and_closes_on_time(controller, clock):
+    controller.queue_run(1, clock.now + 10, 2)
+    assert controller.run_pending(clock.now + 5) == 0
+    assert controller.states() == [False] * 4
+
+    assert controller.run_pending(clock.now + 10) == 1
+    assert controller.states() == [False, True, False, False]
+    assert controller.next_deadline() == clock.now + 10 + 120
+
+    assert controller.run_pending(clock.now + 130) == 1
+    assert controller.states() == [False] * 4
+    assert controller.next_deadline() is None
+
+
+def test_due_events_commit_once_per_tick(controller, clock):
+    for valve_idx in range(len(ZONES)):
+        controller.queue_run(valve_idx, clock.now, 5)
+    assert controller.run_pending() == 4
+    assert controller.commits == [{0: True, 1: True, 2: True, 3: True}]
+
+
+def test_cancel_drops_a_queued_run(controller, clock):
+    run_id = controller.queue_run(0, clock.now + 60, 5)
+    controller.cancel(run_id)
+    assert controller.pending() == 0
+    assert controller.run_pending(clock.now + 3600) == 0
+    assert controller.states() == [False] * 4
+
+
+def test_cancel_leaves_a_running_valve_open(controller, clock):
+    run_id = controller.turn_on(2, 5)
+    controller.cancel(run_id)
+    assert controller.run_pending(clock.now + 3600) == 0
+    assert controller.is_on(2)
+
+
+def test_turn_on_again_rearms_the_shutoff(controller, clock):
+    controller.turn_on(0, 1)
+    clock.now += 30
+    controller.turn_on(0, 2)
+    assert controller.run_pending(clock.now + 60) == 0
+    assert controller.is_on(0)
+    assert controller.run_pending(clock.now + 120) == 1
+    assert not controller.is_on(0)
+
+
+def test_stop_all_closes_valves_and_clears_the_queue(controller, clock):
+    controller.turn_on(0, 10)
+    controller.queue_run(1, clock.now + 60, 10)
+    controller.stop_all()
+    assert controller.states() == [False] * 4
+    assert controller.pending() == 0
+    assert controller.run_pending(clock.now + 3600) == 0
+
+
+def test_listeners_see_each_change(controller, clock):
+    seen = []
+    controller.add_listener(lambda valve_idx, active, info: seen.append((valve_idx, active, info['reason'])))
+    controller.turn_on(3, 1, reason="test")
+    controller.run_pending(clock.now + 60)
+    assert seen == [(3, True, "test"), (3, False, "timer")]
+
+
+def test_restore_resumes_journaled_runs(tmp_path, clock, outputs):
+    path = tmp_path / "journal.log"
+    journal = ValveJournal(path)
+    first = ValveController(ZONES, outputs.__setitem__, clock=clock, start=False, journal=journal)
+    first.turn_on(1, 10)
+    journal.close()  # The process dies with Flowers still open
+
+    journal = ValveJournal(path)
+    runs = journal.open_runs()
+    assert list(runs) == ['Flowers']
+    runs['Apple'] = time.time() - 5  # Overdue by the time we come back
+
+    outputs.clear()
+    restored = ValveController(ZONES, outputs.__setitem__, clock=clock, start=False, journal=journal)
+    assert restored.restore(runs) == ['Flowers']
+    assert restored.states() == [False, True, False, False]
+    assert outputs[3] is False
+    # Still shuts off at the original deadline, not ten minutes from now
+    assert restored.next_deadline() == pytest.approx(clock.now + 600, abs=5)
+    assert journal.open_runs().keys() == {'Flowers'}
+    journal.close()
@@ -0,0 +1,39 @@
+import os
+
+import pytest
+
+import weatherForecast
+
+
+@pytest.mark.parametrize('name', sorted(weatherForecast.FORECAST_FIXTURES))
+def test_saved_pages_parse_as_recorded(name):
+    failures = weatherForecast.check_fixtures({name: weatherForecast.FORECAST_FIXTURES[name]})
+    assert failures == []
+
+
+def test_html_and_api_pages_agree():
+    html = weatherForecast.parse_fixture(os.path.join(weatherForecast.FIXTURE_DIR, 'mapclick_corvallis.html'))
+    api = weatherForecast.parse_fixture(os.path.join(weatherForecast.FIXTURE_DIR, 'gridpoints_forecast.json'))
+    periods = len(html['forecast_data'])
+    keys = ('period', 'temp_value', 'precip_chance', 'precip_in')
+    assert [[p[k] for k in keys] for p in html['forecast_data']] == \
+           [[p[k] for k in keys] for p in api['forecast_data'][:periods]]
+
+
+def test_html_parser_takes_pages_in_chunks():
+    with open(os.path.join(weatherForecast.FIXTURE_DIR, 'mapclick_corvallis.html'), encoding='utf-8') as f:
+        page = f.read()
+    chunks = [page[i:i + 97] for i in range(0, len(page), 97)]
+    assert weatherForecast.parse_forecast_html(chunks) == weatherForecast.parse_forecast_html(page)
+
+
+@pytest.mark.parametrize('text, expected', weatherForecast.PRECIP_SAMPLES)
+def test_precip_wording(text, expected):
+    chance, amount = weatherForecast.parse_precip(text)
+    assert (chance, None if amount is None else round(amount, 3)) == expected
+
+
+def test_empty_page_falls_back_to_the_default_high():
+    forecast = weatherForecast.parse_forecast_html("<html><body></body></html>")
+    assert forecast == {'current_temp': 'N/A', 'next_high_temp': weatherForecast.DEFAULT_HIGH_TEMP,
+                        'forecast_data': []}
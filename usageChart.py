@@ -0,0 +1,125 @@
+"""Server-side SVG chart of watering per zone by day, week or month.
+
+Drawn from the historyStore rollups as stacked bars, one colour per zone,
+with the share of the minutes the weather added (or saved) above each bar.
+Cached and versioned like the forecast chart (see forecastChart).
+"""
+
+from datetime import date
+from html import escape
+
+import historyStore
+from forecastChart import ChartCache
+
+WIDTH = 640
+HEIGHT = 320
+MARGIN = {'top': 40, 'right': 16, 'bottom': 64, 'left': 48}
+ZONE_COLORS = ['steelblue', 'seagreen', 'darkorange', 'orchid', 'goldenrod', 'slategray', 'indianred', 'teal']
+ADJUSTMENT_COLOR = 'indianred'
+TICK_STEPS = [1, 2, 5, 10, 20, 30, 60, 120, 300, 600, 1200, 3000]  # minutes
+PERIOD_TITLES = {'day': "Daily", 'week': "Weekly", 'month': "Monthly"}
+
+
+def chart_data(usage):
+    """The parts of usage() output the chart draws; usage is {'period', 'buckets', 'rows'}"""
+    if not usage:
+        return {'state': 'loading'}
+    period = usage['period']
+    buckets = historyStore.bucket_names(period, usage['buckets'])
+    zones = sorted({row['zone'] for row in usage['rows']})
+    if not zones:
+        return {'state': 'empty', 'period': period}
+    minutes = {zone: [0] * len(buckets) for zone in zones}
+    adjustment = [0] * len(buckets)
+    slots = {bucket: i for i, bucket in enumerate(buckets)}
+    for row in usage['rows']:
+        i = slots.get(row['bucket'])
+        if i is not None:
+            minutes[row['zone']][i] = round(row['minutes'], 1)
+            adjustment[i] = round(adjustment[i] + row['adjustment'], 1)
+    return {'state': 'ok', 'period': period, 'buckets': buckets, 'zones': zones,
+            'minutes': [minutes[zone] for zone in zones], 'adjustment': adjustment}
+
+
+def _label(period, bucket):
+    if period == 'month':
+        return date.fromisoformat(bucket + '-01').strftime('%b')
+    return bucket[5:]  # MM-DD; weeks by their Monday
+
+
+def render_svg(data):
+    """SVG document for chart_data() output"""
+    parts = [
+        f'<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 {WIDTH} {HEIGHT}" '
+        f'width="100%" font-family="sans-serif" font-size="12">'
+    ]
+    if data['state'] == 'loading':
+        parts.append(_message("Loading Usage...", "Please wait"))
+    elif data['state'] != 'ok':
+        parts.append(_message(f"{PERIOD_TITLES[data['period']]} Watering", "No watering in this range yet"))
+    else:
+        period, buckets, zones = data['period'], data['buckets'], data['zones']
+        totals = [sum(column) for column in zip(*data['minutes'])]
+        plot_w = WIDTH - MARGIN['left'] - MARGIN['right']
+        plot_h = HEIGHT - MARGIN['top'] - MARGIN['bottom']
+        top = max(totals) or 1
+        step = next((s for s in TICK_STEPS if top / s <= 5), TICK_STEPS[-1])
+        scale_max = (top // step + 1) * step
+        slot = plot_w / len(buckets)
+        bar_w = slot * 0.7
+        base_y = MARGIN['top'] + plot_h
+        label_every = max(1, len(buckets) // 10)
+
+        parts.append(f'<text x="{WIDTH / 2}" y="24" text-anchor="middle" font-size="16">'
+                     f'{PERIOD_TITLES[period]} Watering</text>')
+        for tick in range(0, int(scale_max) + 1, step):
+            y = base_y - plot_h * tick / scale_max
+            parts.append(f'<line x1="{MARGIN["left"]}" x2="{WIDTH - MARGIN["right"]}" y1="{y:.1f}" '
+                         f'y2="{y:.1f}" stroke="#eee"/>')
+            parts.append(f'<text x="{MARGIN["left"] - 6}" y="{y + 4:.1f}" text-anchor="end">{tick}</text>')
+        parts.append(f'<text transform="translate(14 {MARGIN["top"] + plot_h / 2}) rotate(-90)" '
+                     f'text-anchor="middle">Minutes</text>')
+
+        for i, bucket in enumerate(buckets):
+            x = MARGIN['left'] + slot * i + (slot - bar_w) / 2
+            cx = x + bar_w / 2
+            y = base_y
+            for z, zone in enumerate(zones):
+                value = data['minutes'][z][i]
+                if not value:
+                    continue
+                h = plot_h * value / scale_max
+                y -= h
+                parts.append(
+                    f'<rect x="{x:.1f}" y="{y:.1f}" width="{bar_w:.1f}" height="{h:.1f}" '
+                    f'fill="{ZONE_COLORS[z % len(ZONE_COLORS)]}">'
+                    f'<title>{escape(zone)}, {escape(bucket)}: {value:g} min</title></rect>')
+            adjustment = data['adjustment'][i]
+            if totals[i] and adjustment:
+                share = adjustment / totals[i]
+                parts.append(f'<text x="{cx:.1f}" y="{y - 4:.1f}" text-anchor="middle" font-size="10" '
+                             f'fill="{ADJUSTMENT_COLOR}"><title>Weather: {adjustment:+g} min</title>'
+                             f'{share:+.0%}</text>')
+            if i % label_every == 0:
+                parts.append(f'<text x="{cx:.1f}" y="{base_y + 16:.1f}" text-anchor="middle">'
+                             f'{escape(_label(period, bucket))}</text>')
+
+        # Legend
+        legend_w = (WIDTH - MARGIN['left'] - MARGIN['right']) / max(len(zones), 1)
+        for z, zone in enumerate(zones):
+            x = MARGIN['left'] + legend_w * z
+            parts.append(f'<rect x="{x:.1f}" y="{HEIGHT - 22}" width="10" height="10" '
+                         f'fill="{ZONE_COLORS[z % len(ZONE_COLORS)]}"/>')
+            parts.append(f'<text x="{x + 14:.1f}" y="{HEIGHT - 13}">{escape(zone)}</text>')
+    parts.append('</svg>')
+    return ''.join(parts)
+
+
+def _message(title, text):
+    return (
+        f'<text x="{WIDTH / 2}" y="24" text-anchor="middle" font-size="16">{escape(title)}</text>'
+        f'<text x="{WIDTH / 2}" y="{HEIGHT / 2}" text-anchor="middle" fill="#666">{escape(text)}</text>'
+    )
+
+
+chart_cache = ChartCache(chart_data=chart_data, render=render_svg)
@@ -0,0 +1,78 @@
+"""Zone hardware configuration shared by the daemon, cron runner and tester.
+
+valves.json lists the zones in valve order and how their relays are wired::
+
+    {
+      "driver": "shift_register",
+      "active_low": false,
+      "shift_register": {"data_pin": 17, "clock_pin": 27, "latch_pin": 22, "chips": 4},
+      "zones": [
+        {"name": "Patio", "pin": 0, "inrush_ms": 60},
+        {"name": "Flowers", "pin": 1},
+        ...
+      ]
+    }
+
+"pin" is the BCM pin for direct GPIO drivers and the output number along
+the chain for expanders (0 = first chip's QA or GPA0). "inrush_ms" is how
+long a zone's solenoid draws its pull-in current; no other valve is
+energised in that window. mcp23017 takes {"bus": 1, "addresses": [32, 33]}.
+Without a file the original four zones on GPIO 17, 18, 27 and 22 are used.
+OPENVALVES_RELAY_DRIVER overrides the driver.
+"""
+
+import json
+import os
+from pathlib import Path
+
+VALVES_FILE = Path(os.environ.get("OPENVALVES_VALVES_FILE", Path(__file__).with_name("valves.json")))
+
+DEFAULT_CONFIG = {
+    "driver": "auto",
+    "active_low": True,  # Set to False if your relays activate on HIGH
+    "zones": [
+        {"name": "Patio", "pin": 17},
+        {"name": "Flowers", "pin": 18},
+        {"name": "Fig", "pin": 27},
+        {"name": "Apple", "pin": 22},
+    ],
+}
+
+
+def validate_config(config):
+    """Raise ValueError if a valves config is unusable"""
+    zones = config.get('zones')
+    if not isinstance(zones, list) or not zones:
+        raise ValueError("valves config needs a non-empty 'zones' list")
+    names, pins = set(), set()
+    for zone in zones:
+        name, pin = zone.get('name'), zone.get('pin')
+        if not isinstance(name, str) or not name:
+            raise ValueError(f"zone without a name: {zone}")
+        if not isinstance(pin, int) or pin < 0:
+            raise ValueError(f"zone {name} needs a non-negative integer pin")
+        if name in names or pin in pins:
+            raise ValueError(f"duplicate zone name or pin: {name} / {pin}")
+        inrush = zone.get('inrush_ms', 0)
+        if not isinstance(inrush, (int, float)) or not 0 <= inrush <= 1000:
+            raise ValueError(f"zone {name} inrush_ms must be between 0 and 1000")
+        names.add(name)
+        pins.add(pin)
+
+
+def load_config(path=VALVES_FILE):
+    """Valves config with defaults filled in"""
+    config = dict(DEFAULT_CONFIG)
+    try:
+        with open(path, 'r') as f:
+            config.update(json.load(f))
+    except FileNotFoundError:
+        pass
+    config['driver'] = os.environ.get("OPENVALVES_RELAY_DRIVER") or config['driver']
+    validate_config(config)
+    return config
+
+
+def driver_options(config):
+    """Constructor arguments for the configured driver, e.g. the expander wiring"""
+    return dict(config.get(config['driver'], {}))
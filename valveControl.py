@@ -1,17 +1,16 @@
 #!/usr/bin/env python3
 
-import RPi.GPIO as GPIO
 import time
-from datetime import datetime
-from selenium import webdriver
-from selenium.webdriver.common.by import By
-from selenium.webdriver.chrome.service import Service
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.common.exceptions import NoSuchElementException
 import logging
-import json
-from datetime import datetime
+import forecastCache
+import controlDaemon
+import relayDriver
+import valveConfig
+import valveJournal
+import waterBalance
+import zonePlanner
+import wateringRules
+from valveEngine import ValveController
 
 def setup_logging():
     """Configure logging for the script"""
@@ -20,126 +19,81 @@ def setup_logging():
         format='%(asctime)s - %(levelname)s - %(message)s'
     )
 
-# Relay GPIO Pins (BCM numbering)
-RELAY_PINS = [17, 18, 27, 22]  # Update these to match your wiring
-ZONE_NAMES = ["Patio", "Flowers", "Fig", "Apple"]
+# Zones and relay wiring come from valves.json
+RELAY_PINS = controlDaemon.VALVE_PINS
+ZONE_NAMES = controlDaemon.VALVE_NAMES
 
-# Weather thresholds (adjust based on your needs)
-HOT_WEATHER_EXTRA = 1.5  # Multiplier for watering when >85°F
+# Weather thresholds (adjust in wateringRules.py)
+HOT_WEATHER_THRESHOLD = wateringRules.HOT_WEATHER_THRESHOLD
+HOT_WEATHER_EXTRA = wateringRules.HOT_WEATHER_EXTRA
 
-def setup_relays():
-    GPIO.setmode(GPIO.BCM)
-    for pin in RELAY_PINS:
-        GPIO.setup(pin, GPIO.OUT)
-        GPIO.output(pin, GPIO.HIGH)  # Relays OFF initially
+relays = None
+bank = None
 
-def water_zone(zone_idx, duration_min):
-    print(f"Watering {ZONE_NAMES[zone_idx]} for {duration_min} minutes")
-    GPIO.output(RELAY_PINS[zone_idx], GPIO.LOW)  # Relay ON
-    time.sleep(duration_min * 60)
-    GPIO.output(RELAY_PINS[zone_idx], GPIO.HIGH)  # Relay OFF
+def setup_relays():
+    global relays, bank
+    config = controlDaemon.valve_config
+    relays = relayDriver.get_driver(config['driver'], config['active_low'],
+                                    **valveConfig.driver_options(config))
+    relays.setup(RELAY_PINS)  # Relays OFF initially
+    bank = relayDriver.RelayBank(relays, RELAY_PINS, controlDaemon.VALVE_INRUSH)
+
+def announce_zone(zone_idx, active, info):
+    if active:
+        print(f"Watering {ZONE_NAMES[zone_idx]} for {info['duration']} minutes")
+
+def run_plan(plan, journal):
+    """Execute a watering plan and block until every zone has finished"""
+    controller = ValveController(ZONE_NAMES, bank.set, clock=time.time, start=False, commit=bank.commit,
+                                 journal=journal)
+    controller.add_listener(announce_zone)
+    controller.restore(journal.open_runs())  # Finish runs a crashed invocation left open
+    zonePlanner.execute_plan(plan, controller)
+    try:
+        while controller.next_deadline() is not None:
+            time.sleep(max(0, controller.next_deadline() - controller.clock()))
+            controller.run_pending()
+    finally:
+        controller.stop_all()
 
 def get_weather_forecast():
     """Get comprehensive weather updates from weather.gov"""
     setup_logging()
-    options = webdriver.ChromeOptions()
-    options.add_argument("--headless=new")
-    options.add_argument("--disable-gpu")
-    options.binary_location = '/usr/bin/chromium-browser'
-    service = Service('/usr/bin/chromedriver')
-    driver = webdriver.Chrome(service=service, options=options)
-    
-    try:
-        # Navigate to the forecast page
-        url = "https://forecast.weather.gov/MapClick.php?lat=44.591248&lon=-123.272118"
-        driver.get(url)
-        logging.info(f"Accessing weather data from: {url}")
-
-        # Wait for critical elements to load
-        WebDriverWait(driver, 10).until(
-            EC.presence_of_element_located((By.ID, "seven-day-forecast-body")))
-
-        # Get current conditions
-        current_temp = driver.find_element(
-            By.CLASS_NAME, "myforecast-current-lrg").text
-        print(f"Current temp: {current_temp}")
-
-        # Get extended forecast
-        forecast_items = driver.find_elements(
-            By.CSS_SELECTOR, "#seven-day-forecast-list li.forecast-tombstone")
-
-        # DEBUG: Print raw HTML of each forecast item
-        #print(f"\nFound {len(forecast_items)} forecast items:")
-        #for i, item in enumerate(forecast_items, 1):
-        #    print(f"\n--- Item {i} ---")
-        #    print(item.get_attribute('outerHTML'))  # This prints the full HTML element
-        #    print("----------------")
-
-        forecast_data = []
-        for item in forecast_items:
-            try:
-                temp_element = item.find_element(By.CLASS_NAME, "temp")
-                period = item.find_element(By.CLASS_NAME, "period-name").text
-                temp = temp_element.text
-                desc = item.find_element(By.CLASS_NAME, "short-desc").text
-                
-                #print(f"Found forecast: {period} - {temp} - {desc}")  # Debug print
-                
-                forecast_data.append({
-                    'period': period,
-                    'temperature': temp,
-                    'is_high': 'High' in temp,
-                    'description': desc
-                })
-            except NoSuchElementException as e:
-                logging.warning(f"Missing element in forecast item: {str(e)}")
-                continue
-
-        # Check for precipitation
-        detailed_forecast = driver.find_element(
-            By.ID, "detailed-forecast-body").text.lower()
-
-        # Find next high temp with fallback
-        next_high = next((f for f in forecast_data if f['is_high']), None)
-        next_high_temp = float(next_high['temperature'].split()[1].replace('°F', '')) if next_high else 75
-
-        return {
-            'next_high_temp': next_high_temp,
-            'forecast_data': forecast_data  # Include full forecast data for debugging
-        }
-
-    except Exception as e:
-        logging.error(f"An unexpected error occurred: {str(e)}")
-        return {
-            'next_high_temp': 75,
-            'forecast_data': [],
-            'error': str(e)
-        }
-    finally:
-        driver.quit()
+    weather = forecastCache.get_forecast()
+    print(f"Current temp: {weather['current_temp']}°F")
+    return weather
 
 def calculate_watering_schedule(weather, base_times):
     """Determine watering duration for each zone based on weather"""
-    if weather['next_high_temp'] > 85:
+    rain = wateringRules.forecast_rain(weather)
+    if rain > wateringRules.RAIN_SKIP_INCHES:
+        print(f"{rain:.2f}\" of rain forecast - skipping watering")
+    elif rain >= wateringRules.RAIN_REDUCE_INCHES:
+        print(f"{rain:.2f}\" of rain forecast - halving watering time")
+    if weather['next_high_temp'] > HOT_WEATHER_THRESHOLD:
         print(f"Hot weather forecast ({weather['next_high_temp']}°F) - increasing watering time")
-        return [int(t * HOT_WEATHER_EXTRA) for t in base_times]
-    
-    return base_times
 
-def load_schedule():
+    adjusted = wateringRules.adjust_for_weather(dict(enumerate(base_times)), weather)
+    return [adjusted[i] for i in range(len(base_times))]
+
+def read_schedules():
+    """Load the whole schedule file"""
+    try:
+        # Absolute path, so cron can run us from any working directory
+        return controlDaemon.load_schedule()
+    except Exception as e:
+        print(f"Error loading schedule: {e}")
+        return None
+
+def load_schedule(schedules=None):
     """Load watering durations from schedule file"""
     try:
-        with open('schedules.json', 'r') as f:
-            schedules = json.load(f)
-        
-        today = datetime.now().strftime("%Y-%m-%d")
-        
-        # Check for special schedule first
-        if today in schedules.get('special', {}):
-            return schedules['special'][today]
-        
-        # Fall back to daily schedule
-        return schedules.get('daily', {})
+        schedules = schedules or read_schedules()
+        if schedules is None:
+            raise ValueError("no schedule file")
+
+        # Special dates, ranges, intervals, weekly, then daily
+        return wateringRules.day_durations(schedules)
     except Exception as e:
         print(f"Error loading schedule: {e}")
         # Default durations if file can't be loaded
@@ -150,43 +104,63 @@ def load_schedule():
             "Apple": 20
         }
 
-def main():
-    setup_relays()
-    
+def main(plan_only=False):
+    # A running control daemon owns the relays; hand the run to it
+    daemon = controlDaemon.connect()
+    if daemon:
+        print("Control daemon is running - delegating today's watering")
+        print(daemon.plan() if plan_only else daemon.run_scheduled())
+        return
+
     try:
         print("Checking weather forecast...")
         weather = get_weather_forecast()
         print(f"Next forecasted high: {weather['next_high_temp']}°F")
 
         # Load schedule
-        schedule_durations = load_schedule()
+        schedules = read_schedules() or {}
+        schedule_durations = load_schedule(schedules)
         print(f"Loaded schedule: {schedule_durations}")
         
         # Calculate final durations with weather adjustments
-        base_times = [
-            schedule_durations.get("Patio", 10),
-            schedule_durations.get("Flowers", 20),
-            schedule_durations.get("Fig", 15),
-            schedule_durations.get("Apple", 20)
-        ]
-        
+        base_times = [schedule_durations.get(name, 0) for name in ZONE_NAMES]
         schedule = calculate_watering_schedule(weather, base_times)
-        
-        # Water each zone sequentially
-        for zone, duration in enumerate(schedule):
-            if duration > 0:  # Skip zones with 0 duration
-                water_zone(zone, duration)
-                time.sleep(15)  # Short break between zones
-        
+
+        # Pack zones into the shortest window the supply allows
+        zones, hydraulics = zonePlanner.load_hydraulics(schedules)
+        balance = waterBalance.water_balance.plan(dict(zip(ZONE_NAMES, schedule)), weather, zones)
+        plan = zonePlanner.plan_watering(balance['durations'], ZONE_NAMES, zones, hydraulics)
+        print(zonePlanner.format_plan(plan))
+        if plan_only:
+            return
+
+        # Own the journal before touching a relay: setup writes every relay off
+        try:
+            journal = valveJournal.ValveJournal()
+        except valveJournal.JournalBusy:
+            # app.py is controlling the valves in-process and runs the schedule itself
+            print("Valves are in use by another process - not watering")
+            return
+        try:
+            setup_relays()
+            try:
+                run_plan(plan, journal)
+            finally:
+                relays.cleanup()
+            waterBalance.water_balance.commit(balance, zonePlanner.watered_minutes(plan))
+        finally:
+            journal.close()
+
         print("Watering complete!")
         
     except Exception as e:
         print(f"Error: {str(e)}")
-    finally:
-        GPIO.cleanup()
 
 if __name__ == "__main__":
-    main()
+    import argparse
+    parser = argparse.ArgumentParser(description="Run today's weather-adjusted watering")
+    parser.add_argument('--plan', action='store_true', help="print the watering plan and exit")
+    main(plan_only=parser.parse_args().plan)
 #    if 5 <= datetime.now().hour < 10:  # Only run between 5-10 AM
 #        main()
 #    else:
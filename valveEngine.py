@@ -0,0 +1,312 @@
+"""Valve controller engine.
+
+A single dispatcher thread drives a heap of (deadline, seq) events instead of
+one threading.Timer per open valve. Scheduling is a heap push, cancellation
+drops the event from the live table and the heap skips it lazily, and the
+state table here is the only record of which valves are open.
+
+Output changes made in one call (a tick of due events, stop_all, ...) are
+followed by a single commit() so batched relay backends write them in one
+transaction. With a ValveJournal, every run and its deadline is on disk
+before its relay is energised, and restore() picks the runs up again after
+a crash. The clock is injectable and the dispatcher thread optional, so
+tests and simulations can call run_pending() with their own notion of "now".
+"""
+
+import heapq
+import itertools
+import logging
+import threading
+import time
+from collections import namedtuple
+
+# Immutable view of the state table; version increases on every change
+ValveSnapshot = namedtuple('ValveSnapshot', ['version', 'states'])
+
+
+class _Event:
+    __slots__ = ('deadline', 'seq', 'run_id', 'valve_idx', 'action', 'duration_min', 'reason')
+
+    def __init__(self, deadline, seq, run_id, valve_idx, action, duration_min, reason):
+        self.deadline = deadline
+        self.seq = seq
+        self.run_id = run_id
+        self.valve_idx = valve_idx
+        self.action = action
+        self.duration_min = duration_min
+        self.reason = reason
+
+    def __lt__(self, other):
+        return (self.deadline, self.seq) < (other.deadline, other.seq)
+
+
+class ValveController:
+    """Owns valve state and every pending on/off deadline"""
+
+    def __init__(self, names, set_output, clock=time.monotonic, start=True, commit=None, journal=None):
+        self.names = list(names)
+        self.set_output = set_output
+        self.commit = commit  # flushes set_output calls, e.g. RelayBank.commit
+        self.journal = journal  # ValveJournal, or None
+        self.clock = clock
+        self._cond = threading.Condition()
+        self._heap = []
+        self._events = {}      # seq -> live event
+        self._runs = {}        # run_id -> set of live seqs
+        self._shutoff = {}     # valve_idx -> seq of its armed shutoff
+        self._states = [False] * len(self.names)
+        self._snapshot = ValveSnapshot(0, tuple(self._states))
+        self._seq = itertools.count()
+        self._run_ids = itertools.count(1)
+        self._listeners = []
+        self._thread = None
+        self._running = False
+        if start:
+            self.start()
+
+    # ---------------------- public API ----------------------
+    def add_listener(self, listener):
+        """Call listener(valve_idx, active, info) after every state change"""
+        self._listeners.append(listener)
+
+    def turn_on(self, valve_idx, duration_min, reason="manual"):
+        """Open a valve now and arm its shutoff; returns the run id"""
+        with self._cond:
+            run_id = next(self._run_ids)
+            changes = self._open(valve_idx, duration_min, run_id, self.clock(), reason)
+            self._cond.notify()
+        self._commit(changes)
+        self._notify(changes)
+        return run_id
+
+    def turn_off(self, valve_idx, reason="manual"):
+        """Close a valve now and disarm its shutoff"""
+        with self._cond:
+            changes = self._close(valve_idx, reason)
+            self._cond.notify()
+        self._commit(changes)
+        self._notify(changes)
+
+    def queue_run(self, valve_idx, start_at, duration_min, reason="scheduled"):
+        """Open a valve at clock time start_at for duration_min; returns the run id"""
+        with self._cond:
+            run_id = next(self._run_ids)
+            self._push(start_at, run_id, valve_idx, 'on', duration_min, reason)
+            self._cond.notify()
+        return run_id
+
+    def cancel(self, run_id):
+        """Drop a queued or running run's pending events (the valve stays as is)"""
+        with self._cond:
+            for seq in self._runs.pop(run_id, ()):
+                event = self._events.pop(seq, None)
+                if event and self._shutoff.get(event.valve_idx) == seq:
+                    del self._shutoff[event.valve_idx]
+            self._compact()
+            self._cond.notify()
+
+    def stop_all(self, reason="stop"):
+        """Cancel everything queued and close every valve"""
+        with self._cond:
+            self._heap.clear()
+            self._events.clear()
+            self._runs.clear()
+            self._shutoff.clear()
+            changes = []
+            for valve_idx in range(len(self.names)):
+                changes.extend(self._close(valve_idx, reason))
+            self._cond.notify()
+        self._commit(changes)
+        self._notify(changes)
+
+    def restore(self, deadlines):
+        """Resume journaled runs {zone: wall clock deadline} after a restart.
+
+        Runs still due are reopened until their original deadline; overdue
+        ones are closed at once. Returns the names of the resumed zones.
+        """
+        now = time.time()
+        resumed = []
+        with self._cond:
+            changes = []
+            for name, deadline in deadlines.items():
+                if name not in self.names:
+                    logging.warning(f"Journal names unknown zone {name}; ignoring it")
+                    continue
+                valve_idx = self.names.index(name)
+                if deadline > now:
+                    changes.extend(self._open(valve_idx, (deadline - now) / 60, next(self._run_ids),
+                                              self.clock(), "recovered"))
+                    resumed.append(name)
+                else:
+                    self.set_output(valve_idx, False)  # Overdue: make sure it is off
+                    if self.journal is not None:
+                        self.journal.log_close(name)
+            self._cond.notify()
+        self._commit(changes)
+        self._notify(changes)
+        return resumed
+
+    def is_on(self, valve_idx):
+        return self._states[valve_idx]
+
+    def states(self):
+        return list(self._snapshot.states)
+
+    def snapshot(self):
+        """Current ValveSnapshot; safe to read without the lock"""
+        return self._snapshot
+
+    def pending(self):
+        """Number of live queued events"""
+        with self._cond:
+            return len(self._events)
+
+    def next_deadline(self):
+        with self._cond:
+            self._discard_dead()
+            return self._heap[0].deadline if self._heap else None
+
+    def run_pending(self, now=None):
+        """Dispatch every event due at or before now as one tick; returns how many fired"""
+        fired = 0
+        changes = []
+        with self._cond:
+            now_ = self.clock() if now is None else now
+            while True:
+                self._discard_dead()
+                if not self._heap or self._heap[0].deadline > now_:
+                    break
+                event = heapq.heappop(self._heap)
+                self._forget(event)
+                if event.action == 'on':
+                    changes.extend(self._open(event.valve_idx, event.duration_min,
+                                              event.run_id, event.deadline, event.reason))
+                else:
+                    changes.extend(self._close(event.valve_idx, event.reason))
+                fired += 1
+        if fired:
+            self._commit(changes)
+        self._notify(changes)
+        return fired
+
+    # ---------------------- dispatcher thread ----------------------
+    def start(self):
+        if self._thread is not None:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._dispatch, name="valve-dispatcher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _dispatch(self):
+        while True:
+            with self._cond:
+                if not self._running:
+                    return
+                self._discard_dead()
+                timeout = None
+                if self._heap:
+                    timeout = max(0, self._heap[0].deadline - self.clock())
+                if timeout is None or timeout > 0:
+                    self._cond.wait(timeout)
+                    continue
+            try:
+                self.run_pending()
+            except Exception as e:
+                logging.error(f"Valve dispatcher error: {str(e)}")
+
+    # ---------------------- internals (lock held) ----------------------
+    def _push(self, deadline, run_id, valve_idx, action, duration_min, reason):
+        event = _Event(deadline, next(self._seq), run_id, valve_idx, action, duration_min, reason)
+        heapq.heappush(self._heap, event)
+        self._events[event.seq] = event
+        self._runs.setdefault(run_id, set()).add(event.seq)
+        return event
+
+    def _forget(self, event):
+        self._events.pop(event.seq, None)
+        seqs = self._runs.get(event.run_id)
+        if seqs is not None:
+            seqs.discard(event.seq)
+            if not seqs:
+                del self._runs[event.run_id]
+        if self._shutoff.get(event.valve_idx) == event.seq:
+            del self._shutoff[event.valve_idx]
+
+    def _disarm(self, valve_idx):
+        seq = self._shutoff.pop(valve_idx, None)
+        event = self._events.get(seq)
+        if event:
+            self._forget(event)
+
+    def _open(self, valve_idx, duration_min, run_id, started_at, reason):
+        self._disarm(valve_idx)
+        deadline = started_at + duration_min * 60
+        if self.journal is not None:
+            self.journal.log_open(self.names[valve_idx], deadline - self.clock())
+            if self.commit is None:
+                self.journal.flush()  # set_output energises the relay right away
+        self.set_output(valve_idx, True)
+        self._set_state(valve_idx, True)
+        event = self._push(deadline, run_id, valve_idx, 'off', duration_min, "timer")
+        self._shutoff[valve_idx] = event.seq
+        return [(valve_idx, True, {'run_id': run_id, 'duration': duration_min,
+                                   'reason': reason, 'deadline': deadline,
+                                   'started_at': started_at, 'opened_at': None})]
+
+    def _close(self, valve_idx, reason):
+        self._disarm(valve_idx)
+        was_on = self._states[valve_idx]
+        self.set_output(valve_idx, False)
+        self._set_state(valve_idx, False)
+        if not was_on:
+            return []
+        if self.journal is not None:
+            self.journal.log_close(self.names[valve_idx])
+        return [(valve_idx, False, {'reason': reason})]
+
+    def _commit(self, changes):
+        # Called after the lock is released, so a slow relay write (inrush
+        # stagger, I2C) never holds up another caller's stop_all. Backends
+        # must write their latest staged state, whichever thread commits.
+        if self.journal is not None:
+            self.journal.flush()  # Runs hit the disk before their relays move
+        if self.commit is not None:
+            self.commit()
+        opened_at = self.clock()
+        for _, active, info in changes:
+            if active:
+                info['opened_at'] = opened_at
+
+    def _set_state(self, valve_idx, active):
+        # A restart of an open valve counts as a change too (new deadline)
+        if self._states[valve_idx] == active and not active:
+            return
+        self._states[valve_idx] = active
+        self._snapshot = ValveSnapshot(self._snapshot.version + 1, tuple(self._states))
+
+    def _discard_dead(self):
+        while self._heap and self._heap[0].seq not in self._events:
+            heapq.heappop(self._heap)
+
+    def _compact(self):
+        # Rebuild once cancelled events outnumber live ones to bound heap size
+        if len(self._heap) > 2 * len(self._events) + 64:
+            self._heap = [e for e in self._heap if e.seq in self._events]
+            heapq.heapify(self._heap)
+
+    def _notify(self, changes):
+        for valve_idx, active, info in changes:
+            for listener in self._listeners:
+                try:
+                    listener(valve_idx, active, info)
+                except Exception as e:
+                    logging.error(f"Valve listener error for {self.names[valve_idx]}: {str(e)}")
@@ -0,0 +1,178 @@
+"""Crash-safe journal of open valves and their shutoff deadlines.
+
+Relays keep their state when the process dies, and the shutoff deadlines
+only live in the ValveController's heap. So before a valve is energised,
+its zone and absolute (wall clock) deadline are appended to JOURNAL_FILE
+and fsync'd; closes are appended too. One line of JSON per record::
+
+    {"op": "on", "zone": "Patio", "deadline": 1767600000.0, "at": 1767599100.0}
+    {"op": "off", "zone": "Patio", "at": 1767599400.0}
+
+Records staged during one controller tick go out in a single write and
+fsync. Once the file holds COMPACT_LINES records, a background thread
+rewrites it with just the open runs (tmp file, fsync, rename), so the file
+a restart has to replay stays small. A torn last line from a crash is
+ignored.
+"""
+
+import fcntl
+import json
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+
+JOURNAL_FILE = Path(__file__).with_name("valve_journal.log")
+COMPACT_LINES = 512
+
+
+class JournalBusy(Exception):
+    """Another process owns the valve journal"""
+
+
+def _records(path):
+    """Records in a journal file, skipping damaged lines"""
+    try:
+        with open(path, 'r') as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    logging.warning(f"Skipping damaged valve journal line: {line.strip()[:80]}")
+    except FileNotFoundError:
+        pass
+
+
+def read_open_runs(path=JOURNAL_FILE):
+    """{zone: deadline} as last written by the owner, without taking the journal"""
+    runs = {}
+    for record in _records(path):
+        ValveJournal._apply(runs, record)
+    return {zone: record['deadline'] for zone, record in runs.items()}
+
+
+class ValveJournal:
+    """Append-only log of valve runs; open_runs() is the replayed state.
+
+    The process that opens the journal holds an flock on JOURNAL_FILE's
+    .lock file until close(). Only one process may replay, append to or
+    compact it; a second one gets JournalBusy.
+    """
+
+    def __init__(self, path=JOURNAL_FILE, clock=time.time):
+        self.path = Path(path)
+        self.clock = clock
+        self._owner = open(self.path.with_suffix('.lock'), 'a')
+        try:
+            fcntl.flock(self._owner, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            self._owner.close()
+            raise JournalBusy(f"{self.path} is in use by another process")
+        self._lock = threading.Lock()  # state and the pending list; never held across I/O
+        self._write_lock = threading.Lock()  # one writer at a time, held through the fsync
+        self._open = {}  # zone -> its "on" record, including staged records
+        self._durable = {}  # the same, as far as it is on disk
+        self._pending = []
+        self._lines = 0
+        self._written = 0  # records flushed so far
+        self._compacting = False
+        self._replay()
+        self._file = open(self.path, 'a')
+        if self._lines > len(self._durable):
+            self.compact()  # Leaves only the open runs for the next restart to read
+
+    def _replay(self):
+        for record in _records(self.path):
+            self._apply(self._open, record)
+            self._apply(self._durable, record)
+            self._lines += 1
+
+    @staticmethod
+    def _apply(runs, record):
+        if record['op'] == 'on':
+            runs[record['zone']] = record
+        else:
+            runs.pop(record['zone'], None)
+
+    def open_runs(self):
+        """{zone: wall clock deadline} for runs that were open at the last write"""
+        with self._lock:
+            return {zone: record['deadline'] for zone, record in self._open.items()}
+
+    def log_open(self, zone, remaining):
+        """Stage a run that ends remaining seconds from now"""
+        now = self.clock()
+        self._stage({'op': 'on', 'zone': zone, 'deadline': round(now + remaining, 3), 'at': round(now, 3)})
+
+    def log_close(self, zone):
+        self._stage({'op': 'off', 'zone': zone, 'at': round(self.clock(), 3)})
+
+    def _stage(self, record):
+        with self._lock:
+            self._apply(self._open, record)
+            self._pending.append(record)
+
+    def flush(self):
+        """Write and fsync the staged records; called before relays change"""
+        with self._write_lock:
+            with self._lock:
+                records, self._pending = self._pending, []
+            if not records:
+                return
+            self._file.write(''.join(json.dumps(record) + '\n' for record in records))
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            with self._lock:
+                for record in records:
+                    self._apply(self._durable, record)
+                self._lines += len(records)
+                self._written += len(records)
+                compact = self._lines >= COMPACT_LINES and not self._compacting
+                if compact:
+                    self._compacting = True
+        if compact:
+            threading.Thread(target=self.compact, name="journal-compact", daemon=True).start()
+
+    def compact(self):
+        """Rewrite the journal with only the open runs.
+
+        The copy is written and fsync'd without blocking flush(); if records
+        were flushed meanwhile it is dropped and the next flush tries again.
+        """
+        tmp_path = self.path.with_suffix('.tmp')
+        try:
+            with self._lock:
+                records = list(self._durable.values())
+                written = self._written
+            with open(tmp_path, 'w') as f:
+                f.write(''.join(json.dumps(record) + '\n' for record in records))
+                f.flush()
+                os.fsync(f.fileno())
+            with self._write_lock:
+                if self._written != written:
+                    os.unlink(tmp_path)
+                    return
+                os.replace(tmp_path, self.path)
+                # The rename must be durable before anything is appended to the new file
+                dir_fd = os.open(self.path.parent, os.O_RDONLY)
+                try:
+                    os.fsync(dir_fd)
+                finally:
+                    os.close(dir_fd)
+                self._file.close()
+                self._file = open(self.path, 'a')
+                with self._lock:
+                    self._lines = len(records)
+        except OSError as e:
+            logging.error(f"Error compacting valve journal: {str(e)}")
+        finally:
+            with self._lock:
+                self._compacting = False
+
+    def close(self):
+        self.flush()
+        with self._write_lock:
+            self._file.close()
+        fcntl.flock(self._owner, fcntl.LOCK_UN)
+        self._owner.close()
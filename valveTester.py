@@ -1,48 +1,59 @@
 #!/usr/bin/env python3
-import RPi.GPIO as GPIO
 import time
+import relayDriver
+import controlDaemon
+import valveConfig
 
-# Configuration
-RELAY_PINS = [17, 18, 27, 22]  # Update these to match your GPIO pins
-ZONE_NAMES = ["Patio", "Flowers", "Fig", "Apple"]
+# Configuration (zones and wiring come from valves.json)
+RELAY_PINS = controlDaemon.VALVE_PINS
+ZONE_NAMES = controlDaemon.VALVE_NAMES
 TEST_DURATION = 20  # seconds for valve test
 
+# Go through the control daemon when it owns the relays
+daemon = controlDaemon.connect()
+relays = None if daemon else relayDriver.get_driver(
+    controlDaemon.valve_config['driver'], controlDaemon.RELAY_ACTIVE_LOW,
+    **valveConfig.driver_options(controlDaemon.valve_config))
+
 def setup_gpio():
-    GPIO.setmode(GPIO.BCM)
-    for pin in RELAY_PINS:
-        GPIO.setup(pin, GPIO.OUT)
-        GPIO.output(pin, GPIO.HIGH)  # Start with all relays OFF
+    if relays:
+        relays.setup(RELAY_PINS)  # Start with all relays OFF
 
 def test_zone(zone_index):
     pin = RELAY_PINS[zone_index]
-    print(f"\nTesting {ZONE_NAMES[zone_index]} (GPIO {pin})...")
+    print(f"\nTesting {ZONE_NAMES[zone_index]} (output {pin})...")
     
-    GPIO.output(pin, GPIO.LOW)  # Relay ON
+    if daemon:
+        daemon.test_zone(valve_idx=zone_index, seconds=TEST_DURATION)  # Daemon closes it
+    else:
+        relays.write(pin, True)  # Relay ON
     print(f"Valve OPEN - waiting {TEST_DURATION} seconds")
     time.sleep(TEST_DURATION)
     
-    GPIO.output(pin, GPIO.HIGH)  # Relay OFF
+    if not daemon:
+        relays.write(pin, False)  # Relay OFF
     print("Valve CLOSED")
 
 def main_menu():
     print("\n=== Irrigation Valve Tester ===")
+    count = len(ZONE_NAMES)
     for i, name in enumerate(ZONE_NAMES):
-        print(f"{i+1}. Test {name} (GPIO {RELAY_PINS[i]})")
-    print("5. Test ALL zones sequentially")
+        print(f"{i+1}. Test {name} (output {RELAY_PINS[i]})")
+    print(f"{count+1}. Test ALL zones sequentially")
     print("0. Exit")
     
     while True:
         try:
-            choice = int(input("\nSelect zone to test (0-5): "))
-            if 1 <= choice <= 4:
+            choice = int(input(f"\nSelect zone to test (0-{count+1}): "))
+            if 1 <= choice <= count:
                 test_zone(choice-1)
-            elif choice == 5:
-                for i in range(4):
+            elif choice == count + 1:
+                for i in range(count):
                     test_zone(i)
             elif choice == 0:
                 break
             else:
-                print("Invalid choice. Enter 0-5")
+                print(f"Invalid choice. Enter 0-{count+1}")
         except ValueError:
             print("Please enter a number")
         except KeyboardInterrupt:
@@ -53,5 +64,6 @@ if __name__ == "__main__":
         setup_gpio()
         main_menu()
     finally:
-        GPIO.cleanup()
+        if relays:
+            relays.cleanup()
         print("\nGPIO cleanup complete. Exiting.")
@@ -0,0 +1,272 @@
+"""Daily soil water balance per zone.
+
+Zones opt in by naming a plant type and soil in the schedules.json zone
+settings, plus either an application rate or an area to derive it from:
+
+    "zones": {"Fig": {"plant": "trees", "soil": "clay", "area_sqft": 120, "flow_gpm": 2.0}}
+
+Reference evapotranspiration (ET0) comes from the Hargreaves equation, which
+needs only the daily high and low and the site latitude. Crop coefficients,
+root depths and soil water holding capacities follow wateringGuide.md. Each
+zone's root-zone depletion is carried forward in WATER_BALANCE_FILE; a zone
+is watered back to field capacity when waiting another day would take it
+past its allowed depletion. All zones and forecast days are computed
+together as NumPy arrays.
+"""
+
+import json
+import logging
+import math
+import os
+import re
+from datetime import date, datetime, timedelta
+from pathlib import Path
+
+import numpy as np
+
+from weatherForecast import FORECAST_LAT
+
+WATER_BALANCE_FILE = Path(__file__).with_name("water_balance.json")
+
+# Plant type: (crop coefficient Kc, root depth in inches)
+PLANTS = {
+    'lawn': (0.80, 7.0),
+    'vegetables': (1.00, 15.0),
+    'flowers': (0.70, 9.0),
+    'shrubs': (0.50, 18.0),
+    'trees': (0.60, 30.0),
+}
+
+# Soil type: available water (inches per inch of soil), infiltration (in/hr)
+SOILS = {
+    'sand': (0.06, 2.0),
+    'loam': (0.17, 0.75),
+    'clay': (0.20, 0.25),
+}
+
+GALLONS_PER_SQFT_INCH = 0.623
+DEFAULT_MAD = 0.5  # Management allowed depletion, fraction of available water
+EFFECTIVE_RAIN = 0.8  # Share of forecast rain that reaches the root zone
+DIURNAL_RANGE_F = 20  # Assumed high-low spread when the forecast has no low
+
+_TEMP_RE = re.compile(r'(-?\d+)')
+
+
+def _as_date(day):
+    return day.date() if isinstance(day, datetime) else day
+
+
+def uses_water_balance(config):
+    return bool(config.get('plant')) and bool(config.get('soil'))
+
+
+def application_rate(config):
+    """Inches per hour a zone applies, or None if it cannot be worked out"""
+    if config.get('precip_in_hr'):
+        return float(config['precip_in_hr'])
+    if config.get('flow_gpm') and config.get('area_sqft'):
+        return config['flow_gpm'] * 60 / (config['area_sqft'] * GALLONS_PER_SQFT_INCH)
+    return None
+
+
+def forecast_days(weather):
+    """Daily (high °F, low °F, rain inches) arrays from a forecast dict.
+
+    Day 0 is the first forecast high. Rain forecast for a night is credited
+    to the day before it; rain before the first high goes to day 0.
+    """
+    highs, lows, rain = [], [], []
+    early_rain = 0.0
+    for period in weather.get('forecast_data', []):
+        # Expected rain: the forecast amount weighted by its chance
+        precip = (period.get('precip_in') or 0.0) * period.get('precip_chance', 100) / 100
+        if period.get('is_high') and period.get('temp_value') is not None:
+            highs.append(float(period['temp_value']))
+            lows.append(None)
+            rain.append(precip)
+            continue
+        if not highs:
+            early_rain += precip
+            continue
+        match = _TEMP_RE.search(period.get('temperature', ''))
+        if match and lows[-1] is None:
+            lows[-1] = float(match.group(1))
+        rain[-1] += precip
+
+    if not highs:
+        highs, lows, rain = [float(weather['next_high_temp'])], [None], [0.0]
+    rain[0] += early_rain
+
+    tmax = np.array(highs)
+    tmin = np.array([low if low is not None else high - DIURNAL_RANGE_F
+                     for high, low in zip(highs, lows)])
+    return tmax, np.minimum(tmin, tmax), np.array(rain)
+
+
+def hargreaves_et0(tmax_f, tmin_f, day_of_year, lat=FORECAST_LAT):
+    """Reference ET in inches/day (FAO-56 Hargreaves) for arrays of days"""
+    tmax = (np.asarray(tmax_f) - 32) / 1.8
+    tmin = (np.asarray(tmin_f) - 32) / 1.8
+    doy = np.asarray(day_of_year, dtype=float)
+
+    # Extraterrestrial radiation Ra (MJ/m²/day) from latitude and date
+    phi = math.radians(lat)
+    dr = 1 + 0.033 * np.cos(2 * np.pi * doy / 365)
+    decl = 0.409 * np.sin(2 * np.pi * doy / 365 - 1.39)
+    ws = np.arccos(np.clip(-math.tan(phi) * np.tan(decl), -1, 1))
+    ra = (24 * 60 / np.pi) * 0.0820 * dr * (
+        ws * math.sin(phi) * np.sin(decl) + math.cos(phi) * np.cos(decl) * np.sin(ws))
+
+    et0_mm = 0.0023 * 0.408 * ra * ((tmax + tmin) / 2 + 17.8) * np.sqrt(np.maximum(tmax - tmin, 0))
+    return np.maximum(et0_mm, 0) / 25.4
+
+
+class WaterBalance:
+    """Root-zone depletion per zone, advanced one day at a time"""
+
+    def __init__(self, path=WATER_BALANCE_FILE, lat=FORECAST_LAT):
+        self.path = Path(path) if path else None
+        self.lat = lat
+        self._state = None
+
+    def plan(self, durations, weather, zones, day=None):
+        """Replace the durations of water-balance zones; does not change state.
+
+        Returns a dict whose 'durations' are the new minutes per zone. Pass
+        it to commit() once the watering has actually been queued.
+        """
+        day = _as_date(day or datetime.now())
+        durations = dict(durations)
+        names = [name for name, config in zones.items()
+                 if uses_water_balance(config) and application_rate(config)]
+        for name, config in zones.items():
+            if uses_water_balance(config) and name not in names:
+                logging.warning(f"Zone {name} needs precip_in_hr or flow_gpm and area_sqft for the water balance")
+
+        state = self._load()
+        tmax, tmin, rain = forecast_days(weather)
+        doys = [(day + timedelta(days=i)).timetuple().tm_yday for i in range(len(tmax))]
+        et0 = hargreaves_et0(tmax, tmin, doys, self.lat)
+        result = {'day': day.isoformat(), 'zones': names, 'durations': durations,
+                  'et0': et0.tolist(), 'rain': rain.tolist()}
+        if not names:
+            result['depletion'] = result['depth'] = []
+            return result
+
+        kc, taw, raw, rate = self._zone_arrays(names, zones)
+        depletion = self._depletion_at(state, names, kc, taw, day)
+
+        if state and date.fromisoformat(state['date']) > day:
+            # A run earlier today already refilled these zones
+            depth = np.zeros(len(names))
+        else:
+            net = kc[:, None] * et0[None, :] - EFFECTIVE_RAIN * rain[None, :]
+            path = np.clip(depletion[:, None] + np.cumsum(net, axis=1), 0, taw[:, None])
+            # Water today only if waiting until tomorrow would pass the allowed depletion
+            wait_until = path[:, min(1, path.shape[1] - 1)]
+            depth = np.where(wait_until > raw, path[:, 0], 0.0)
+
+        minutes = np.rint(depth / rate * 60).astype(int)
+        durations.update(zip(names, minutes.tolist()))
+        result.update(depletion=depletion.tolist(), depth=depth.tolist(),
+                      kc=kc.tolist(), taw=taw.tolist())
+        return result
+
+    def commit(self, plan, watered=None):
+        """Advance the stored state past the planned day.
+
+        watered maps zone to the minutes that actually ran, for runs cut
+        short by the done_by deadline; their depth shrinks to match.
+        """
+        if not plan['zones']:
+            return
+        day = date.fromisoformat(plan['day'])
+        state = self._load()
+        if state and date.fromisoformat(state['date']) > day:
+            return  # Already advanced by an earlier run today
+
+        kc, taw = np.array(plan['kc']), np.array(plan['taw'])
+        depth = np.array(plan['depth'])
+        if watered is not None:
+            planned = np.array([plan['durations'][name] for name in plan['zones']], dtype=float)
+            ran = np.array([watered.get(name, 0) for name in plan['zones']], dtype=float)
+            share = np.divide(ran, planned, out=np.zeros_like(ran), where=planned > 0)
+            depth = depth * np.minimum(share, 1)
+        net_today = kc * plan['et0'][0] - EFFECTIVE_RAIN * plan['rain'][0]
+        depletion = np.clip(np.array(plan['depletion']) + net_today - depth, 0, taw)
+
+        known = dict(state['depletion']) if state else {}
+        known.update(zip(plan['zones'], depletion.tolist()))
+        self._state = {
+            'date': (day + timedelta(days=1)).isoformat(),
+            'depletion': known,
+            # Forecast for the coming days, used if a day passes without a run
+            'outlook': {'et0': plan['et0'][1:], 'rain': plan['rain'][1:]}
+        }
+        self._save(self._state)
+
+    def depletion(self):
+        """Stored depletion per zone in inches"""
+        state = self._load()
+        return dict(state['depletion']) if state else {}
+
+    # ---------------------- internals ----------------------
+    def _zone_arrays(self, names, zones):
+        kc, root, awc, mad, rate = [], [], [], [], []
+        for name in names:
+            config = zones[name]
+            plant_kc, plant_root = PLANTS[config['plant']]
+            soil_awc, _ = SOILS[config['soil']]
+            kc.append(config.get('kc', plant_kc))
+            root.append(config.get('root_depth_in', plant_root))
+            awc.append(soil_awc)
+            mad.append(config.get('mad', DEFAULT_MAD))
+            rate.append(application_rate(config))
+        taw = np.array(root) * np.array(awc)
+        return np.array(kc), taw, taw * np.array(mad), np.array(rate)
+
+    def _depletion_at(self, state, names, kc, taw, day):
+        """Depletion at the start of day, rolling the state over skipped days"""
+        if not state:
+            return np.zeros(len(names))
+        stored = state['depletion']
+        depletion = np.array([stored.get(name, 0.0) for name in names])
+        skipped = (day - date.fromisoformat(state['date'])).days
+        if skipped <= 0:
+            return depletion
+
+        outlook = state.get('outlook', {})
+        et0 = list(outlook.get('et0', []))[:skipped]
+        rain = list(outlook.get('rain', []))[:skipped]
+        fill = et0[-1] if et0 else 0.0
+        et0 += [fill] * (skipped - len(et0))
+        rain += [0.0] * (skipped - len(rain))
+        for day_et0, day_rain in zip(et0, rain):
+            depletion = np.clip(depletion + kc * day_et0 - EFFECTIVE_RAIN * day_rain, 0, taw)
+        return depletion
+
+    def _load(self):
+        if self._state is not None or self.path is None:
+            return self._state
+        try:
+            with open(self.path, 'r') as f:
+                self._state = json.load(f)
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            logging.error(f"Error reading water balance: {str(e)}")
+        return self._state
+
+    def _save(self, state):
+        if self.path is None:
+            return
+        tmp_path = self.path.with_suffix('.tmp')
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(state, f, indent=2)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logging.error(f"Error writing water balance: {str(e)}")
+
+
+water_balance = WaterBalance()
@@ -0,0 +1,56 @@
+"""Schedule resolution and weather adjustments shared by every runner.
+
+A special entry for the date wins over date ranges and intervals, which win
+over the weekly entry for the weekday, which wins over the daily durations
+(see scheduleCompiler).
+"""
+
+from datetime import datetime
+
+import scheduleCompiler
+
+HOT_WEATHER_THRESHOLD = 85  # °F
+HOT_WEATHER_EXTRA = 1.5  # Multiplier for watering when >85°F
+
+# Rain sensor settings from wateringGuide.md
+RAIN_SKIP_INCHES = 0.5  # Skip if more rain than this is forecast
+RAIN_REDUCE_INCHES = 0.25  # Halve watering from this much up to the skip level
+RAIN_REDUCE_FACTOR = 0.5
+RAIN_MIN_CHANCE = 50  # % chance before forecast rain is counted
+RAIN_LOOKAHEAD_PERIODS = 2  # Forecast periods (day/night) after the run
+
+
+def day_durations(schedules, day=None):
+    """Base zone durations (minutes) for a date"""
+    day = day or datetime.now()
+    if isinstance(day, datetime):
+        day = day.date()
+    rule = scheduleCompiler.resolve(scheduleCompiler.compile_rules(schedules), day)
+    return dict(rule.durations) if rule else {}
+
+
+def forecast_rain(weather, periods=RAIN_LOOKAHEAD_PERIODS):
+    """Inches of likely rain over the next forecast periods"""
+    return sum(
+        period.get('precip_in', 0.0)
+        for period in weather.get('forecast_data', [])[:periods]
+        if period.get('precip_chance', 0) >= RAIN_MIN_CHANCE
+    )
+
+
+def rain_factor(weather):
+    """Multiplier for runs that come just before significant rain"""
+    rain = forecast_rain(weather)
+    if rain > RAIN_SKIP_INCHES:
+        return 0.0
+    if rain >= RAIN_REDUCE_INCHES:
+        return RAIN_REDUCE_FACTOR
+    return 1.0
+
+
+def adjust_for_weather(durations, weather):
+    """Apply the hot weather multiplier and rain skip to a durations dict"""
+    factor = rain_factor(weather)
+    if weather['next_high_temp'] > HOT_WEATHER_THRESHOLD:
+        factor *= HOT_WEATHER_EXTRA
+    return {zone: int(duration * factor) for zone, duration in durations.items()}
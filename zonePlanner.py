@@ -0,0 +1,190 @@
+"""Pack zone runs into the shortest window the water supply allows.
+
+Zones that fit within the supply together run at the same time; everything
+else is queued by list scheduling (priority first, then longest run first,
+with smaller runs backfilling spare capacity). Optional settings live in
+schedules.json::
+
+    "zones": {"Patio": {"flow_gpm": 3.0, "priority": 1}, ...},
+    "hydraulics": {"supply_gpm": 8.0, "max_concurrent": 2,
+                   "zone_gap_sec": 15, "done_by": "09:00"}
+
+max_concurrent is the pressure budget: how many zones may be open before
+the heads stop throwing properly. A zone without a flow_gpm is assumed to
+use the whole supply, which gives the old one-zone-at-a-time behaviour.
+done_by is enforced: runs that would end after it are shortened to end at
+the deadline, and runs that would start after it are dropped; the plan
+lists what was cut. It means the HH:MM nearest the start, so a late run
+(09:30 against "08:00") waters nothing rather than running until tomorrow
+morning, while a 22:00 start with "06:00" still gets the night.
+"""
+
+import logging
+from datetime import datetime, timedelta
+
+DEFAULT_HYDRAULICS = {
+    'supply_gpm': None,     # None = unlimited flow, only max_concurrent applies
+    'max_concurrent': 1,
+    'zone_gap_sec': 15,     # pause after a zone closes before its share is reused
+    'done_by': None         # "HH:MM" deadline for the whole window
+}
+
+
+def load_hydraulics(schedules):
+    """Zone and supply settings from a schedules dict, with defaults filled in"""
+    hydraulics = dict(DEFAULT_HYDRAULICS)
+    hydraulics.update(schedules.get('hydraulics', {}))
+    return schedules.get('zones', {}), hydraulics
+
+
+def _parse_done_by(done_by, start):
+    """The occurrence of HH:MM nearest start; it may already have passed"""
+    if not done_by:
+        return None
+    if isinstance(done_by, datetime):
+        return done_by
+    hour, minute = (int(part) for part in done_by.split(':'))
+    deadline = start.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    if start - deadline > timedelta(hours=12):
+        deadline += timedelta(days=1)
+    elif deadline - start > timedelta(hours=12):
+        deadline -= timedelta(days=1)
+    return deadline
+
+
+def plan_watering(durations, zone_names, zones=None, hydraulics=None, start=None):
+    """Build a watering plan.
+
+    durations maps zone name to minutes; zone_names gives each zone's valve
+    index. Returns a dict with 'entries' (zone, valve_idx, start, end,
+    duration, flow_gpm) ordered by start time, the window 'start'/'end', the
+    'done_by' deadline, whether the full plan is 'feasible' against it and
+    the runs 'trimmed' to meet it.
+    """
+    zones = zones or {}
+    settings = dict(DEFAULT_HYDRAULICS)
+    settings.update(hydraulics or {})
+    start = start or datetime.now()
+
+    supply = settings['supply_gpm']
+    max_concurrent = max(1, int(settings['max_concurrent'] or 1))
+    gap = timedelta(seconds=settings['zone_gap_sec'] or 0)
+
+    jobs = []
+    for valve_idx, name in enumerate(zone_names):
+        minutes = durations.get(name, 0)
+        if not minutes or minutes <= 0:
+            continue
+        config = zones.get(name, {})
+        flow = config.get('flow_gpm')
+        if supply and (flow is None or flow > supply):
+            flow = supply
+        jobs.append({
+            'zone': name,
+            'valve_idx': valve_idx,
+            'duration': minutes,
+            'flow_gpm': flow or 0,
+            'priority': config.get('priority', 0)
+        })
+    jobs.sort(key=lambda job: (job['priority'], -job['duration'], job['valve_idx']))
+
+    entries = []
+    running = []  # (release_time, flow) of zones still holding capacity
+    now = start
+    while jobs:
+        running = [r for r in running if r[0] > now]
+        used_flow = sum(flow for _, flow in running)
+
+        for job in list(jobs):
+            if len(running) >= max_concurrent:
+                break
+            if supply and used_flow + job['flow_gpm'] > supply + 1e-9:
+                continue
+            end = now + timedelta(minutes=job['duration'])
+            entries.append({
+                'zone': job['zone'],
+                'valve_idx': job['valve_idx'],
+                'start': now,
+                'end': end,
+                'duration': job['duration'],
+                'flow_gpm': job['flow_gpm']
+            })
+            running.append((end + gap, job['flow_gpm']))
+            used_flow += job['flow_gpm']
+            jobs.remove(job)
+
+        if jobs:
+            now = min(release for release, _ in running)
+
+    entries.sort(key=lambda entry: (entry['start'], entry['valve_idx']))
+    end = max((entry['end'] for entry in entries), default=start)
+    deadline = _parse_done_by(settings['done_by'], start)
+    feasible = deadline is None or end <= deadline
+    trimmed = []
+    if not feasible:
+        entries, trimmed = _trim_to(entries, deadline)
+        end = max((entry['end'] for entry in entries), default=start)
+
+    return {
+        'start': start,
+        'end': end,
+        'done_by': deadline,
+        'feasible': feasible,
+        'entries': entries,
+        'trimmed': trimmed
+    }
+
+
+def _trim_to(entries, deadline):
+    """Shorten runs that would end after the deadline and drop those starting at or after it.
+
+    Returns the kept entries and (zone, planned minutes, kept minutes) for
+    every run that was cut.
+    """
+    kept, trimmed = [], []
+    for entry in entries:
+        if entry['end'] <= deadline:
+            kept.append(entry)
+            continue
+        minutes = int((deadline - entry['start']).total_seconds() // 60)
+        trimmed.append((entry['zone'], entry['duration'], max(minutes, 0)))
+        if minutes >= 1:
+            kept.append(dict(entry, duration=minutes, end=entry['start'] + timedelta(minutes=minutes)))
+    return kept, trimmed
+
+
+def watered_minutes(plan):
+    """{zone: minutes} the plan's entries will actually run, after any trim"""
+    minutes = {}
+    for entry in plan['entries']:
+        minutes[entry['zone']] = minutes.get(entry['zone'], 0) + entry['duration']
+    return minutes
+
+
+def format_plan(plan):
+    """Human readable plan for logs and the CLI"""
+    lines = [f"Watering plan {plan['start']:%Y-%m-%d %H:%M} - {plan['end']:%H:%M}"
+             f" ({(plan['end'] - plan['start']).total_seconds() / 60:.0f} min)"]
+    for entry in plan['entries']:
+        flow = f", {entry['flow_gpm']:g} GPM" if entry['flow_gpm'] else ""
+        lines.append(f"  {entry['start']:%H:%M:%S}-{entry['end']:%H:%M:%S} "
+                     f"{entry['zone']} for {entry['duration']} minutes{flow}")
+    if plan['done_by'] and not plan['feasible']:
+        cuts = ", ".join(f"{zone} {planned} -> {kept} min" if kept else f"{zone} skipped"
+                         for zone, planned, kept in plan.get('trimmed', []))
+        lines.append(f"  WARNING: would finish after the {plan['done_by']:%H:%M} deadline; trimmed {cuts}")
+    return "\n".join(lines)
+
+
+def execute_plan(plan, controller, reason="scheduled"):
+    """Queue every plan entry on a ValveController; returns the run ids"""
+    if plan['done_by'] and not plan['feasible']:
+        logging.warning(f"Watering plan trimmed to the {plan['done_by']:%H:%M} deadline: "
+                        f"{len(plan.get('trimmed', []))} runs cut")
+
+    offset = controller.clock() - plan['start'].timestamp()
+    return [
+        controller.queue_run(entry['valve_idx'], entry['start'].timestamp() + offset,
+                             entry['duration'], reason)
+        for entry in plan['entries']
+    ]